@@ -1,3 +1,4 @@
+import json
 from collections import OrderedDict
 
 import swapper
@@ -8,6 +9,8 @@ from rest_framework import serializers
 from openwisp_users.api.mixins import FilterSerializerByOrgManaged
 from openwisp_utils.api.serializers import ValidatedModelSerializer
 
+from .. import settings as app_settings
+
 Node = swapper.load_model("topology", "Node")
 Link = swapper.load_model("topology", "Link")
 Topology = swapper.load_model("topology", "Topology")
@@ -42,12 +45,14 @@ def get_representation_data(obj):
     Returns a dict that represents
     a NetJSON NetworkGraph object.
     """
-    nodes = []
-    links = []
-    for link in obj.get_links_queryset():
-        links.append(link.json(dict=True, original=False))
-    for node in obj.get_nodes_queryset():
-        nodes.append(node.json(dict=True, original=False))
+    if app_settings.CACHE_TIMEOUT:
+        # nodes and links are taken from the cached representation
+        graph = json.loads(obj.json())
+    else:
+        # not cached: the representation is not serialized for nothing
+        graph = obj.json(dict=True)
+    nodes = graph["nodes"]
+    links = graph["links"]
     netjson = OrderedDict(
         (
             ("type", "NetworkGraph"),
@@ -107,7 +112,7 @@ class NetworkGraphSerializer(BaseSerializer):
                 self.instance, context={"request": self.context["request"]}
             )
             return serializer.data
-        return obj.json(dict=True)
+        return json.loads(obj.json(), object_pairs_hook=OrderedDict)
 
     class Meta:
         model = Topology
@@ -1,8 +1,13 @@
 import json
 import logging
+from hashlib import md5
 
 import swapper
-from django.core.exceptions import ValidationError
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.http import http_date
+from django.utils.timezone import is_naive, make_aware
 from django.utils.translation import gettext_lazy as _
 from django_filters.rest_framework import DjangoFilterBackend
 from netdiff.exceptions import NetdiffException
@@ -18,7 +23,7 @@ from openwisp_users.api.permissions import DjangoModelPermissions, IsOrganizatio
 from openwisp_utils.api.pagination import OpenWispPagination
 
 from .. import settings as app_settings
-from ..utils import get_object_or_404
+from ..utils import get_graph_delta, get_object_or_404
 from .filters import LinkFilter, NetworkCollectionFilter, NodeFilter
 from .parsers import TextParser
 from .serializers import (
@@ -57,10 +62,60 @@ class UnpublishedTopologyFilterMixin:
         return qs.filter(published=True)
 
 
+class ConditionalGetMixin:
+    """
+    Adds ``ETag`` and ``Last-Modified`` headers to the responses
+    and returns ``304 Not Modified`` to conditional requests
+    when the requested topologies have not changed
+    """
+
+    def get_etag(self, request, topologies):
+        values = []
+        for topology in topologies:
+            revision = topology.get_graph_revision()
+            # the revision is not available without cache
+            if revision is None:
+                return None
+            values.append(f"{topology.pk}:{revision}")
+        # the representation depends also on the format,
+        # on the filters and on the host (receive_url)
+        values += [
+            request.accepted_renderer.format,
+            request.get_full_path(),
+            request.get_host(),
+        ]
+        return '"{0}"'.format(md5("|".join(values).encode()).hexdigest())
+
+    def get_last_modified(self, topologies):
+        # deletions and changes of related objects (e.g. the name
+        # of a device used as label) do not update any "modified"
+        # field, the date of the last revision bump is used instead
+        dates = [topology.get_graph_modified() for topology in topologies]
+        if not dates or None in dates:
+            return None
+        return max(dates)
+
+    def get_conditional_response(self, request, topologies, get_response):
+        etag = self.get_etag(request, topologies)
+        if etag is None:
+            return get_response()
+        last_modified = self.get_last_modified(topologies)
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            response = get_response()
+        response["ETag"] = etag
+        if last_modified:
+            response["Last-Modified"] = http_date(last_modified)
+        return response
+
+
 class NetworkCollectionView(
     UnpublishedTopologyFilterMixin,
     RequireAuthentication,
     FilterByOrganizationManaged,
+    ConditionalGetMixin,
     generics.ListCreateAPIView,
 ):
     """
@@ -75,7 +130,14 @@ class NetworkCollectionView(
 
     def list(self, request, *args, **kwargs):
         self.check_permissions(request)
-        return super().list(request, *args, **kwargs)
+        if self.paginator is not None or not app_settings.CACHE_TIMEOUT:
+            return super().list(request, *args, **kwargs)
+        topologies = list(self.filter_queryset(self.get_queryset()))
+        return self.get_conditional_response(
+            request,
+            topologies,
+            lambda: Response(self.get_serializer(topologies, many=True).data),
+        )
 
     def get_success_headers(self, data):
         """
@@ -89,6 +151,7 @@ class NetworkGraphView(
     UnpublishedTopologyFilterMixin,
     RequireAuthentication,
     FilterByOrganizationManaged,
+    ConditionalGetMixin,
     generics.RetrieveUpdateDestroyAPIView,
 ):
     """
@@ -99,6 +162,16 @@ class NetworkGraphView(
     serializer_class = NetworkGraphUpdateSerializer
     queryset = Topology.objects.select_related("organization")
 
+    def retrieve(self, request, *args, **kwargs):
+        if not app_settings.CACHE_TIMEOUT:
+            return super().retrieve(request, *args, **kwargs)
+        topology = self.get_object()
+        return self.get_conditional_response(
+            request,
+            [topology],
+            lambda: Response(self.get_serializer(topology).data),
+        )
+
 
 class ReceiveTopologyView(APIView):
     """
@@ -134,6 +207,9 @@ class ReceiveTopologyView(APIView):
         validation_response = self._validate_request(request, topology)
         if validation_response:
             return validation_response
+        # parsing and diffing identical data is avoided
+        if topology.is_unchanged(request.data):
+            return Response({"detail": _("data unchanged, skipped")})
         try:
             topology.receive(request.data)
         except NetdiffException as e:
@@ -157,25 +233,86 @@ class NetworkGraphHistoryView(RequireAuthentication):
     snapshot_model = Snapshot
     queryset = topology_model.objects.all()  # Required for DjangoModelPermissions
 
-    def get(self, request, pk, format=None):
-        topology = get_object_or_404(self.topology_model, pk)
-        self.check_object_permissions(request, topology)
-        date = request.query_params.get("date")
-        options = dict(topology=topology, date=date)
+    def get_snapshot(self, topology, date, param="date"):
+        """
+        returns the snapshot of ``topology`` saved at ``date``
+        or the error ``Response`` if it cannot be found
+        """
         # missing date: 400
         if not date:
             return Response(
-                {"detail": _('missing required "date" parameter')}, status=400
+                {"detail": _('missing required "%s" parameter') % param}, status=400
             )
+        queryset = self.snapshot_model.objects.filter(topology=topology)
         try:
-            s = self.snapshot_model.objects.get(**options)
-            return Response(json.loads(s.data))
-        except self.snapshot_model.DoesNotExist:
+            # a date returns the last snapshot of that day,
+            # a timestamp the last snapshot saved until then
+            day = parse_date(date)
+            timestamp = None if day else parse_datetime(date)
+        except ValueError:
+            day = timestamp = None
+        if day:
+            queryset = queryset.filter(date=day)
+        elif timestamp:
+            if is_naive(timestamp):
+                timestamp = make_aware(timestamp)
+            queryset = queryset.filter(timestamp__lte=timestamp)
+        else:
+            return Response({"detail": _("invalid date supplied")}, status=403)
+        s = queryset.order_by("-timestamp").first()
+        if s is None:
             return Response(
                 {"detail": _("no snapshot found for this date")}, status=404
             )
-        except ValidationError:
-            return Response({"detail": _("invalid date supplied")}, status=403)
+        return s
+
+    def get(self, request, pk, format=None):
+        topology = get_object_or_404(self.topology_model, pk)
+        self.check_object_permissions(request, topology)
+        s = self.get_snapshot(topology, request.query_params.get("date"))
+        if isinstance(s, Response):
+            return s
+        return Response(json.loads(s.json()))
+
+
+class NetworkGraphHistoryDiffView(NetworkGraphHistoryView):
+    """
+    Changes of a specific topology between two
+    snapshots, returned in the format of ``get_graph_delta``.
+    """
+
+    def get(self, request, pk, format=None):
+        topology = get_object_or_404(self.topology_model, pk)
+        self.check_object_permissions(request, topology)
+        snapshots = []
+        for param in ["from", "to"]:
+            s = self.get_snapshot(topology, request.query_params.get(param), param)
+            if isinstance(s, Response):
+                return s
+            snapshots.append(s)
+        old, new = snapshots
+        # the snapshot of the current interval is updated until the
+        # interval is over, hence the modification dates are part of the key
+        key = "topology-history-diff-{0}-{1}-{2}-{3}".format(
+            old.pk,
+            old.modified.timestamp(),
+            new.pk,
+            new.modified.timestamp(),
+        )
+        diff = cache.get(key)
+        if diff is None:
+            delta = get_graph_delta(old.get_graph(), new.get_graph())
+            diff = {
+                "from": old.timestamp,
+                "to": new.timestamp,
+                "graph": {},
+                "added": {"nodes": [], "links": []},
+                "removed": {"nodes": [], "links": []},
+                "changed": {"nodes": [], "links": []},
+            }
+            diff.update(delta or {})
+            cache.set(key, diff, app_settings.CACHE_TIMEOUT)
+        return Response(diff)
 
 
 class NodeListCreateView(
@@ -227,6 +364,7 @@ class LinkDetailView(
 network_collection = NetworkCollectionView.as_view()
 network_graph = NetworkGraphView.as_view()
 network_graph_history = NetworkGraphHistoryView.as_view()
+network_graph_history_diff = NetworkGraphHistoryDiffView.as_view()
 receive_topology = ReceiveTopologyView.as_view()
 node_list = NodeListCreateView.as_view()
 node_detail = NodeDetailView.as_view()
@@ -15,8 +15,10 @@ class OpenwispNetworkTopologyConfig(AppConfig):
     def ready(self, *args, **kwargs):
         if SIGNALS:  # pragma: nocover
             __import__(SIGNALS)
-        from .signals import broadcast_topology, update_topology
+        from .signals import broadcast_topology, bump_graph_revision, update_topology
 
+        # the revision must be bumped before broadcasting
+        update_topology.connect(bump_graph_revision)
         update_topology.connect(broadcast_topology)
         self.register_menu_groups()
 
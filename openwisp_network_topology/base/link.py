@@ -6,8 +6,7 @@ import swapper
 from django.core.exceptions import ValidationError
 from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
-from django.db.models import JSONField, Q, TextField
-from django.db.models.functions import Cast
+from django.db.models import JSONField, Q
 from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.utils.timezone import now
@@ -20,8 +19,8 @@ from openwisp_users.mixins import ShareableOrgMixin
 from openwisp_utils.base import TimeStampedEditableModel
 
 from .. import settings as app_settings
-from ..signals import update_topology
-from ..utils import link_status_changed, print_info
+from ..signals import send_link_status_changed, send_update_topology
+from ..utils import print_info
 
 
 class AbstractLink(ShareableOrgMixin, TimeStampedEditableModel):
@@ -163,7 +162,7 @@ class AbstractLink(ShareableOrgMixin, TimeStampedEditableModel):
         return json.dumps(netjson, cls=JSONEncoder, **kwargs)
 
     def send_status_changed_signal(self):
-        link_status_changed.send(sender=self.__class__, link=self)
+        send_link_status_changed(self)
 
     @classmethod
     def get_from_nodes(cls, source, target, topology):
@@ -176,20 +175,29 @@ class AbstractLink(ShareableOrgMixin, TimeStampedEditableModel):
         :param topology: Topology instance
         :returns: Link object or None
         """
-        source_needle = '"{}"'.format(source)
-        target_needle = '"{}"'.format(target)
-        qs = cls.objects.annotate(
-            _source_addresses_text=Cast("source__addresses", output_field=TextField()),
-            _target_addresses_text=Cast("target__addresses", output_field=TextField()),
+        NodeAddress = swapper.load_model("topology", "NodeAddress")
+        Node = swapper.load_model("topology", "Node")
+        max_length = NodeAddress._meta.get_field("address").max_length
+        node_ids = {}
+        # addresses shared by more nodes resolve to the oldest node
+        for address, node_id in (
+            NodeAddress.objects.filter(topology=topology, address__in=[source, target])
+            .order_by("node__created", "node_id")
+            .values_list("address", "node_id")
+        ):
+            node_ids.setdefault(address, node_id)
+        for address in [source, target]:
+            if len(address) > max_length:
+                node = Node.get_from_address(address, topology)
+                node_ids[address] = node.pk if node else None
+        source_id = node_ids.get(source)
+        target_id = node_ids.get(target)
+        if not source_id or not target_id:
+            return None
+        q = Q(source_id=source_id, target_id=target_id) | Q(
+            source_id=target_id, target_id=source_id
         )
-        q = Q(
-            _source_addresses_text__contains=source_needle,
-            _target_addresses_text__contains=target_needle,
-        ) | Q(
-            _source_addresses_text__contains=target_needle,
-            _target_addresses_text__contains=source_needle,
-        )
-        return qs.filter(q).filter(topology=topology).first()
+        return cls.objects.filter(q).filter(topology=topology).first()
 
     @classmethod
     def delete_expired_links(cls):
@@ -219,4 +227,4 @@ class AbstractLink(ShareableOrgMixin, TimeStampedEditableModel):
 @receiver(post_save, sender=swapper.get_model_name("topology", "Link"))
 @receiver(post_delete, sender=swapper.get_model_name("topology", "Link"))
 def send_topology_signal(sender, instance, **kwargs):
-    update_topology.send(sender=sender, topology=instance.topology)
+    send_update_topology(sender, instance.topology)
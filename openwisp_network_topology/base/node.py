@@ -17,10 +17,10 @@ from django.utils.translation import gettext_lazy as _
 from rest_framework.utils.encoders import JSONEncoder
 
 from openwisp_users.mixins import ShareableOrgMixin
-from openwisp_utils.base import TimeStampedEditableModel
+from openwisp_utils.base import TimeStampedEditableModel, UUIDModel
 
 from .. import settings as app_settings
-from ..signals import update_topology
+from ..signals import send_update_topology
 from ..utils import print_info
 
 
@@ -130,20 +130,70 @@ class AbstractNode(ShareableOrgMixin, TimeStampedEditableModel):
             return netjson
         return json.dumps(netjson, cls=JSONEncoder, **kwargs)
 
+    def sync_addresses(self):
+        """
+        Keeps the rows of the address lookup table
+        in sync with the ``addresses`` of the node.
+
+        Every node indexes all its addresses, even the ones
+        shared with other nodes of the same topology, so that
+        an address dropped by one node still points to the others.
+        """
+        NodeAddress = self.address_set.model
+        max_length = NodeAddress._meta.get_field("address").max_length
+        addresses = [
+            address
+            for address in dict.fromkeys(self.addresses or [])
+            if isinstance(address, str) and len(address) <= max_length
+        ]
+        existing = {}
+        stale = []
+        for pk, address, topology_id in self.address_set.values_list(
+            "pk", "address", "topology_id"
+        ):
+            if address in addresses and topology_id == self.topology_id:
+                existing[address] = pk
+            else:
+                stale.append(pk)
+        if stale:
+            NodeAddress.objects.filter(pk__in=stale).delete()
+        missing = [
+            NodeAddress(topology_id=self.topology_id, node=self, address=address)
+            for address in addresses
+            if address not in existing
+        ]
+        if missing:
+            NodeAddress.objects.bulk_create(missing, ignore_conflicts=True)
+
+    @classmethod
+    def _filter_by_address(cls, address, topology):
+        NodeAddress = swapper.load_model("topology", "NodeAddress")
+        max_length = NodeAddress._meta.get_field("address").max_length
+        if len(address) > max_length:
+            # addresses too long to be indexed are looked up
+            # in the JSON field, which requires a full scan
+            needle = '"{}"'.format(address)
+            return (
+                cls.objects.filter(topology=topology)
+                .annotate(_addresses_text=Cast("addresses", output_field=TextField()))
+                .filter(_addresses_text__contains=needle)
+            )
+        return cls.objects.filter(
+            address_set__topology=topology, address_set__address=address
+        )
+
     @classmethod
     def get_from_address(cls, address, topology):
         """
         Find node from one of its addresses and its topology.
+        If the address is shared by more nodes,
+        the oldest node is returned.
         :param address: string
         :param topology: Topology instance
         :returns: Node object or None
         """
-        needle = '"{}"'.format(address)
         return (
-            cls.objects.filter(topology=topology)
-            .annotate(_addresses_text=Cast("addresses", output_field=TextField()))
-            .filter(_addresses_text__contains=needle)
-            .first()
+            cls._filter_by_address(address, topology).order_by("created", "pk").first()
         )
 
     @classmethod
@@ -154,13 +204,7 @@ class AbstractNode(ShareableOrgMixin, TimeStampedEditableModel):
         :param topology: Topology instance
         :returns: int
         """
-        needle = '"{}"'.format(address)
-        return (
-            cls.objects.filter(topology=topology)
-            .annotate(_addresses_text=Cast("addresses", output_field=TextField()))
-            .filter(_addresses_text__contains=needle)
-            .count()
-        )
+        return cls._filter_by_address(address, topology).count()
 
     @classmethod
     def delete_expired_nodes(cls):
@@ -193,7 +237,48 @@ class AbstractNode(ShareableOrgMixin, TimeStampedEditableModel):
         return qs.select_related("organization", "topology")
 
 
+class AbstractNodeAddress(UUIDModel):
+    """
+    Lookup table which maps every address of a node
+    to the node itself, allows to find nodes from
+    their addresses with an index seek
+    """
+
+    topology = models.ForeignKey(
+        swapper.get_model_name("topology", "Topology"),
+        on_delete=models.CASCADE,
+        related_name="+",
+    )
+    node = models.ForeignKey(
+        swapper.get_model_name("topology", "Node"),
+        on_delete=models.CASCADE,
+        related_name="address_set",
+    )
+    address = models.CharField(_("address"), max_length=255)
+
+    class Meta:
+        abstract = True
+        verbose_name = _("node address")
+        verbose_name_plural = _("node addresses")
+        unique_together = ("node", "address")
+        indexes = [models.Index(fields=["topology", "address"])]
+
+    def __str__(self):
+        return self.address
+
+
+@receiver(post_save, sender=swapper.get_model_name("topology", "Node"))
+def sync_node_addresses(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not {
+        "addresses",
+        "topology",
+        "topology_id",
+    }.intersection(update_fields):
+        return
+    instance.sync_addresses()
+
+
 @receiver(post_save, sender=swapper.get_model_name("topology", "Node"))
 @receiver(post_delete, sender=swapper.get_model_name("topology", "Node"))
 def send_topology_signal(sender, instance, **kwargs):
-    update_topology.send(sender=sender, topology=instance.topology)
+    send_update_topology(sender, instance.topology)
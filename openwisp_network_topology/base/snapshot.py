@@ -1,9 +1,29 @@
+import json
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from itertools import islice
+
 import swapper
-from django.db import models
+from django.db import models, transaction
+from django.utils.timezone import localdate, localtime, make_aware, now
 from django.utils.translation import gettext_lazy as _
+from rest_framework.utils.encoders import JSONEncoder
 
 from openwisp_utils.base import TimeStampedEditableModel
 
+from .. import settings as app_settings
+from ..utils import (
+    COMPRESSION_PREFIX,
+    apply_graph_delta,
+    compress,
+    decompress,
+    get_graph_delta,
+    is_compressed,
+)
+
+# snapshot intervals are counted from the local midnight of this date
+LOCAL_EPOCH = datetime(1970, 1, 1)
+
 
 class AbstractSnapshot(TimeStampedEditableModel):
     """
@@ -15,6 +35,15 @@ class AbstractSnapshot(TimeStampedEditableModel):
     )
     data = models.TextField(blank=False)
     date = models.DateField(auto_now=True)
+    timestamp = models.DateTimeField(_("timestamp"), default=now, db_index=True)
+    keyframe = models.BooleanField(
+        _("keyframe"),
+        default=True,
+        help_text=_(
+            "whether the whole graph is stored or only "
+            "the changes since the previous snapshot"
+        ),
+    )
 
     class Meta:
         verbose_name_plural = _("snapshots")
@@ -22,3 +51,234 @@ class AbstractSnapshot(TimeStampedEditableModel):
 
     def __str__(self):
         return "{0}: {1}".format(self.topology.label, self.date)
+
+    def save(self, *args, **kwargs):
+        # the data is stored compressed
+        if not is_compressed(self.data):
+            self.data = compress(self.data)
+        return super().save(*args, **kwargs)
+
+    def json(self):
+        """
+        returns the NetJSON NetworkGraph of the snapshot
+        """
+        if self.keyframe:
+            return decompress(self.data)
+        return json.dumps(self.get_graph(), cls=JSONEncoder)
+
+    def get_graph(self, previous_graph=None):
+        """
+        returns the NetJSON NetworkGraph dict of the snapshot, the graph
+        of delta snapshots is reconstructed by applying the deltas
+        saved since the nearest keyframe, unless the graph of the
+        previous snapshot is supplied in ``previous_graph``
+        """
+        if self.keyframe:
+            return json.loads(decompress(self.data), object_pairs_hook=OrderedDict)
+        if previous_graph is not None:
+            return apply_graph_delta(previous_graph, self.get_delta())
+        snapshots = self.topology.snapshot_set.filter(timestamp__lte=self.timestamp)
+        keyframe = snapshots.filter(keyframe=True).order_by("-timestamp").first()
+        graph = keyframe.get_graph() if keyframe else OrderedDict()
+        deltas = snapshots.filter(keyframe=False)
+        if keyframe:
+            deltas = deltas.filter(timestamp__gt=keyframe.timestamp)
+        for snapshot in deltas.order_by("timestamp"):
+            graph = apply_graph_delta(graph, snapshot.get_delta())
+        return graph
+
+    def get_delta(self):
+        """
+        returns the delta stored in a delta snapshot
+        (``None`` if the graph did not change)
+        """
+        return json.loads(decompress(self.data), object_pairs_hook=OrderedDict)
+
+    def set_data(self, data):
+        """
+        sets the NetJSON NetworkGraph ``data`` of the snapshot: when
+        ``OPENWISP_NETWORK_TOPOLOGY_SNAPSHOT_KEYFRAME_INTERVAL`` is set,
+        the whole graph is stored only if the last keyframe is at least
+        that many days old, otherwise only the delta with the previous
+        snapshot is stored
+        """
+        self.data = data
+        self.keyframe = True
+        interval = app_settings.SNAPSHOT_KEYFRAME_INTERVAL
+        if not interval:
+            return
+        previous = self.topology.snapshot_set.filter(
+            timestamp__lt=self.timestamp
+        ).exclude(pk=self.pk)
+        keyframe = previous.filter(keyframe=True).order_by("-timestamp").first()
+        if (
+            not keyframe
+            or (self.timestamp.date() - keyframe.timestamp.date()).days >= interval
+        ):
+            return
+        previous = previous.order_by("-timestamp").first()
+        delta = get_graph_delta(previous.get_graph(), json.loads(data))
+        self.data = json.dumps(delta, cls=JSONEncoder)
+        self.keyframe = False
+
+    @staticmethod
+    def get_interval_start(timestamp):
+        """
+        returns the beginning of the interval of ``timestamp``
+        (see ``OPENWISP_NETWORK_TOPOLOGY_SNAPSHOT_INTERVAL``),
+        intervals are aligned to the local midnight like ``date``
+        """
+        interval = app_settings.SNAPSHOT_INTERVAL
+        # wall clock time: intervals are not shifted by DST changes
+        elapsed = localtime(timestamp).replace(tzinfo=None) - LOCAL_EPOCH
+        start = elapsed.total_seconds() // interval * interval
+        return make_aware(LOCAL_EPOCH + timedelta(seconds=start))
+
+    @classmethod
+    def bulk_save(cls, snapshots):
+        """
+        saves ``snapshots`` with one query for the new snapshots
+        and one for the existing ones (``save`` is not called)
+        """
+        new = []
+        existing = []
+        for snapshot in snapshots:
+            if not is_compressed(snapshot.data):
+                snapshot.data = compress(snapshot.data)
+            # auto_now fields are not updated by bulk_update()
+            snapshot.modified = snapshot.timestamp
+            snapshot.date = localdate(snapshot.timestamp)
+            if snapshot._state.adding:
+                new.append(snapshot)
+            else:
+                existing.append(snapshot)
+        with transaction.atomic():
+            cls.objects.bulk_create(new)
+            cls.objects.bulk_update(
+                existing, ["data", "keyframe", "timestamp", "date", "modified"]
+            )
+
+    @staticmethod
+    def get_retention_bucket(timestamp, current_time, retention):
+        """
+        returns the retention tier in which ``timestamp`` falls and
+        the interval of that tier which contains it, ``None`` if
+        ``timestamp`` is older than all the tiers
+        """
+        for index, (max_age, interval) in enumerate(retention):
+            if max_age is None or current_time - timestamp < timedelta(seconds=max_age):
+                return index, int(timestamp.timestamp() // interval)
+        return None
+
+    @classmethod
+    def prune(cls, topology, retention=None):
+        """
+        downsamples the snapshots of ``topology`` according to
+        ``OPENWISP_NETWORK_TOPOLOGY_SNAPSHOT_RETENTION``: only the
+        latest snapshot of each interval of a retention tier is kept
+        and the deltas of the snapshots which followed the deleted
+        ones are recomputed; returns the number of deleted snapshots
+        """
+        if retention is None:
+            retention = app_settings.SNAPSHOT_RETENTION
+        if not retention:
+            return 0
+        current_time = now()
+        # the data is loaded only for the snapshots which need it
+        snapshots = list(
+            topology.snapshot_set.order_by("timestamp").only(
+                "id", "timestamp", "keyframe"
+            )
+        )
+        buckets = {}
+        for snapshot in snapshots:
+            bucket = cls.get_retention_bucket(
+                snapshot.timestamp, current_time, retention
+            )
+            if bucket is not None:
+                buckets[bucket] = snapshot.pk
+        kept = set(buckets.values())
+        if len(kept) == len(snapshots):
+            return 0
+        updated = cls._rebase_deltas(topology, snapshots, kept)
+        with transaction.atomic():
+            deleted, _ = (
+                topology.snapshot_set.filter(pk__in=[s.pk for s in snapshots])
+                .exclude(pk__in=kept)
+                .delete()
+            )
+            cls.objects.bulk_update(updated, ["data", "keyframe"])
+        return deleted
+
+    @classmethod
+    def _rebase_deltas(cls, topology, snapshots, kept):
+        """
+        recomputes the deltas of the ``kept`` delta snapshots which follow
+        deleted ones, returns the snapshots which have been modified;
+        the graphs are reconstructed starting from the keyframe which
+        precedes the first of these snapshots (and the last snapshot
+        kept before it) up to the last of them
+        """
+        start = end = previous = None
+        gap = False
+        for index, snapshot in enumerate(snapshots):
+            if snapshot.pk not in kept:
+                gap = True
+                continue
+            if gap and not snapshot.keyframe:
+                if start is None:
+                    start = previous if previous is not None else 0
+                end = index + 1
+            gap = False
+            previous = index
+        if start is None:
+            return []
+        while start > 0 and not snapshots[start].keyframe:
+            start -= 1
+        chain = snapshots[start:end]
+        data = dict(
+            topology.snapshot_set.filter(pk__in=[s.pk for s in chain]).values_list(
+                "id", "data"
+            )
+        )
+        updated = []
+        graph = OrderedDict()
+        kept_graph = None
+        gap = False
+        for snapshot in chain:
+            snapshot.data = data[snapshot.pk]
+            graph = snapshot.get_graph(previous_graph=graph)
+            if snapshot.pk not in kept:
+                gap = True
+                continue
+            if gap and not snapshot.keyframe:
+                if kept_graph is None:
+                    snapshot.data = json.dumps(graph, cls=JSONEncoder)
+                    snapshot.keyframe = True
+                else:
+                    delta = get_graph_delta(kept_graph, graph)
+                    snapshot.data = json.dumps(delta, cls=JSONEncoder)
+                snapshot.data = compress(snapshot.data)
+                updated.append(snapshot)
+            gap = False
+            kept_graph = graph
+        return updated
+
+    @classmethod
+    def compress_all(cls, chunk_size=100):
+        """
+        compresses the snapshots which have been stored uncompressed
+        (by previous versions), ``chunk_size`` snapshots at a time;
+        yields the number of snapshots compressed after each chunk
+        """
+        queryset = cls.objects.exclude(data__startswith=COMPRESSION_PREFIX)
+        pks = iter(list(queryset.values_list("pk", flat=True)))
+        chunk = list(islice(pks, chunk_size))
+        while chunk:
+            snapshots = list(cls.objects.filter(pk__in=chunk).only("id", "data"))
+            for snapshot in snapshots:
+                snapshot.data = compress(snapshot.data)
+            # "modified" is left unchanged
+            cls.objects.bulk_update(snapshots, ["data"])
+            yield len(snapshots)
+            chunk = list(islice(pks, chunk_size))
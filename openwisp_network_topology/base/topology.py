@@ -1,10 +1,15 @@
 import json
 from collections import OrderedDict
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+from functools import partial
+from hashlib import md5
+from time import perf_counter, time, time_ns
 
 import swapper
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import connection, models, transaction
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.urls import reverse
@@ -18,11 +23,20 @@ from rest_framework.utils.encoders import JSONEncoder
 from openwisp_users.mixins import ShareableOrgMixin
 from openwisp_utils.base import KeyField, TimeStampedEditableModel
 
+from .. import settings as app_settings
 from ..contextmanagers import log_failure
 from ..settings import PARSERS, TIMEOUT
-from ..signals import update_topology
+from ..signals import defer_topology_signals, nodes_created, send_update_topology
 from ..tasks import handle_update_topology
-from ..utils import print_info
+from ..utils import (
+    GraphResolver,
+    encode_diff,
+    get_graph_fingerprint,
+    get_link_digest,
+    get_link_key,
+    get_node_digest,
+    print_info,
+)
 
 STRATEGIES = (("fetch", _("FETCH")), ("receive", _("RECEIVE")))
 
@@ -119,8 +133,12 @@ class AbstractTopology(ShareableOrgMixin, TimeStampedEditableModel):
         """
         gets latest topology data
         """
-        # if data is ``None`` it will be fetched from ``self.url``
-        latest = self.parser_class(data=data, url=self.url, timeout=TIMEOUT)
+        # data may have been fetched and parsed already (``update_all``)
+        if isinstance(data, self.parser_class):
+            latest = data
+        else:
+            # if data is ``None`` it will be fetched from ``self.url``
+            latest = self.parser_class(data=data, url=self.url, timeout=TIMEOUT)
         # update topology attributes if needed
         changed = False
         for attr in ["protocol", "version", "metric"]:
@@ -140,17 +158,216 @@ class AbstractTopology(ShareableOrgMixin, TimeStampedEditableModel):
             latest = data
         else:
             latest = self.get_topology_data(data)
+        fingerprint = self._get_fingerprint()
+        if fingerprint is not None:
+            return self._fingerprint_diff(fingerprint, latest)
+        # read before loading the graph: writes happening
+        # in the meantime will invalidate the fingerprint
+        revision = self.get_graph_revision() if app_settings.CACHE_TIMEOUT else None
         current = NetJsonParser(self.json(dict=True, omit_down=True, original=True))
+        if revision is not None:
+            fingerprint = get_graph_fingerprint(current.json(dict=True))
+            fingerprint["revision"] = revision
+            # never refreshed: writes which do not bump the revision
+            # cannot make diffs stale for longer than the timeout
+            fingerprint["expires"] = time() + app_settings.CACHE_TIMEOUT
+            cache.set(self._fingerprint_key, fingerprint, app_settings.CACHE_TIMEOUT)
         return diff(current, latest)
 
+    @property
+    def _fingerprint_key(self):
+        return f"topology-fingerprint-{self.pk}"
+
+    def _get_fingerprint(self):
+        """
+        returns the content hashes of the nodes and links stored
+        in the database the last time a diff has been computed,
+        or ``None`` if the graph has been modified since then
+        """
+        if not app_settings.CACHE_TIMEOUT:
+            return None
+        fingerprint = cache.get(self._fingerprint_key)
+        if fingerprint is None:
+            return None
+        if fingerprint["revision"] != self.get_graph_revision():
+            return None
+        return fingerprint
+
+    def _fingerprint_diff(self, fingerprint, latest):
+        """
+        same as ``netdiff.diff``, but compares ``latest`` with the
+        fingerprint of the graph stored in the database: only the
+        removed items, if any, are loaded from the database
+        """
+        netjson = latest.json(dict=True)
+        nodes = dict(fingerprint["nodes"])
+        links = dict(fingerprint["links"])
+        added = {"nodes": [], "links": []}
+        changed = {"nodes": [], "links": []}
+        for node in netjson["nodes"]:
+            digest = nodes.pop(node["id"], None)
+            if digest is None:
+                added["nodes"].append(node)
+            elif digest != get_node_digest(node):
+                changed["nodes"].append(node)
+        for link in netjson["links"]:
+            digest = links.pop(get_link_key(link), None)
+            if digest is None:
+                added["links"].append(link)
+            elif digest != get_link_digest(link):
+                changed["links"].append(link)
+        removed = self._get_removed_items(nodes, links)
+
+        def section(items):
+            if not (items["nodes"] or items["links"]):
+                return None
+            return OrderedDict(
+                (
+                    ("type", "NetworkGraph"),
+                    ("protocol", latest.protocol),
+                    ("version", latest.version),
+                    ("revision", latest.revision),
+                    ("metric", latest.metric),
+                    ("nodes", sorted(items["nodes"], key=lambda d: d["id"])),
+                    (
+                        "links",
+                        sorted(
+                            items["links"], key=lambda d: (d["source"], d["target"])
+                        ),
+                    ),
+                )
+            )
+
+        return OrderedDict(
+            (
+                ("added", section(added)),
+                ("removed", section(removed)),
+                ("changed", section(changed)),
+            )
+        )
+
+    def _get_removed_items(self, node_ids, link_keys):
+        """
+        loads the nodes and the links (which are up) identified by
+        ``node_ids`` and ``link_keys`` from the database and
+        returns them as ``netdiff`` would do
+        """
+        removed = {"nodes": [], "links": []}
+        if not (node_ids or link_keys):
+            return removed
+        addresses = set(node_ids)
+        for key in link_keys:
+            addresses.update(key)
+        nodes = {
+            node.pk: node
+            for node in self.node_set.filter(
+                address_set__topology=self, address_set__address__in=addresses
+            ).distinct()
+        }
+        links = []
+        if link_keys:
+            for link in self.link_set.filter(
+                status="up", source_id__in=nodes, target_id__in=nodes
+            ):
+                link.source = nodes[link.source_id]
+                link.target = nodes[link.target_id]
+                links.append(link)
+        # normalized by the parser, as it happens with the whole graph
+        netjson = NetJsonParser(
+            {
+                "type": "NetworkGraph",
+                "protocol": self.protocol,
+                "version": self.version,
+                "metric": self.metric,
+                "nodes": [
+                    node.json(dict=True, original=True) for node in nodes.values()
+                ],
+                "links": [link.json(dict=True, original=True) for link in links],
+            }
+        ).json(dict=True)
+        for node in netjson["nodes"]:
+            if node["id"] in node_ids:
+                removed["nodes"].append(node)
+        for link in netjson["links"]:
+            if get_link_key(link) in link_keys:
+                removed["links"].append(link)
+        return removed
+
     def get_nodes_queryset(self):
         return self.node_set.all()
 
     def get_links_queryset(self):
         return self.link_set.select_related("source", "target")
 
+    def get_graph_revision(self):
+        """
+        returns the revision of the graph, which is bumped on
+        any write of the topology, its nodes or its links;
+        returns ``None`` if the cache is not available
+        """
+        if not app_settings.CACHE_TIMEOUT:
+            return None
+        key = f"topology-revision-{self.pk}"
+        revision = cache.get(key)
+        if revision is None:
+            # initialized with a value which cannot have been used before
+            cache.add(key, time_ns(), None)
+            revision = cache.get(key)
+        return revision
+
+    @property
+    def _graph_modified_key(self):
+        return f"topology-revision-modified-{self.pk}"
+
+    def get_graph_modified(self):
+        """
+        returns the UNIX timestamp (in seconds) of the last change
+        of the graph, which is updated whenever its revision is bumped;
+        returns ``None`` if the cache is not available
+        """
+        if not app_settings.CACHE_TIMEOUT:
+            return None
+        key = self._graph_modified_key
+        modified = cache.get(key)
+        if modified is None:
+            # the last change is not known: it's assumed to be now
+            cache.add(key, int(time()), None)
+            modified = cache.get(key)
+        return modified
+
+    def bump_graph_revision(self):
+        """
+        invalidates the cached representations of the graph
+        """
+        key = f"topology-revision-{self.pk}"
+
+        def bump():
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.add(key, time_ns(), None)
+            cache.set(self._graph_modified_key, int(time()), None)
+
+        bump()
+        # bumped again on commit, concurrent readers may
+        # have cached the data which was not committed yet
+        transaction.on_commit(bump)
+
     def json(self, dict=False, omit_down=False, original=False, **kwargs):
         """returns a dict that represents a NetJSON NetworkGraph object"""
+        if dict or omit_down or original or kwargs or not app_settings.CACHE_TIMEOUT:
+            return self._json(dict, omit_down, original, **kwargs)
+        revision = self.get_graph_revision()
+        if revision is None:
+            return self._json(dict, omit_down, original, **kwargs)
+        key = f"topology-json-{self.pk}-{revision}"
+        data = cache.get(key)
+        if data is None:
+            data = self._json()
+            cache.set(key, data, app_settings.CACHE_TIMEOUT)
+        return data
+
+    def _json(self, dict=False, omit_down=False, original=False, **kwargs):
         nodes = []
         links = []
         links_queryset = self.get_links_queryset()
@@ -193,14 +410,15 @@ class AbstractTopology(ShareableOrgMixin, TimeStampedEditableModel):
         link = self.link_model(**options)
         return link
 
-    def _update_added_items(self, items):
-        Link, Node = self.link_model, self.node_model
+    def _update_added_items(self, items, resolver=None):
+        resolver = resolver or GraphResolver(self)
 
         for node_dict in items.get("nodes", []):
             # if node exists, update its properties
-            node = Node.get_from_address(node_dict["id"], topology=self)
+            node = resolver.get_node(node_dict["id"])
             if node:
                 self._update_node_properties(node, node_dict, section="added")
+                resolver.add_node(node)
                 continue
             # if node doesn't exist create new
             addresses = [node_dict["id"]]
@@ -212,18 +430,17 @@ class AbstractTopology(ShareableOrgMixin, TimeStampedEditableModel):
             )
             node.full_clean()
             node.save()
+            resolver.add_node(node)
 
         for link_dict in items.get("links", []):
-            link = Link.get_from_nodes(
-                link_dict["source"], link_dict["target"], topology=self
-            )
+            link = resolver.get_link(link_dict["source"], link_dict["target"])
             # if link exists, update its properties
             if link:
                 self._update_link_properties(link, link_dict, section="added")
                 continue
             # if link does not exist create new
-            source = Node.get_from_address(link_dict["source"], self)
-            target = Node.get_from_address(link_dict["target"], self)
+            source = resolver.get_node(link_dict["source"])
+            target = resolver.get_node(link_dict["target"])
             link = self._create_link(
                 source=source,
                 target=target,
@@ -234,100 +451,308 @@ class AbstractTopology(ShareableOrgMixin, TimeStampedEditableModel):
             )
             link.full_clean()
             link.save()
+            resolver.add_link(link)
 
-    def _update_node_properties(self, node, node_dict, section):
-        changed = False
+    def _set_node_properties(self, node, node_dict):
+        """
+        applies the values of ``node_dict`` to ``node``,
+        returns the list of fields which have been changed
+        """
+        changed = []
         if node.label != node_dict.get("label"):
-            changed = True
+            changed.append("label")
             node.label = node_dict.get("label")
-        local_addresses = node_dict.get("local_addresses")
-        if node.addresses != local_addresses:
-            changed = True
-            node.addresses = [node_dict["id"]]
-            if local_addresses:
-                node.addresses += local_addresses
+        addresses = [node_dict["id"]] + (node_dict.get("local_addresses") or [])
+        if node.addresses != addresses:
+            changed.append("addresses")
+            node.addresses = addresses
         if node.properties != node_dict.get("properties"):
-            changed = True
+            changed.append("properties")
             node.properties = node_dict.get("properties")
+        return changed
+
+    def _set_link_properties(self, link, link_dict, section):
+        """
+        applies the values of ``link_dict`` to ``link``,
+        returns the list of fields which have been changed
+        """
+        changed = []
+        # if status of link is changed
+        if self.link_status_changed(link, self.status[section]):
+            link.status = self.status[section]
+            changed.append("status")
+        for attr in ["cost", "cost_text", "properties"]:
+            if getattr(link, attr) != link_dict.get(attr):
+                setattr(link, attr, link_dict.get(attr))
+                changed.append(attr)
+        return changed
+
+    def _update_node_properties(self, node, node_dict, section):
         # perform writes only if needed
-        if changed:
+        if self._set_node_properties(node, node_dict):
             with log_failure(self.action[section], node):
                 node.full_clean()
                 node.save()
 
     def _update_link_properties(self, link, link_dict, section):
-        changed = False
-        # if status of link is changed
-        if self.link_status_changed(link, self.status[section]):
-            link.status = self.status[section]
-            changed = True
-        if link.cost != link_dict.get("cost"):
-            link.cost = link_dict.get("cost")
-            changed = True
-        if link.cost_text != link_dict.get("cost_text"):
-            link.cost_text = link_dict.get("cost_text")
-            changed = True
-        if link.properties != link_dict.get("properties"):
-            link.properties = link_dict.get("properties")
-            changed = True
         # perform writes only if needed
-        if changed:
+        if self._set_link_properties(link, link_dict, section):
             with log_failure(self.action[section], link):
                 link.full_clean()
                 link.save()
 
-    def _update_changed_items(self, items, section="changed"):
-        Link, Node = self.link_model, self.node_model
+    def _update_changed_items(self, items, section="changed", resolver=None):
+        resolver = resolver or GraphResolver(self)
         for node_dict in items.get("nodes", []):
-            node = Node.get_from_address(node_dict["id"], topology=self)
+            node = resolver.get_node(node_dict["id"])
             if node:
                 self._update_node_properties(node, node_dict, section=section)
+                resolver.add_node(node)
 
         for link_dict in items.get("links", []):
-            link = Link.get_from_nodes(
-                link_dict["source"], link_dict["target"], topology=self
-            )
+            link = resolver.get_link(link_dict["source"], link_dict["target"])
             if link:
                 self._update_link_properties(link, link_dict, section=section)
 
     def update_topology(self, diff):
+        """
+        applies ``diff`` in a single transaction, the signals
+        are sent once the transaction is committed
+        """
+        if not (diff["added"] or diff["changed"] or diff["removed"]):
+            return
+        with transaction.atomic(), defer_topology_signals(self):
+            self._update_topology(diff)
+
+    def _update_topology(self, diff):
+        # nodes and links are loaded once and
+        # resolved in memory for the whole diff
+        resolver = GraphResolver(self)
+        if app_settings.BULK_UPDATE:
+            self._bulk_update_topology(diff, resolver)
+            return
         if diff["added"]:
-            self._update_added_items(diff["added"])
+            self._update_added_items(diff["added"], resolver=resolver)
         if diff["changed"]:
-            self._update_changed_items(diff["changed"])
+            self._update_changed_items(diff["changed"], resolver=resolver)
         if diff["removed"]:
-            Link = self.link_model
             for link_dict in diff["removed"].get("links", []):
-                link = Link.get_from_nodes(
-                    link_dict["source"], link_dict["target"], topology=self
-                )
+                link = resolver.get_link(link_dict["source"], link_dict["target"])
                 if link:
                     self._update_link_properties(link, link_dict, section="removed")
 
+    @staticmethod
+    def _bulk_clean(instance):
+        """
+        validates ``instance`` without hitting the database:
+        relations are resolved in memory and primary keys
+        are generated by the application
+        """
+        exclude = [f.name for f in instance._meta.concrete_fields if f.is_relation]
+        instance.full_clean(exclude=exclude, validate_unique=False)
+
+    def _bulk_update_topology(self, diff, resolver):
+        """
+        applies ``diff`` with a constant number of write queries:
+        new nodes and links are validated in batch and inserted with
+        ``bulk_create``, modified rows are written with ``bulk_update``
+        (dirty fields only); ``update_topology`` is sent only once
+        """
+        Link, Node = self.link_model, self.node_model
+        new_nodes, new_links = [], []
+        changed_nodes, changed_links = {}, {}
+        sections = [
+            ("added", diff["added"] or {}),
+            ("changed", diff["changed"] or {}),
+            # removed nodes are not deleted or modified
+            ("removed", {"links": (diff["removed"] or {}).get("links", [])}),
+        ]
+        for section, items in sections:
+            for node_dict in items.get("nodes", []):
+                node = resolver.get_node(node_dict["id"])
+                if node is None:
+                    if section != "added":
+                        continue
+                    node = self._create_node(
+                        label=node_dict.get("label", ""),
+                        addresses=[node_dict["id"]]
+                        + node_dict.get("local_addresses", []),
+                        properties=node_dict.get("properties", {}),
+                    )
+                    # invalid items are skipped without discarding the others
+                    with log_failure(self.action[section], node):
+                        self._bulk_clean(node)
+                        new_nodes.append(node)
+                        resolver.add_node(node)
+                    continue
+                fields = self._set_node_properties(node, node_dict)
+                # nodes which are about to be created do not need an update
+                if fields and not node._state.adding:
+                    with log_failure(self.action[section], node):
+                        self._bulk_clean(node)
+                        changed_nodes.setdefault(node.pk, (node, set()))[1].update(
+                            fields
+                        )
+                        resolver.add_node(node)
+            for link_dict in items.get("links", []):
+                link = resolver.get_link(link_dict["source"], link_dict["target"])
+                if link is None:
+                    if section != "added":
+                        continue
+                    link = self._create_link(
+                        source=resolver.get_node(link_dict["source"]),
+                        target=resolver.get_node(link_dict["target"]),
+                        cost=link_dict["cost"],
+                        cost_text=link_dict["cost_text"],
+                        properties=link_dict["properties"],
+                    )
+                    with log_failure(self.action[section], link):
+                        self._bulk_clean(link)
+                        new_links.append(link)
+                        resolver.add_link(link)
+                    continue
+                fields = self._set_link_properties(link, link_dict, section)
+                if fields and not link._state.adding:
+                    with log_failure(self.action[section], link):
+                        self._bulk_clean(link)
+                        changed_links.setdefault(link.pk, (link, set()))[1].update(
+                            fields
+                        )
+        if not (new_nodes or new_links or changed_nodes or changed_links):
+            return
+        if new_nodes:
+            Node.objects.bulk_create(new_nodes)
+            self._bulk_create_addresses(new_nodes)
+        if changed_nodes:
+            self._bulk_update(Node, changed_nodes.values())
+            for node, fields in changed_nodes.values():
+                if "addresses" in fields:
+                    node.sync_addresses()
+        if new_links:
+            Link.objects.bulk_create(new_links)
+        if changed_links:
+            self._bulk_update(Link, changed_links.values(), extra=["status_changed"])
+            for link, fields in changed_links.values():
+                if link.status != link._initial_status:
+                    link.send_status_changed_signal()
+                    link._initial_status = link.status
+        if new_nodes:
+            nodes_created.send(sender=Node, topology=self, nodes=new_nodes)
+        send_update_topology(self.__class__, self)
+
+    def _bulk_create_addresses(self, nodes):
+        NodeAddress = swapper.load_model("topology", "NodeAddress")
+        max_length = NodeAddress._meta.get_field("address").max_length
+        NodeAddress.objects.bulk_create(
+            [
+                NodeAddress(topology=self, node=node, address=address)
+                for node in nodes
+                for address in dict.fromkeys(node.addresses)
+                if isinstance(address, str) and len(address) <= max_length
+            ],
+            ignore_conflicts=True,
+        )
+
+    @staticmethod
+    def _bulk_update(model, changes, extra=None):
+        """
+        writes the changed ``(instance, fields)`` pairs
+        grouping the instances which share the same dirty fields
+        """
+        timestamp = now()
+        groups = {}
+        for instance, fields in changes:
+            fields = sorted(fields) + ["modified"] + (extra or [])
+            for field in ["modified"] + (extra or []):
+                setattr(instance, field, timestamp)
+            groups.setdefault(tuple(fields), []).append(instance)
+        for fields, instances in groups.items():
+            model.objects.bulk_update(instances, fields)
+
     def update(self, data=None):
         """
         Updates topology
         Removed nodes are not deleted or modified
         Links are not deleted straightaway but set as "down"
         """
-        diff = self.diff(data)
-        handle_update_topology.delay(self.pk, diff)
+        sequence = None
+        if self.has_full_diffs:
+            # assigned before computing the diff: diffs enqueued
+            # earlier are superseded by this one
+            sequence = self.next_update_sequence()
+        diff = encode_diff(self.diff(data))
+        handle_update_topology.delay(self.pk, diff, sequence)
+
+    @property
+    def has_full_diffs(self):
+        """
+        ``True`` if each diff describes the whole graph, in which case
+        the latest diff supersedes the ones enqueued earlier; with the
+        RECEIVE strategy and an expiration time, several reporters may
+        send partial graphs of the same topology: all their diffs
+        are applied in order
+        """
+        return self.strategy == "fetch" or self.expiration_time == 0
+
+    @property
+    def _update_sequence_key(self):
+        return f"topology-update-sequence-{self.pk}"
+
+    def next_update_sequence(self):
+        """
+        returns the sequence number of a new diff of the topology,
+        diffs having a lower sequence number are not applied anymore;
+        returns ``None`` if the cache is not available
+        """
+        if not app_settings.CACHE_TIMEOUT:
+            return None
+        key = self._update_sequence_key
+        try:
+            return cache.incr(key)
+        except ValueError:
+            # initialized with a value which cannot have been used before
+            cache.add(key, time_ns(), None)
+        # incremented even if initialized by this call: concurrent
+        # callers which found the key missing get distinct numbers
+        try:
+            return cache.incr(key)
+        except ValueError:
+            # evicted in the meantime or not stored by the cache backend
+            return None
+
+    def is_update_superseded(self, sequence):
+        """
+        returns ``True`` if a diff more recent than
+        the one numbered ``sequence`` has been computed
+        """
+        if sequence is None:
+            return False
+        latest = cache.get(self._update_sequence_key)
+        return latest is not None and sequence < latest
 
     def save_snapshot(self, **kwargs):
         """
-        Saves the snapshot of topology
+        Saves the snapshot of topology, the last snapshot is
+        overwritten if it has been saved in the current interval
+        (see ``OPENWISP_NETWORK_TOPOLOGY_SNAPSHOT_INTERVAL``)
         """
         Snapshot = self.snapshot_model
-        date = datetime.now().date()
-        options = dict(topology=self, date=date)
+        timestamp = now()
+        options = dict(
+            topology=self, timestamp__gte=Snapshot.get_interval_start(timestamp)
+        )
         options.update(kwargs)
-        try:
-            s = Snapshot.objects.get(**options)
-        except Snapshot.DoesNotExist:
-            s = Snapshot(**options)
-        s.data = self.json()
+        s = Snapshot.objects.filter(**options).order_by("-timestamp").first()
+        if s is None:
+            s = Snapshot(topology=self)
+        self._prepare_snapshot(s, timestamp)
         s.save()
 
+    def _prepare_snapshot(self, snapshot, timestamp):
+        snapshot.timestamp = timestamp
+        snapshot.set_data(self.json())
+        return snapshot
+
     def link_status_changed(self, link, status):
         """
         determines if link status has changed,
@@ -356,51 +781,234 @@ class AbstractTopology(ShareableOrgMixin, TimeStampedEditableModel):
         expiration_time > 0 means:
           "if a link is missing, wait expiration_time seconds before marking it as down"
         """
+        digest = self._get_payload_digest(data)
         if self.expiration_time > 0:
             data = self.get_topology_data(data)
-            Link = self.link_model
-            netjson = data.json(dict=True)
             # update last modified date of all received links
-            for link_dict in netjson["links"]:
-                link = Link.get_from_nodes(
-                    link_dict["source"], link_dict["target"], topology=self
-                )
-                if link:
-                    link.save()
+            self._touch_links(data.json(dict=True)["links"])
         self.update(data)
+        if digest and app_settings.CACHE_TIMEOUT:
+            cache.set(
+                self._payload_key,
+                (digest, self.get_graph_revision(), now()),
+                app_settings.CACHE_TIMEOUT,
+            )
+
+    def _touch_links(self, links):
+        """
+        updates the ``modified`` field of the existing links
+        among ``links`` (NetJSON dicts) with a single update
+        query, no signal is sent for the updated links
+        """
+        keys = {get_link_key(link) for link in links}
+        addresses = set().union(*keys)
+        if not addresses:
+            return
+        rows = self.link_set.filter(
+            source__address_set__address__in=addresses,
+            target__address_set__address__in=addresses,
+        ).values_list(
+            "pk", "source__address_set__address", "target__address_set__address"
+        )
+        pks = {pk for pk, source, target in rows if frozenset((source, target)) in keys}
+        if not pks:
+            return
+        fingerprint = self._get_fingerprint()
+        self.link_set.filter(pk__in=pks).update(modified=now())
+        self.bump_graph_revision()
+        if fingerprint is not None:
+            self._carry_over_fingerprint(fingerprint)
+
+    def _carry_over_fingerprint(self, fingerprint):
+        """
+        the digests do not include the ``modified`` field of the
+        links, hence the fingerprint is still valid after the links
+        have been touched: it's moved to the revision bumped by
+        ``_touch_links`` (also on commit), keeping its original expiry;
+        it's dropped if any other write has bumped the revision
+        """
+        state = {"revision": fingerprint["revision"]}
+
+        def carry_over(increments):
+            revision = self.get_graph_revision()
+            timeout = fingerprint.get("expires", 0) - time()
+            if revision != state["revision"] + increments or timeout <= 0:
+                return
+            state["revision"] = revision
+            fingerprint["revision"] = revision
+            cache.set(self._fingerprint_key, fingerprint, timeout)
+
+        if transaction.get_connection().in_atomic_block:
+            carry_over(1)
+            # registered after the callback bumping the revision on commit
+            transaction.on_commit(partial(carry_over, 1))
+        else:
+            # the revision has already been bumped twice
+            carry_over(2)
+
+    @property
+    def _payload_key(self):
+        return f"topology-payload-{self.pk}"
+
+    @staticmethod
+    def _get_payload_digest(data):
+        if isinstance(data, bytes):
+            return md5(data).hexdigest()
+        if isinstance(data, str):
+            return md5(data.encode()).hexdigest()
+        return None
+
+    def is_unchanged(self, data):
+        """
+        returns ``True`` if ``data`` is identical to the data received
+        last time and nothing needs to be done, that is:
+        the graph has not been modified in the meantime and, if
+        ``expiration_time`` is used, received links have been
+        refreshed recently enough (within half of ``expiration_time``)
+        """
+        if not app_settings.CACHE_TIMEOUT:
+            return False
+        state = cache.get(self._payload_key)
+        if state is None:
+            return False
+        digest, revision, received = state
+        if digest != self._get_payload_digest(data):
+            return False
+        if revision != self.get_graph_revision():
+            return False
+        if self.expiration_time > 0:
+            return received > now() - timedelta(seconds=self.expiration_time / 2)
+        return True
 
     @classmethod
-    def update_all(cls, label=None):
+    def update_all(cls, label=None, workers=1):
         """
         - updates topologies
         - logs failures
         - calls delete_expired_links()
+        if ``workers`` is greater than 1, the data of up to ``workers``
+        topologies is fetched and parsed concurrently
+        """
+        queryset = cls.get_update_all_queryset(label)
+        if workers > 1:
+            cls._update_concurrently(queryset, workers)
+        else:
+            for topology in queryset:
+                print_info("Updating topology {0}".format(topology))
+                start = perf_counter()
+                with log_failure("update", topology):
+                    topology.update()
+                print_info(
+                    "Topology {0} updated in {1:.2f} seconds".format(
+                        topology, perf_counter() - start
+                    )
+                )
+        cls().link_model.delete_expired_links()
+        cls().node_model.delete_expired_nodes()
+
+    @classmethod
+    def get_update_all_queryset(cls, label=None):
+        """
+        returns the topologies which are updated by ``update_all``
         """
         queryset = cls.objects.filter(published=True, strategy="fetch")
         if label:
             queryset = queryset.filter(label__icontains=label)
-        for topology in queryset:
-            print_info("Updating topology {0}".format(topology))
-            with log_failure("update", topology):
-                topology.update()
-        cls().link_model.delete_expired_links()
-        cls().node_model.delete_expired_nodes()
+        return queryset
+
+    @staticmethod
+    def _update_concurrently(topologies, workers):
+        """
+        fetches and parses the data of ``topologies`` in a pool of
+        threads (no database query is performed in the threads),
+        the diffs are computed and dispatched as results arrive
+        """
+        timings = {}
+
+        def fetch(topology):
+            start = perf_counter()
+            try:
+                return topology.parser_class(url=topology.url, timeout=TIMEOUT)
+            finally:
+                timings[topology.pk] = perf_counter() - start
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(fetch, topology): topology for topology in topologies
+            }
+            for future in as_completed(futures):
+                topology = futures[future]
+                print_info("Updating topology {0}".format(topology))
+                start = perf_counter()
+                with log_failure("update", topology):
+                    topology.update(topology.get_topology_data(future.result()))
+                print_info(
+                    "Topology {0} updated in {1:.2f} seconds "
+                    "(fetched in {2:.2f} seconds)".format(
+                        topology, perf_counter() - start, timings[topology.pk]
+                    )
+                )
 
     @classmethod
-    def save_snapshot_all(cls, label=None):
+    def save_snapshot_all(cls, label=None, workers=1):
         """
-        - save snapshots of topoogies
+        - save snapshots of topologies: the snapshots already saved
+          in the current interval are retrieved with a single query,
+          ``workers`` topologies are serialized concurrently and
+          the snapshots are written in bulk
+        - prunes old snapshots (see ``Snapshot.prune``)
         - logs failures
         """
         queryset = cls.objects.filter(published=True)
         if label:
             queryset = queryset.filter(label__icontains=label)
-        for topology in queryset:
+        topologies = list(queryset)
+        Snapshot = cls().snapshot_model
+        timestamp = now()
+        snapshots = {}
+        # the data of the snapshots is replaced, hence it's not loaded
+        for snapshot in (
+            Snapshot.objects.filter(
+                topology__in=topologies,
+                timestamp__gte=Snapshot.get_interval_start(timestamp),
+            )
+            .defer("data")
+            .order_by("topology_id", "-timestamp")
+        ):
+            # the most recent snapshot of each topology
+            snapshots.setdefault(snapshot.topology_id, snapshot)
+
+        def prepare(topology):
             print_info("Saving topology {0}".format(topology))
+            snapshot = snapshots.get(topology.pk) or Snapshot(topology=topology)
             with log_failure("save_snapshot", topology):
-                topology.save_snapshot()
+                return topology._prepare_snapshot(snapshot, timestamp)
+
+        def prepare_in_thread(topology):
+            try:
+                return prepare(topology)
+            finally:
+                # each thread opens its own database connection
+                connection.close()
+
+        start = perf_counter()
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                prepared = list(executor.map(prepare_in_thread, topologies))
+        else:
+            prepared = [prepare(topology) for topology in topologies]
+        prepared = [snapshot for snapshot in prepared if snapshot is not None]
+        Snapshot.bulk_save(prepared)
+        print_info(
+            "{0} snapshots saved in {1:.2f} seconds".format(
+                len(prepared), perf_counter() - start
+            )
+        )
+        for topology in topologies:
+            with log_failure("prune_snapshots", topology):
+                Snapshot.prune(topology)
 
 
 @receiver(post_save, sender=swapper.get_model_name("topology", "Topology"))
 def send_topology_signal(sender, instance, **kwargs):
-    update_topology.send(sender=sender, topology=instance)
+    send_update_topology(sender, instance)
@@ -1,4 +1,5 @@
 import json
+from urllib.parse import parse_qs
 
 from asgiref.sync import async_to_sync
 from channels.generic.websocket import WebsocketConsumer
@@ -6,12 +7,20 @@ from django.core.exceptions import ValidationError
 from swapper import load_model
 
 from . import settings as app_settings
+from .signals import (
+    add_delta_subscriber,
+    get_snapshot_message,
+    get_topology_state,
+    refresh_delta_subscriber,
+    remove_delta_subscriber,
+)
 
 Topology = load_model("topology", "Topology")
 
 
 class TopologyConsumer(WebsocketConsumer):
     channel_layer_group = "topology"
+    delta_subscriber = False
 
     def _is_user_authorized_to_view_topology(self, user, topology_pk):
         try:
@@ -30,17 +39,49 @@ class TopologyConsumer(WebsocketConsumer):
         user, topology_pk = self.scope.get("user"), self.scope.get("url_route").get(
             "kwargs"
         ).get("pk")
+        query = parse_qs(self.scope.get("query_string", b"").decode())
+        self.topology_pk = topology_pk
+        self.delta = query.get("format") == ["delta"]
         if self._is_user_authorized_to_view_topology(user, topology_pk):
-            async_to_sync(self.channel_layer.group_add)(
-                f"{self.channel_layer_group}-{topology_pk}", self.channel_name
-            )
+            group = f"{self.channel_layer_group}-{topology_pk}"
+            # clients which receive deltas are kept in a separate group
+            if self.delta:
+                group = f"{group}-delta"
+            async_to_sync(self.channel_layer.group_add)(group, self.channel_name)
             self.accept()
+            if self.delta:
+                # deltas are computed only while clients are connected
+                add_delta_subscriber(topology_pk)
+                self.delta_subscriber = True
+                self.send_topology_snapshot()
         else:
             self.close()
 
     def disconnect(self, close_code):
+        if self.delta_subscriber:
+            remove_delta_subscriber(self.topology_pk)
+            self.delta_subscriber = False
         self.close()
 
+    def receive(self, text_data=None, bytes_data=None):
+        try:
+            message = json.loads(text_data)
+        except (TypeError, ValueError):
+            return
+        if not isinstance(message, dict) or message.get("type") != "resync":
+            return
+        if self.delta:
+            refresh_delta_subscriber(self.topology_pk)
+            self.send_topology_snapshot()
+            return
+        topology = Topology.objects.get(pk=self.topology_pk)
+        self.send_topology_update({"data": topology.json()})
+
+    def send_topology_snapshot(self):
+        topology = Topology.objects.get(pk=self.topology_pk)
+        revision, graph = get_topology_state(topology)
+        self.send(text_data=json.dumps(get_snapshot_message(revision, graph)))
+
     def send_topology_update(self, event):
         self.send(
             text_data=json.dumps(
@@ -50,3 +91,8 @@ class TopologyConsumer(WebsocketConsumer):
                 }
             )
         )
+
+    def send_topology_delta(self, event):
+        # the number of subscribers expires if not refreshed
+        refresh_delta_subscriber(self.topology_pk)
+        self.send(text_data=json.dumps(event["data"]))
@@ -3,11 +3,27 @@ from importlib import import_module
 import swapper
 from django.apps import AppConfig
 from django.db import transaction
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.utils.translation import gettext_lazy as _
 
-from ...utils import link_status_changed
-from .tasks import create_device_node_relation, trigger_device_updates
+from ...signals import get_pending, nodes_created
+from ...utils import links_status_changed
+from .tasks import (
+    create_device_node_relation,
+    create_device_node_relations,
+    trigger_devices_updates,
+)
+
+
+class PendingDeviceNodes(dict):
+    """
+    new nodes of each topology waiting for the auto-creation
+    of DeviceNode objects when the current transaction is committed
+    """
+
+    def __call__(self):
+        for node_pks in self.values():
+            create_device_node_relations.delay(node_pks)
 
 
 class OpenwispTopologyDeviceConfig(AppConfig):
@@ -26,21 +42,76 @@ class OpenwispTopologyDeviceConfig(AppConfig):
         post_save.connect(
             self.create_device_rel, sender=Node, dispatch_uid="node_to_device_rel"
         )
-        link_status_changed.connect(
-            self.link_status_changed_receiver,
+        nodes_created.connect(
+            self.create_device_rels, sender=Node, dispatch_uid="nodes_to_device_rels"
+        )
+        links_status_changed.connect(
+            self.links_status_changed_receiver,
             sender=Link,
-            dispatch_uid="controller_integration_link_status_chaged",
+            dispatch_uid="controller_integration_links_status_changed",
+        )
+        # the name of the device is used as node label, hence the
+        # cached representations of the topology must be invalidated
+        DeviceNode = swapper.load_model("topology_device", "DeviceNode")
+        Device = swapper.load_model("config", "Device")
+        post_save.connect(
+            self.device_node_changed,
+            sender=DeviceNode,
+            dispatch_uid="device_node_bump_graph_revision",
+        )
+        post_delete.connect(
+            self.device_node_changed,
+            sender=DeviceNode,
+            dispatch_uid="device_node_delete_bump_graph_revision",
+        )
+        post_save.connect(
+            self.device_changed,
+            sender=Device,
+            dispatch_uid="device_bump_graph_revision",
         )
 
     @classmethod
     def create_device_rel(cls, instance, created, **kwargs):
         if not created:
             return
+        if transaction.get_connection().in_atomic_block:
+            pending = get_pending("device_nodes", PendingDeviceNodes)
+            pending.setdefault(instance.topology_id, []).append(instance.pk)
+            return
         transaction.on_commit(lambda: create_device_node_relation.delay(instance.pk))
 
     @classmethod
-    def link_status_changed_receiver(cls, link, **kwargs):
-        transaction.on_commit(lambda: trigger_device_updates.delay(link.pk))
+    def create_device_rels(cls, nodes, **kwargs):
+        node_pks = [node.pk for node in nodes]
+        transaction.on_commit(lambda: create_device_node_relations.delay(node_pks))
+
+    @classmethod
+    def device_node_changed(cls, instance, **kwargs):
+        Node = swapper.load_model("topology", "Node")
+        Topology = swapper.load_model("topology", "Topology")
+        # the node may have been deleted already
+        topology_ids = Node.objects.filter(pk=instance.node_id).values_list(
+            "topology_id", flat=True
+        )
+        for pk in topology_ids:
+            Topology(pk=pk).bump_graph_revision()
+
+    @classmethod
+    def device_changed(cls, instance, created, **kwargs):
+        if created:
+            return
+        Topology = swapper.load_model("topology", "Topology")
+        topology_ids = (
+            Topology.objects.filter(node__devicenode__device=instance)
+            .values_list("pk", flat=True)
+            .distinct()
+        )
+        for pk in topology_ids:
+            Topology(pk=pk).bump_graph_revision()
+
+    @classmethod
+    def links_status_changed_receiver(cls, link_ids, **kwargs):
+        transaction.on_commit(lambda: trigger_devices_updates.delay(link_ids))
 
     def override_node_label(self):
         import_module("openwisp_network_topology.integrations.device.overrides")
@@ -1,9 +1,11 @@
 import logging
 from ipaddress import ip_address, ip_network
 
+from celery import group
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
-from django.db import models
+from django.db import connections, models, router
+from django.db.models.functions import Lower, Substr
 from django.utils.module_loading import import_string
 from django.utils.timezone import datetime, now, timedelta
 from django.utils.translation import gettext_lazy as _
@@ -12,6 +14,7 @@ from swapper import get_model_name, load_model
 from openwisp_utils.base import UUIDModel
 
 from .. import settings as app_settings
+from ..utils import PrefixIndex, get_network_filter
 
 logger = logging.getLogger(__name__)
 
@@ -30,17 +33,21 @@ class AbstractDeviceNode(UUIDModel):
     ENABLED_PARSERS = {
         "netdiff.OpenvpnParser": {
             "auto_create": "auto_create_openvpn",
+            "bulk_auto_create": "bulk_auto_create_openvpn",
             "link_down": "link_down_openvpn",
             "link_up": "link_up_openvpn",
         },
         "netdiff.WireguardParser": {
             "auto_create": "auto_create_wireguard",
+            "bulk_auto_create": "bulk_auto_create_wireguard",
         },
         "netdiff.ZeroTierParser": {
             "auto_create": "auto_create_zerotier",
+            "bulk_auto_create": "bulk_auto_create_zerotier",
         },
         "netdiff.NetJsonParser": {
             "auto_create": "auto_create_netjsongraph",
+            "bulk_auto_create": "bulk_auto_create_netjsongraph",
         },
     }
 
@@ -104,30 +111,25 @@ class AbstractDeviceNode(UUIDModel):
         return cls.save_device_node(device, node)
 
     @classmethod
-    def auto_create_wireguard(cls, node):
-        allowed_ips = node.properties.get("allowed_ips")
-        if not allowed_ips:
-            return
-        Device = load_model("config", "Device")
-        ip_addresses = []
-        for ip in allowed_ips:
+    def get_wireguard_networks(cls, node):
+        """
+        Returns the networks of the ``allowed_ips`` of a wireguard node
+        """
+        networks = []
+        for ip in node.properties.get("allowed_ips") or []:
             try:
-                ip_addresses.extend([str(host) for host in ip_network(ip).hosts()])
+                networks.append(ip_network(ip))
             except ValueError:
                 # invalid IP address
                 continue
-        device_filter = models.Q(config__vpnclient__ip__ip_address__in=ip_addresses)
-        if node.organization_id:
-            device_filter &= models.Q(organization_id=node.organization_id)
-        device = (
-            Device.objects.only(
-                "id", "name", "last_ip", "management_ip", "organization_id"
-            )
-            .filter(device_filter)
-            .first()
-        )
-        if not device:
+        return networks
+
+    @classmethod
+    def auto_create_wireguard(cls, node):
+        pairs = cls.bulk_auto_create_wireguard([node])
+        if not pairs:
             return
+        device, node = pairs[0]
         return cls.save_device_node(device, node)
 
     @classmethod
@@ -183,7 +185,178 @@ class AbstractDeviceNode(UUIDModel):
             return
         return cls.save_device_node(device, node)
 
-    def link_action(self, link, status):
+    @classmethod
+    def bulk_auto_create(cls, nodes):
+        """
+        Like ``auto_create`` but for many nodes at once: the devices
+        are looked up with a single query for each parser and the
+        DeviceNode objects are created with a single query
+        """
+        parser_nodes = {}
+        for node in nodes:
+            opts = cls.ENABLED_PARSERS.get(node.topology.parser)
+            if opts:
+                parser_nodes.setdefault(opts["bulk_auto_create"], []).append(node)
+        pairs = []
+        for method, method_nodes in parser_nodes.items():
+            pairs.extend(getattr(cls, method)(method_nodes))
+        if not pairs:
+            return []
+        return cls.bulk_save_device_nodes(pairs)
+
+    @classmethod
+    def bulk_save_device_nodes(cls, pairs):
+        """
+        Creates the DeviceNode objects of the ``(device, node)``
+        tuples in ``pairs`` (``post_save`` is not sent), nodes
+        which are already related to a device are skipped
+        """
+        Node = load_model("topology", "Node")
+        Topology = load_model("topology", "Topology")
+        device_nodes = [cls(device=device, node=node) for device, node in pairs]
+        cls.objects.bulk_create(device_nodes, ignore_conflicts=True)
+        # the primary keys are generated by the application, hence the
+        # rows which have been inserted can be looked up afterwards
+        # (in batches, like bulk_create, to respect the query size limits)
+        pks = [device_node.pk for device_node in device_nodes]
+        ops = connections[router.db_for_write(cls)].ops
+        batch_size = ops.bulk_batch_size(["pk"], pks)
+        created = set()
+        while pks:
+            batch, pks = pks[:batch_size], pks[batch_size:]
+            created.update(
+                cls.objects.filter(pk__in=batch).values_list("pk", flat=True)
+            )
+        device_nodes = [
+            device_node for device_node in device_nodes if device_node.pk in created
+        ]
+        shared_nodes = []
+        for device_node in device_nodes:
+            node = device_node.node
+            # Update organization of the node. This is required
+            # when topology is shared.
+            if node.organization_id is None:
+                node.organization_id = device_node.device.organization_id
+                shared_nodes.append(node)
+        if shared_nodes:
+            Node.objects.bulk_update(shared_nodes, ["organization_id"])
+        for topology_id in {
+            device_node.node.topology_id for device_node in device_nodes
+        }:
+            Topology(pk=topology_id).bump_graph_revision()
+        logger.info(f"{len(device_nodes)} DeviceNode relations created")
+        return device_nodes
+
+    @classmethod
+    def _get_device_queryset(cls, nodes, device_key):
+        """
+        Returns the devices which may be related to ``nodes``
+        annotated with ``device_key``
+        """
+        Device = load_model("config", "Device")
+        queryset = Device.objects.only(
+            "id", "name", "last_ip", "management_ip", "organization_id"
+        ).annotate(device_key=device_key)
+        organization_ids = {node.organization_id for node in nodes}
+        if None not in organization_ids:
+            queryset = queryset.filter(organization_id__in=organization_ids)
+        return queryset
+
+    @classmethod
+    def match_devices(cls, nodes, get_keys, device_key):
+        """
+        Returns the ``(device, node)`` tuples of ``nodes`` using a
+        single query: ``get_keys(node)`` returns the values identifying
+        the device of a node, which are compared with the expression
+        ``device_key`` evaluated on each device
+        """
+        node_keys = [(node, get_keys(node)) for node in nodes]
+        keys = {key for _, node_key in node_keys for key in node_key}
+        if not keys:
+            return []
+        queryset = cls._get_device_queryset(nodes, device_key).filter(
+            device_key__in=keys
+        )
+        devices = {}
+        for device in queryset:
+            devices.setdefault(device.device_key, []).append(device)
+        pairs = []
+        for node, node_key in node_keys:
+            for key in node_key:
+                device = next(
+                    (
+                        device
+                        for device in devices.get(key, [])
+                        if not node.organization_id
+                        or node.organization_id == device.organization_id
+                    ),
+                    None,
+                )
+                if device:
+                    pairs.append((device, node))
+                    break
+        return pairs
+
+    @classmethod
+    def bulk_auto_create_openvpn(cls, nodes):
+        def get_keys(node):
+            common_name = node.properties.get("common_name")
+            return [common_name] if common_name else []
+
+        return cls.match_devices(
+            nodes, get_keys, models.F("config__vpnclient__cert__common_name")
+        )
+
+    @classmethod
+    def bulk_auto_create_wireguard(cls, nodes):
+        """
+        The IP addresses of the VPN clients are matched against the
+        ``allowed_ips`` networks by containment, hence the cost
+        does not depend on the size of these networks
+        """
+        index = PrefixIndex()
+        for node in nodes:
+            for network in cls.get_wireguard_networks(node):
+                index.add(network, node)
+        if not index.networks:
+            return []
+        queryset = cls._get_device_queryset(
+            nodes, models.F("config__vpnclient__ip__ip_address")
+        ).filter(get_network_filter(index.networks, "device_key"))
+        devices = {}
+        for device in queryset:
+            for node in index.lookup(device.device_key):
+                if node.pk in devices or (
+                    node.organization_id
+                    and node.organization_id != device.organization_id
+                ):
+                    continue
+                devices[node.pk] = (device, node)
+        return list(devices.values())
+
+    @classmethod
+    def bulk_auto_create_zerotier(cls, nodes):
+        def get_keys(node):
+            zerotier_member_id = node.properties.get("address")
+            return [zerotier_member_id] if zerotier_member_id else []
+
+        # the secret of the vpn client starts with the ZeroTier member ID,
+        # which is made of 10 hexadecimal digits
+        return cls.match_devices(
+            nodes, get_keys, Substr("config__vpnclient__secret", 1, 10)
+        )
+
+    @classmethod
+    def bulk_auto_create_netjsongraph(cls, nodes):
+        def get_keys(node):
+            # see auto_create_netjsongraph
+            if len(node.addresses) < 2:
+                return []
+            return [node.addresses[0].rpartition("@")[0].lower()]
+
+        return cls.match_devices(nodes, get_keys, Lower("mac_address"))
+
+    def link_action(self, link, status, save=True):
         """
         Performs clean-up operations when link goes down.
         The right action to perform depends on the Topology used.
@@ -192,16 +365,18 @@ class AbstractDeviceNode(UUIDModel):
         if opts:
             key = f"link_{status}"
             if key in opts and hasattr(self, opts[key]):
-                return getattr(self, opts[key])()
+                return getattr(self, opts[key])(save=save)
 
-    def link_down_openvpn(self):
+    def link_down_openvpn(self, save=True):
         """
         Link down action for OpenVPN
         """
         self.device.management_ip = None
-        self.device.save(update_fields=["management_ip"])
+        if save:
+            self.device.save(update_fields=["management_ip"])
+        return True
 
-    def link_up_openvpn(self):
+    def link_up_openvpn(self, save=True):
         """
         Link up action for OpenVPN
         """
@@ -215,7 +390,9 @@ class AbstractDeviceNode(UUIDModel):
             )
         else:
             self.device.management_ip = str(address)
-            self.device.save(update_fields=["management_ip"])
+            if save:
+                self.device.save(update_fields=["management_ip"])
+            return True
 
     @classmethod
     def filter_by_link(cls, link):
@@ -234,14 +411,67 @@ class AbstractDeviceNode(UUIDModel):
         Used to refresh controller and monitoring information
         whenever the status of a link changes
         """
-        if link.topology.parser not in cls.ENABLED_PARSERS:
+        cls.bulk_trigger_device_updates([link])
+
+    @classmethod
+    def bulk_trigger_device_updates(cls, links):
+        """
+        Like ``trigger_device_updates`` but for many links at once:
+        the DeviceNode objects are looked up with a single query,
+        each device is saved at most once and the monitoring checks
+        are enqueued in a single group
+        """
+        node_links = {}
+        for link in links:
+            if link.topology.parser not in cls.ENABLED_PARSERS:
+                continue
+            node_links.setdefault(link.source_id, []).append(link)
+            node_links.setdefault(link.target_id, []).append(link)
+        if not node_links:
             return
-        for device_node in cls.filter_by_link(link):
-            device_node.link_action(link, link.status)
-            # triggers monitoring checks if OpenWISP Monitoring is enabled
-            if "openwisp_monitoring.device" in settings.INSTALLED_APPS:
-                run_checks = import_string(trigger_device_checks_path)
-                run_checks.delay(device_node.device.pk, recovery=link.status == "up")
+        devices = {}
+        checks = {}
+        queryset = cls.objects.filter(node_id__in=node_links.keys()).select_related(
+            "device", "node"
+        )
+        for device_node in queryset:
+            device = device_node.device
+            # each device instance is loaded from the database
+            initial_management_ip = device.management_ip
+            for link in node_links[device_node.node_id]:
+                if device_node.link_action(link, link.status, save=False):
+                    devices[device.pk] = (device, initial_management_ip)
+                checks[device.pk] = link.status == "up"
+        cls._update_management_ip(devices.values())
+        cls._trigger_device_checks(checks)
+
+    @classmethod
+    def _update_management_ip(cls, devices):
+        """
+        ``devices`` is a list of ``(device, initial_management_ip)`` tuples,
+        only the devices whose ``management_ip`` has changed are saved:
+        ``Device.save()`` sends the signals the other modules rely on
+        """
+        for device, initial_management_ip in devices:
+            if device.management_ip != initial_management_ip:
+                device.save(update_fields=["management_ip"])
+
+    @classmethod
+    def _trigger_device_checks(cls, checks):
+        """
+        triggers monitoring checks if OpenWISP Monitoring is enabled,
+        ``checks`` maps the primary key of each device to ``recovery``
+        """
+        if not checks or "openwisp_monitoring.device" not in settings.INSTALLED_APPS:
+            return
+        run_checks = import_string(trigger_device_checks_path)
+        if len(checks) == 1:
+            pk, recovery = next(iter(checks.items()))
+            run_checks.delay(pk, recovery=recovery)
+            return
+        group(
+            run_checks.si(pk, recovery=recovery) for pk, recovery in checks.items()
+        ).delay()
 
 
 class AbstractWifiMesh(UUIDModel):
@@ -282,16 +512,21 @@ class AbstractWifiMesh(UUIDModel):
                 '"OPENIWSP_NETWORK_TOPOLOGY_WIFI_MESH_INTEGRATION" is set to "False".'
             )
         Link = load_model("topology", "Link")
+        Topology = load_model("topology", "Topology")
         for org_id in organization_ids:
             intermediate_topologies = cls._create_intermediate_topologies(
                 org_id, discard_older_data_time
             )
             if not intermediate_topologies:
-                Link.objects.filter(
+                links = Link.objects.filter(
                     topology__wifimesh__isnull=False, organization_id=org_id
-                ).exclude(topology__wifimesh__in=intermediate_topologies.keys()).update(
-                    status="down"
-                )
+                ).exclude(topology__wifimesh__in=intermediate_topologies.keys())
+                topology_ids = set(links.values_list("topology_id", flat=True))
+                links.update(status="down")
+                # update() does not call Link.save(): the cached
+                # representations of the graphs are invalidated here
+                for topology_id in topology_ids:
+                    Topology(pk=topology_id).bump_graph_revision()
                 continue
             cls._create_topology(intermediate_topologies, org_id)
 
@@ -1,18 +1,91 @@
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from time import perf_counter
+
 import swapper
 from django.core.management.base import BaseCommand
-from django.db.models import Q
+from django.db import connection
 
 
 class BaseCreateDeviceNodeCommand(BaseCommand):
     help = "Create initial DeviceNode objects"
 
-    def handle(self, *args, **kwargs):
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            action="store",
+            type=int,
+            default=1000,
+            help="Number of nodes processed at once",
+        )
+        parser.add_argument(
+            "--workers",
+            action="store",
+            type=int,
+            default=1,
+            help="Number of chunks of nodes processed concurrently",
+        )
+
+    def handle(self, *args, **options):
         Node = swapper.load_model("topology", "Node")
         DeviceNode = swapper.load_model("topology_device", "DeviceNode")
-        queryset = Node.objects.select_related("topology").filter(
-            Q(topology__parser="netdiff.OpenvpnParser")
-            | Q(topology__parser="netdiff.WireguardParser")
-            | Q(topology__parser="netdiff.ZeroTierParser")
+        # nodes which are already related to a device are skipped,
+        # hence an interrupted execution can be resumed by running
+        # this command again
+        queryset = Node.objects.filter(
+            topology__parser__in=DeviceNode.ENABLED_PARSERS.keys(),
+            devicenode__isnull=True,
+        ).order_by("pk")
+        total = queryset.count()
+        chunks = self.get_chunks(
+            queryset.values_list("pk", flat=True).iterator(), options["chunk_size"]
+        )
+        processed = created = 0
+        start = perf_counter()
+        if options["workers"] > 1:
+            with ThreadPoolExecutor(max_workers=options["workers"]) as executor:
+                results = executor.map(self.process_chunk_in_thread, chunks)
+                for count, relations in results:
+                    processed += count
+                    created += relations
+                    self.print_progress(processed, total, created, start)
+        else:
+            for chunk in chunks:
+                count, relations = self.process_chunk(chunk)
+                processed += count
+                created += relations
+                self.print_progress(processed, total, created, start)
+
+    @staticmethod
+    def get_chunks(iterable, size):
+        iterator = iter(iterable)
+        chunk = list(islice(iterator, size))
+        while chunk:
+            yield chunk
+            chunk = list(islice(iterator, size))
+
+    def process_chunk(self, pks):
+        """
+        Creates the DeviceNode objects of the nodes in ``pks``, returns
+        the number of nodes and the number of relations created
+        """
+        Node = swapper.load_model("topology", "Node")
+        DeviceNode = swapper.load_model("topology_device", "DeviceNode")
+        nodes = Node.objects.select_related("topology").filter(pk__in=pks)
+        return len(pks), len(DeviceNode.bulk_auto_create(nodes))
+
+    def process_chunk_in_thread(self, pks):
+        try:
+            return self.process_chunk(pks)
+        finally:
+            # each thread opens its own database connection
+            connection.close()
+
+    def print_progress(self, processed, total, created, start):
+        elapsed = perf_counter() - start
+        self.stdout.write(
+            "Processed {0}/{1} nodes, {2} relations created "
+            "({3:.0f} nodes/s)".format(
+                processed, total, created, processed / elapsed if elapsed else 0
+            )
         )
-        for node in queryset.iterator():
-            DeviceNode.auto_create(node)
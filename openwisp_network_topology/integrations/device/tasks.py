@@ -12,6 +12,14 @@ def create_device_node_relation(node_pk):
     DeviceNode.auto_create(node)
 
 
+@shared_task
+def create_device_node_relations(node_pks):
+    Node = swapper.load_model("topology", "Node")
+    DeviceNode = swapper.load_model("topology_device", "DeviceNode")
+    nodes = Node.objects.select_related("topology").filter(pk__in=node_pks)
+    DeviceNode.bulk_auto_create(nodes)
+
+
 @shared_task
 def trigger_device_updates(link_pk):
     Link = swapper.load_model("topology", "Link")
@@ -20,6 +28,14 @@ def trigger_device_updates(link_pk):
     DeviceNode.trigger_device_updates(link)
 
 
+@shared_task
+def trigger_devices_updates(link_pks):
+    Link = swapper.load_model("topology", "Link")
+    DeviceNode = swapper.load_model("topology_device", "DeviceNode")
+    links = Link.objects.select_related("topology").filter(pk__in=link_pks)
+    DeviceNode.bulk_trigger_device_updates(links)
+
+
 @shared_task
 def create_mesh_topology(organization_ids, discard_older_data_time=360):
     if not app_settings.WIFI_MESH_INTEGRATION:
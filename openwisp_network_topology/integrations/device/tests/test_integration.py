@@ -1,3 +1,5 @@
+from io import StringIO
+from ipaddress import IPv4Network, ip_network
 from unittest import mock
 
 import swapper
@@ -6,6 +8,8 @@ from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
 from django.core.management import call_command
 from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_save
 from django.test import TransactionTestCase
 from django.urls import reverse
 from django.utils.module_loading import import_string
@@ -24,6 +28,8 @@ from openwisp_utils.admin_theme.menu import MENU
 
 from ..base.models import logger as models_logger
 from ..base.models import trigger_device_checks_path
+from ..utils import get_network_filter
+from ..utils import logger as utils_logger
 
 Node = swapper.load_model("topology", "Node")
 Link = swapper.load_model("topology", "Link")
@@ -195,6 +201,42 @@ class TestControllerIntegration(Base, TransactionTestCase):
                 node.save()
                 on_commit.assert_not_called()
 
+    def test_bulk_auto_create(self):
+        topology, device, cert = self._create_test_env(parser="netdiff.OpenvpnParser")
+
+        with self.subTest("nodes created within a transaction"):
+            with mock.patch.object(DeviceNode, "auto_create") as auto_create:
+                with transaction.atomic():
+                    node = self._init_test_node(topology, common_name=cert.common_name)
+                    self._init_test_node(
+                        topology,
+                        addresses=["netjson_id2"],
+                        label="test2",
+                        common_name="missing",
+                    )
+                auto_create.assert_not_called()
+            self.assertEqual(DeviceNode.objects.count(), 1)
+            device_node = DeviceNode.objects.first()
+            self.assertEqual(device_node.device, device)
+            self.assertEqual(device_node.node, node)
+
+        with self.subTest("assert number of queries"):
+            DeviceNode.objects.all().delete()
+            nodes = list(Node.objects.select_related("topology"))
+            # select devices, BEGIN, INSERT, COMMIT, select inserted rows
+            with self.assertNumQueries(5):
+                DeviceNode.bulk_auto_create(nodes)
+            self.assertEqual(DeviceNode.objects.count(), 1)
+
+        with self.subTest("nodes already related to a device are skipped"):
+            for node in nodes:
+                node.organization_id = None
+            self.assertEqual(DeviceNode.bulk_auto_create(nodes), [])
+            self.assertEqual(DeviceNode.objects.count(), 1)
+            # the organization is not updated for the skipped nodes
+            for node in nodes:
+                self.assertIsNone(node.organization_id)
+
     def test_auto_create_openvpn_failures(self):
         topology, device, cert = self._create_test_env(parser="netdiff.OpenvpnParser")
 
@@ -248,6 +290,43 @@ class TestControllerIntegration(Base, TransactionTestCase):
             except KeyError:
                 self.fail("KeyError raised")
 
+    def test_auto_create_wireguard_network(self):
+        topology, device = self._create_wireguard_test_env(
+            parser="netdiff.WireguardParser"
+        )
+        with self.subTest("network which does not contain the device IP"):
+            self._init_wireguard_test_node(topology, allowed_ips=["10.1.0.0/16"])
+            self.assertEqual(DeviceNode.objects.count(), 0)
+        with self.subTest("network which contains the device IP"):
+            with mock.patch.object(IPv4Network, "hosts") as hosts:
+                node = self._init_wireguard_test_node(
+                    topology, allowed_ips=["10.0.0.0/8"]
+                )
+            hosts.assert_not_called()
+            self.assertEqual(DeviceNode.objects.count(), 1)
+            device_node = DeviceNode.objects.first()
+            self.assertEqual(device_node.device, device)
+            self.assertEqual(device_node.node, node)
+
+    def test_get_network_filter(self):
+        with self.subTest("hosts matched exactly"):
+            query = get_network_filter([ip_network("10.0.0.5/32")], "key")
+            self.assertEqual(query, Q(key__in=["10.0.0.5"]))
+        with self.subTest("IPv4 networks narrowed down by their octets"):
+            query = get_network_filter([ip_network("10.1.0.0/16")], "key")
+            self.assertEqual(query, Q(key__startswith="10.1."))
+        with self.subTest("IPv6 networks narrowed down by their hextets"):
+            query = get_network_filter([ip_network("fd00:1::/32")], "key")
+            self.assertEqual(query, Q(key__startswith="fd00:1:"))
+            # zero hextets may be compressed in the stored addresses
+            query = get_network_filter([ip_network("fd00:0:0:1::/64")], "key")
+            self.assertEqual(query, Q(key__startswith="fd00:"))
+        with self.subTest("full scan logged for short prefixes"):
+            with mock.patch.object(utils_logger, "info") as logger_info:
+                query = get_network_filter([ip_network("10.0.0.0/7")], "key")
+            self.assertEqual(query, Q(key__isnull=False))
+            logger_info.assert_called_once()
+
     def test_auto_create_zerotier(self):
         topology, device, zerotier_member_id = self._create_zerotier_test_env(
             parser="netdiff.ZeroTierParser"
@@ -361,6 +440,52 @@ class TestControllerIntegration(Base, TransactionTestCase):
         device.refresh_from_db()
         self.assertEqual(device.management_ip, "10.0.0.2")
 
+    def test_bulk_trigger_device_updates(self):
+        topology, device, cert = self._create_test_env(parser="netdiff.OpenvpnParser")
+        device2 = self._create_device(
+            name="device2",
+            mac_address="00:11:22:33:44:56",
+            organization=topology.organization,
+        )
+        config2 = self._create_config(device=device2)
+        cert2 = config2.vpnclient_set.first().cert
+        node = self._init_test_node(topology, common_name=cert.common_name)
+        node2 = self._init_test_node(
+            topology,
+            addresses=["netjson_id2"],
+            label="test2",
+            common_name=cert2.common_name,
+        )
+        server = self._init_test_node(topology, addresses=["server"], label="server")
+        self.assertEqual(DeviceNode.objects.count(), 2)
+        Device.objects.update(management_ip="10.0.0.8")
+        # the management IP of the second device is already unset
+        Device.objects.filter(pk=device2.pk).update(management_ip=None)
+        for source in [node, node2]:
+            link = Link(
+                source=source,
+                target=server,
+                status="up",
+                topology=topology,
+                organization=topology.organization,
+                cost=1,
+            )
+            link.full_clean()
+            link.save()
+        Link.objects.update(status="down")
+        links = list(Link.objects.select_related("topology"))
+        handler = mock.Mock()
+        post_save.connect(handler, sender=Device, dispatch_uid="test_bulk_trigger")
+        try:
+            DeviceNode.bulk_trigger_device_updates(links)
+        finally:
+            post_save.disconnect(sender=Device, dispatch_uid="test_bulk_trigger")
+        self.assertFalse(Device.objects.filter(management_ip__isnull=False).exists())
+        # only the device whose management IP changed has been saved
+        handler.assert_called_once()
+        self.assertEqual(handler.call_args.kwargs["instance"].pk, device.pk)
+        self.assertEqual(handler.call_args.kwargs["update_fields"], {"management_ip"})
+
     @mock.patch.object(models_logger, "warning")
     def test_link_up_openvpn_failure(self, logger_warning):
         topology, device, cert = self._create_test_env(parser="netdiff.OpenvpnParser")
@@ -431,6 +556,25 @@ class TestControllerIntegration(Base, TransactionTestCase):
         qs = DeviceNode.objects.filter(node=n)
         self.assertEqual(qs.count(), 1)
 
+        with self.subTest("nodes already related to a device are skipped"):
+            stdout = StringIO()
+            call_command("create_device_nodes", stdout=stdout)
+            self.assertEqual(stdout.getvalue(), "")
+            self.assertEqual(qs.count(), 1)
+
+        with self.subTest("chunks and workers"):
+            self._create_node(
+                topology=topology,
+                label="test2",
+                addresses=["netjson_id2"],
+                properties={"common_name": "missing"},
+            )
+            DeviceNode.objects.all().delete()
+            stdout = StringIO()
+            call_command("create_device_nodes", chunk_size=1, workers=2, stdout=stdout)
+            self.assertIn("Processed 2/2 nodes, 1 relations created", stdout.getvalue())
+            self.assertEqual(qs.count(), 1)
+
     def test_shared_topology_org_devices(self):
         org1 = self._create_org(name="org1")
         org2 = self._create_org(name="org2")
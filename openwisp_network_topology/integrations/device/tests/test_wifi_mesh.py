@@ -249,10 +249,13 @@ class TestWifiMeshIntegration(TopologyTestMixin, TransactionTestCase):
         self.assertEqual(topology.link_set.filter(status="up").count(), 1)
 
         # No device is sending monitoring data
+        revision = topology.get_graph_revision()
         create_mesh_topology.delay(organization_ids=(org.id,))
         self.assertEqual(Topology.objects.count(), 1)
         self.assertEqual(topology.node_set.count(), 3)
         self.assertEqual(topology.link_set.filter(status="up").count(), 0)
+        # links are marked as down with a queryset update
+        self.assertNotEqual(topology.get_graph_revision(), revision)
 
     def test_topology_admin(self):
         """
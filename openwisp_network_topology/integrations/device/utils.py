@@ -0,0 +1,90 @@
+import logging
+from ipaddress import ip_address, ip_network
+
+from django.db.models import Q
+
+logger = logging.getLogger(__name__)
+
+
+class PrefixIndex(object):
+    """
+    In-memory index of IP networks: looks up the networks
+    which contain an IP address without enumerating their
+    hosts, with one dictionary lookup for each prefix length
+    """
+
+    def __init__(self):
+        self.networks = {}
+        self.prefixlens = {4: set(), 6: set()}
+
+    def add(self, network, value):
+        self.networks.setdefault(network, []).append(value)
+        self.prefixlens[network.version].add(network.prefixlen)
+
+    def lookup(self, address):
+        """
+        Returns the values of the networks which contain
+        ``address``, starting from the most specific one
+        """
+        address = ip_address(address)
+        values = []
+        for prefixlen in sorted(self.prefixlens[address.version], reverse=True):
+            network = ip_network((address, prefixlen), strict=False)
+            values.extend(self.networks.get(network, []))
+        return values
+
+
+def get_address_prefix(network):
+    """
+    Returns the beginning of the string representation shared by
+    the addresses of ``network`` (ending with a separator), the
+    octets of IPv4 networks and the hextets of IPv6 networks which
+    are entirely part of the prefix are used; returns an empty
+    string if no part of the prefix can be used
+    """
+    # the last octet or hextet is never followed by a separator
+    if network.version == 4:
+        octets = str(network.network_address).split(".")
+        return "".join(
+            f"{octet}." for octet in octets[: min(network.prefixlen // 8, 3)]
+        )
+    prefix = ""
+    hextets = network.network_address.exploded.split(":")
+    hextets = hextets[: min(network.prefixlen // 16, 7)]
+    for hextet in hextets:
+        # zeros may be compressed with "::" in the stored addresses
+        if int(hextet, 16) == 0:
+            break
+        prefix += f"{int(hextet, 16):x}:"
+    return prefix
+
+
+def get_network_filter(networks, field):
+    """
+    Returns a ``Q`` object which looks for the IP addresses stored
+    in ``field`` which may be contained in ``networks``: host networks
+    are matched exactly, other networks are narrowed down by the
+    beginning of their prefix (see ``get_address_prefix``), the
+    results must be checked with ``PrefixIndex``
+    """
+    hosts = []
+    prefixes = set()
+    query = Q()
+    for network in networks:
+        if network.num_addresses == 1:
+            hosts.append(str(network.network_address))
+            continue
+        prefix = get_address_prefix(network)
+        if prefix:
+            prefixes.add(prefix)
+            continue
+        logger.info(
+            f"The prefix of {network} is too short to narrow down the lookup: "
+            f"all the addresses stored in {field} are scanned"
+        )
+        query |= Q(**{f"{field}__isnull": False})
+    for prefix in sorted(prefixes):
+        query |= Q(**{f"{field}__startswith": prefix})
+    if hosts:
+        query |= Q(**{f"{field}__in": hosts})
+    return query
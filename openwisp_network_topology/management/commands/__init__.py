@@ -1,7 +1,10 @@
 import swapper
 from django.core.management.base import BaseCommand
 
+from ...tasks import update_all_topologies
+
 Topology = swapper.load_model("topology", "Topology")
+Snapshot = swapper.load_model("topology", "Snapshot")
 
 
 class BaseUpdateCommand(BaseCommand):
@@ -15,9 +18,25 @@ class BaseUpdateCommand(BaseCommand):
             default=None,
             help="Will update topologies containing label",
         )
+        parser.add_argument(
+            "--workers",
+            action="store",
+            type=int,
+            default=1,
+            help="Number of topologies fetched concurrently",
+        )
+        parser.add_argument(
+            "--celery",
+            action="store_true",
+            default=False,
+            help="Will update each topology in a separate Celery task",
+        )
 
     def handle(self, *args, **options):
-        self.topology_model.update_all(options["label"])
+        if options["celery"]:
+            update_all_topologies.delay(options["label"])
+            return
+        self.topology_model.update_all(options["label"], workers=options["workers"])
 
 
 class BaseSaveSnapshotCommand(BaseCommand):
@@ -31,6 +50,35 @@ class BaseSaveSnapshotCommand(BaseCommand):
             default=None,
             help="Will save snapshots of topologies containing label",
         )
+        parser.add_argument(
+            "--workers",
+            action="store",
+            type=int,
+            default=1,
+            help="Number of topologies serialized concurrently",
+        )
+
+    def handle(self, *args, **options):
+        self.topology_model.save_snapshot_all(
+            options["label"], workers=options["workers"]
+        )
+
+
+class BaseCompressSnapshotsCommand(BaseCommand):
+    help = "Compress the snapshots stored uncompressed by previous versions"
+    snapshot_model = Snapshot
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            action="store",
+            type=int,
+            default=100,
+            help="Number of snapshots compressed with each query",
+        )
 
     def handle(self, *args, **options):
-        self.topology_model.save_snapshot_all(options["label"])
+        total = 0
+        for count in self.snapshot_model.compress_all(options["chunk_size"]):
+            total += count
+            self.stdout.write(f"{total} snapshots compressed")
@@ -0,0 +1,5 @@
+from . import BaseCompressSnapshotsCommand
+
+
+class Command(BaseCompressSnapshotsCommand):
+    pass
@@ -0,0 +1,56 @@
+import uuid
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from . import populate_node_addresses
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("topology", "0017_migrate_to_django_jsonfield"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="NodeAddress",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                ("address", models.CharField(max_length=255, verbose_name="address")),
+                (
+                    "node",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="address_set",
+                        to="topology.Node",
+                    ),
+                ),
+                (
+                    "topology",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="topology.Topology",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "node address",
+                "verbose_name_plural": "node addresses",
+                "abstract": False,
+                "swappable": "TOPOLOGY_NODEADDRESS_MODEL",
+                "unique_together": {("topology", "address")},
+            },
+        ),
+        migrations.RunPython(
+            populate_node_addresses, reverse_code=migrations.RunPython.noop
+        ),
+    ]
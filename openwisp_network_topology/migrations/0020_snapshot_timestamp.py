@@ -0,0 +1,26 @@
+import django.utils.timezone
+from django.db import migrations, models
+
+from openwisp_network_topology.migrations import populate_snapshot_timestamp
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("topology", "0019_snapshot_keyframe"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="snapshot",
+            name="timestamp",
+            field=models.DateTimeField(
+                db_index=True,
+                default=django.utils.timezone.now,
+                verbose_name="timestamp",
+            ),
+        ),
+        migrations.RunPython(
+            populate_snapshot_timestamp, reverse_code=migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,31 @@
+from django.db import migrations, models
+
+from openwisp_network_topology.migrations import (
+    deduplicate_node_addresses,
+    populate_node_addresses,
+)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("topology", "0020_snapshot_timestamp"),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name="nodeaddress",
+            unique_together={("node", "address")},
+        ),
+        # the addresses are looked up by topology
+        migrations.AddIndex(
+            model_name="nodeaddress",
+            index=models.Index(
+                fields=["topology", "address"], name="topology_no_topolog_753316_idx"
+            ),
+        ),
+        # indexes the shared addresses which were skipped
+        migrations.RunPython(
+            populate_node_addresses, reverse_code=deduplicate_node_addresses
+        ),
+    ]
@@ -3,6 +3,7 @@ import json
 
 import swapper
 from django.contrib.auth.management import create_permissions
+from django.db import models
 
 
 def get_model(apps, app_name, model):
@@ -48,8 +49,58 @@ def fix_link_properties(apps, schema_editor):
         link.save()
 
 
+def populate_node_addresses(apps, schema_editor, batch_size=1000):
+    Node = get_model(apps, "topology", "Node")
+    NodeAddress = get_model(apps, "topology", "NodeAddress")
+    max_length = NodeAddress._meta.get_field("address").max_length
+    queryset = Node.objects.only("id", "topology_id", "addresses").order_by("created")
+    batch = []
+    for node in queryset.iterator():
+        addresses = node.addresses
+        if isinstance(addresses, str):
+            addresses = json.loads(addresses)
+        for address in addresses or []:
+            if not isinstance(address, str) or len(address) > max_length:
+                continue
+            batch.append(
+                NodeAddress(
+                    topology_id=node.topology_id, node_id=node.pk, address=address
+                )
+            )
+        if len(batch) >= batch_size:
+            NodeAddress.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    if batch:
+        NodeAddress.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def deduplicate_node_addresses(apps, schema_editor):
+    """
+    keeps only the address of the oldest node when an address
+    is shared, allows to restore uniqueness per topology
+    """
+    NodeAddress = get_model(apps, "topology", "NodeAddress")
+    seen = set()
+    duplicates = []
+    for pk, topology_id, address in (
+        NodeAddress.objects.order_by("node__created", "node_id")
+        .values_list("pk", "topology_id", "address")
+        .iterator()
+    ):
+        if (topology_id, address) in seen:
+            duplicates.append(pk)
+        else:
+            seen.add((topology_id, address))
+    NodeAddress.objects.filter(pk__in=duplicates).delete()
+
+
 def create_default_permissions(apps, schema_editor):
     for app_config in apps.get_app_configs():
         app_config.models_module = True
         create_permissions(app_config, apps=apps, verbosity=0)
         app_config.models_module = None
+
+
+def populate_snapshot_timestamp(apps, schema_editor):
+    Snapshot = get_model(apps, "topology", "Snapshot")
+    Snapshot.objects.update(timestamp=models.F("modified"))
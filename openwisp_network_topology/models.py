@@ -1,7 +1,7 @@
 import swapper
 
 from .base.link import AbstractLink
-from .base.node import AbstractNode
+from .base.node import AbstractNode, AbstractNodeAddress
 from .base.snapshot import AbstractSnapshot
 from .base.topology import AbstractTopology
 
@@ -18,6 +18,12 @@ class Node(AbstractNode):
         swappable = swapper.swappable_setting("topology", "Node")
 
 
+class NodeAddress(AbstractNodeAddress):
+    class Meta(AbstractNodeAddress.Meta):
+        abstract = False
+        swappable = swapper.swappable_setting("topology", "NodeAddress")
+
+
 class Snapshot(AbstractSnapshot):
     class Meta(AbstractSnapshot.Meta):
         abstract = False
@@ -1,6 +1,7 @@
 import logging
 
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 
 # 'pre_django_setup' is supposed to be a logger
 # that can work before registered Apps are
@@ -39,6 +40,27 @@ SIGNALS = get_settings_value("SIGNALS", None)
 TIMEOUT = get_settings_value("TIMEOUT", 8)
 LINK_EXPIRATION = get_settings_value("LINK_EXPIRATION", 60)
 NODE_EXPIRATION = get_settings_value("NODE_EXPIRATION", False)
+BULK_UPDATE = get_settings_value("BULK_UPDATE", False)
+# the cached data is shared by the web and the Celery worker processes:
+# caches which are local to each process would serve stale data
+LOCAL_CACHE_BACKENDS = [
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+]
+_cache_backend = settings.CACHES.get("default", {}).get("BACKEND")
+SHARED_CACHE = _cache_backend not in LOCAL_CACHE_BACKENDS
+CACHE_TIMEOUT = get_settings_value("CACHE_TIMEOUT", 86400 if SHARED_CACHE else 0)
+BROADCAST_DEBOUNCE = get_settings_value("BROADCAST_DEBOUNCE", 0)
+if BROADCAST_DEBOUNCE and not SHARED_CACHE:
+    raise ImproperlyConfigured(
+        "OPENWISP_NETWORK_TOPOLOGY_BROADCAST_DEBOUNCE requires a cache backend "
+        "shared by all the processes, the default cache uses "
+        f"{_cache_backend}"
+    )
+UPDATE_LOCK_TIMEOUT = get_settings_value("UPDATE_LOCK_TIMEOUT", 600)
+SNAPSHOT_INTERVAL = get_settings_value("SNAPSHOT_INTERVAL", 86400)
+SNAPSHOT_KEYFRAME_INTERVAL = get_settings_value("SNAPSHOT_KEYFRAME_INTERVAL", 0)
+SNAPSHOT_RETENTION = get_settings_value("SNAPSHOT_RETENTION", [])
 VISUALIZER_CSS = get_settings_value("VISUALIZER_CSS", "netjsongraph/css/style.css")
 TOPOLOGY_API_URLCONF = get_settings_value("API_URLCONF", None)
 TOPOLOGY_API_BASEURL = get_settings_value("API_BASEURL", None)
@@ -1,16 +1,344 @@
+import json
+import weakref
+from contextlib import contextmanager
+from functools import partial
+from threading import local
+from time import monotonic, sleep, time_ns
+from uuid import uuid4
+
 from asgiref.sync import async_to_sync
 from channels import layers
+from django.core.cache import cache
+from django.db import transaction
 from django.dispatch import Signal
 
+from . import settings as app_settings
+from .tasks import handle_broadcast_topology
+from .utils import get_graph_delta, link_status_changed, links_status_changed
+
 update_topology = Signal()
 update_topology.__doc__ = """
 Providing arguments: ['topology']
 """
+nodes_created = Signal()
+nodes_created.__doc__ = """
+Sent when the nodes of a topology are created in bulk
+(``post_save`` is not sent for these nodes)
+Providing arguments: ['topology', 'nodes']
+"""
 
+_pending = local()
+STATE_LOCK_TIMEOUT = 10
+STATE_LOCK_WAIT = 2
+# refreshed by the connected clients, see ``refresh_delta_subscriber``
+DELTA_SUBSCRIBERS_TIMEOUT = 3600
 
-def broadcast_topology(topology, *args, **kwargs):
+
+class PendingBroadcasts(dict):
+    """
+    topologies waiting to be broadcasted when
+    the current transaction is committed
+    """
+
+    def __call__(self):
+        for topology in self.values():
+            schedule_broadcast(topology)
+
+
+def get_pending(name, factory):
+    """
+    returns the callable stored as ``name`` which is called once
+    the current transaction is committed (created with ``factory``
+    if needed), must be used within an atomic block
+    """
+    ref = getattr(_pending, name, None)
+    pending = ref() if ref else None
+    if pending is None:
+        pending = factory()
+        # only a weak reference is kept here: the callback is released
+        # by the connection when it's run or when the transaction (or
+        # the savepoint in which it was registered) is rolled back
+        setattr(_pending, name, weakref.ref(pending))
+        transaction.on_commit(partial(_run_pending, name, pending))
+    return pending
+
+
+def _run_pending(name, pending):
+    ref = getattr(_pending, name, None)
+    if ref and ref() is pending:
+        setattr(_pending, name, None)
+    pending()
+
+
+def _get_pending_broadcasts():
+    return get_pending("broadcasts", PendingBroadcasts)
+
+
+class DeferredSignals(object):
+    """
+    signals of a topology waiting to be sent
+    when the current transaction is committed
+    """
+
+    def __init__(self, topology):
+        self.topology = topology
+        self.changed = False
+        self.links = {}
+
+    def __call__(self):
+        link_ids = {}
+        for link in self.links.values():
+            link_status_changed.send(sender=link.__class__, link=link)
+            link_ids.setdefault(link.status, []).append(link.pk)
+        for status, ids in link_ids.items():
+            links_status_changed.send(
+                sender=self.topology.link_model, link_ids=ids, status=status
+            )
+        if self.changed:
+            update_topology.send(sender=self.topology.__class__, topology=self.topology)
+
+
+def _get_deferred_signals():
+    if not hasattr(_pending, "deferred"):
+        _pending.deferred = {}
+    return _pending.deferred
+
+
+@contextmanager
+def defer_topology_signals(topology):
+    """
+    ``update_topology`` and ``link_status_changed`` are not sent for
+    ``topology`` within this block: they're sent once the current
+    transaction is committed (``update_topology`` only once),
+    must be used within an atomic block
+    """
+    deferred = _get_deferred_signals()
+    if topology.pk in deferred:
+        yield
+        return
+    signals = deferred[topology.pk] = DeferredSignals(topology)
+    try:
+        yield
+    finally:
+        del deferred[topology.pk]
+    transaction.on_commit(signals)
+
+
+def send_update_topology(sender, topology):
+    """
+    sends ``update_topology`` unless deferred
+    """
+    signals = _get_deferred_signals().get(topology.pk)
+    if signals is not None:
+        # cached data must not be served within the transaction
+        if not signals.changed:
+            topology.bump_graph_revision()
+        signals.changed = True
+        return
+    update_topology.send(sender=sender, topology=topology)
+
+
+def send_link_status_changed(link):
+    """
+    sends ``link_status_changed`` and ``links_status_changed``
+    (with a single link) unless deferred
+    """
+    signals = _get_deferred_signals().get(link.topology_id)
+    if signals is not None:
+        signals.links[link.pk] = link
+        return
+    link_status_changed.send(sender=link.__class__, link=link)
+    links_status_changed.send(
+        sender=link.__class__, link_ids=[link.pk], status=link.status
+    )
+
+
+def get_broadcast_lock_key(topology_pk):
+    return f"topology-broadcast-{topology_pk}"
+
+
+def get_broadcast_state_key(topology_pk):
+    return f"topology-broadcast-state-{topology_pk}"
+
+
+def get_delta_subscribers_key(topology_pk):
+    return f"topology-delta-subscribers-{topology_pk}"
+
+
+def get_state_revision(topology, base_revision=0):
+    """
+    returns the revision of the state broadcasted to the clients
+    which receive deltas, which is greater than ``base_revision``:
+    the revision of the graph is used, which increases monotonically
+    and is shared by all the processes (the current time is used
+    if the cache is disabled)
+    """
+    revision = topology.get_graph_revision() or time_ns()
+    return max(revision, base_revision + 1)
+
+
+def get_snapshot_message(revision, graph):
+    return {"type": "topology_snapshot", "revision": revision, "topology": graph}
+
+
+@contextmanager
+def broadcast_state_lock(topology_pk):
+    """
+    serializes the updates of the state broadcasted to the
+    clients which receive deltas, the lock expires after
+    ``STATE_LOCK_TIMEOUT`` seconds if its holder crashes;
+    yields ``False`` if the lock could not be acquired
+    within ``STATE_LOCK_WAIT`` seconds
+    """
+    key = f"topology-broadcast-state-lock-{topology_pk}"
+    token = uuid4().hex
+    deadline = monotonic() + STATE_LOCK_WAIT
+    acquired = cache.add(key, token, STATE_LOCK_TIMEOUT)
+    while not acquired and monotonic() < deadline:
+        sleep(0.01)
+        acquired = cache.add(key, token, STATE_LOCK_TIMEOUT)
+    try:
+        yield acquired
+    finally:
+        # the lock may have expired and been acquired by another broadcast
+        if acquired and cache.get(key) == token:
+            cache.delete(key)
+
+
+def get_topology_state(topology):
+    """
+    returns the ``(revision, graph)`` tuple which has been
+    broadcasted last to the clients which receive deltas
+    """
+    key = get_broadcast_state_key(topology.pk)
+    state = cache.get(key)
+    if state is None:
+        state = (get_state_revision(topology), json.loads(topology.json()))
+        # a concurrent broadcast may have stored the state in the meantime
+        if not cache.add(key, state, app_settings.CACHE_TIMEOUT):
+            state = cache.get(key) or state
+    return state
+
+
+def add_delta_subscriber(topology_pk):
+    key = get_delta_subscribers_key(topology_pk)
+    cache.add(key, 0, DELTA_SUBSCRIBERS_TIMEOUT)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # expired in the meantime
+        cache.add(key, 1, DELTA_SUBSCRIBERS_TIMEOUT)
+    cache.touch(key, DELTA_SUBSCRIBERS_TIMEOUT)
+
+
+def refresh_delta_subscriber(topology_pk):
+    """
+    postpones the expiration of the number of subscribers, which
+    is not decremented if a process crashes; if it has expired
+    (or has been reset) the subscriber is counted again
+    """
+    key = get_delta_subscribers_key(topology_pk)
+    if not cache.get(key):
+        add_delta_subscriber(topology_pk)
+        return
+    cache.touch(key, DELTA_SUBSCRIBERS_TIMEOUT)
+
+
+def remove_delta_subscriber(topology_pk):
+    try:
+        cache.decr(get_delta_subscribers_key(topology_pk))
+    except ValueError:
+        pass
+
+
+def send_topology(topology):
     channel_layer = layers.get_channel_layer()
+    data = topology.json()
     async_to_sync(channel_layer.group_send)(
         f"topology-{topology.pk}",
-        {"type": "send_topology_update", "data": topology.json()},
+        {"type": "send_topology_update", "data": data},
     )
+    send_topology_delta(topology, data)
+
+
+def send_topology_delta(topology, data):
+    """
+    sends the changes of ``topology`` since the last broadcast to
+    the clients which receive deltas; without cache the state cannot
+    be shared between processes and the whole graph is sent, which
+    happens also if no client is known to be connected, in order to
+    avoid keeping the state of topologies nobody is looking at
+    """
+    channel_layer = layers.get_channel_layer()
+    group = f"topology-{topology.pk}-delta"
+    key = get_broadcast_state_key(topology.pk)
+    if not app_settings.CACHE_TIMEOUT or not cache.get(
+        get_delta_subscribers_key(topology.pk)
+    ):
+        # initialized again when a client connects
+        cache.delete(key)
+        message = get_snapshot_message(get_state_revision(topology), json.loads(data))
+        async_to_sync(channel_layer.group_send)(
+            group, {"type": "send_topology_delta", "data": message}
+        )
+        return
+    with broadcast_state_lock(topology.pk) as acquired:
+        # loaded within the lock: an older graph
+        # must not overwrite a more recent one
+        graph = json.loads(topology.json())
+        if not acquired:
+            # the state is left to the holder of the lock: the clients
+            # replace their graph and resync on the next delta
+            message = get_snapshot_message(get_state_revision(topology), graph)
+            async_to_sync(channel_layer.group_send)(
+                group, {"type": "send_topology_delta", "data": message}
+            )
+            return
+        state = cache.get(key)
+        if state is None:
+            revision = get_state_revision(topology)
+            message = get_snapshot_message(revision, graph)
+        else:
+            base_revision, base_graph = state
+            delta = get_graph_delta(base_graph, graph)
+            if delta is None:
+                return
+            revision = get_state_revision(topology, base_revision)
+            message = {
+                "type": "topology_delta",
+                "revision": revision,
+                "base_revision": base_revision,
+                "delta": delta,
+            }
+        cache.set(key, (revision, graph), app_settings.CACHE_TIMEOUT)
+        async_to_sync(channel_layer.group_send)(
+            group, {"type": "send_topology_delta", "data": message}
+        )
+
+
+def bump_graph_revision(topology, *args, **kwargs):
+    topology.bump_graph_revision()
+
+
+def broadcast_topology(topology, *args, **kwargs):
+    """
+    Coalesces the changes of a topology in a single broadcast:
+    changes made within a transaction are sent once it is committed,
+    if ``OPENWISP_NETWORK_TOPOLOGY_BROADCAST_DEBOUNCE`` is set, changes
+    happening within the debounce window are sent only once
+    """
+    if transaction.get_connection().in_atomic_block:
+        _get_pending_broadcasts()[topology.pk] = topology
+        return
+    schedule_broadcast(topology)
+
+
+def schedule_broadcast(topology):
+    debounce = app_settings.BROADCAST_DEBOUNCE
+    if not debounce:
+        send_topology(topology)
+        return
+    # a broadcast is already scheduled for this topology
+    if not cache.add(get_broadcast_lock_key(topology.pk), True, debounce * 2):
+        return
+    handle_broadcast_topology.apply_async((topology.pk,), countdown=debounce)
@@ -1,29 +1,181 @@
 import logging
 
-from celery import shared_task
+from celery import chord, shared_task
+from celery.backends.base import DisabledBackend
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
 from swapper import load_model
 
+from . import settings as app_settings
+from .utils import decode_diff
+
 logger = logging.getLogger(__name__)
 
 
+def get_update_lock_key(topology_pk):
+    return f"topology-update-{topology_pk}"
+
+
 @shared_task
-def handle_update_topology(topology_pk, diff):
+def handle_update_topology(topology_pk, diff, sequence=None):
     """
     A Celery task that updates the network topology
     of a Topology instance in the background.
 
+    The updates of a topology are serialized by locking its
+    row, diffs superseded by a more recent one are discarded
+    (see ``AbstractTopology.has_full_diffs``).
+
     Args:
         topology_pk (uuid):
         The primary key of the Topology instance.
 
         diff (str):
-        A dict containing the network topology diff.
+        The network topology diff, either a dict
+        or encoded with ``utils.encode_diff``.
+
+        sequence (int):
+        The sequence number of the diff (optional).
+    """
+    Topology = load_model("topology", "Topology")
+    with transaction.atomic():
+        try:
+            topology = Topology.objects.select_for_update().get(pk=topology_pk)
+        except ObjectDoesNotExist as e:
+            logger.warning(f'handle_update_topology("{topology_pk}") failed: {e}')
+            return
+        if topology.is_update_superseded(sequence):
+            logger.info(
+                f'handle_update_topology("{topology_pk}") skipped: diff {sequence} '
+                "superseded by a more recent diff"
+            )
+            return
+        topology.update_topology(decode_diff(diff))
+
+
+@shared_task
+def handle_broadcast_topology(topology_pk):
     """
+    A Celery task that broadcasts the latest version of
+    a topology once the debounce window has elapsed.
+    """
+    from .signals import get_broadcast_lock_key, send_topology
+
     Topology = load_model("topology", "Topology")
+    # changes received from now on will schedule a new broadcast
+    cache.delete(get_broadcast_lock_key(topology_pk))
     try:
         topology = Topology.objects.get(pk=topology_pk)
     except ObjectDoesNotExist as e:
-        logger.warning(f'handle_update_topology("{topology_pk}") failed: {e}')
+        logger.warning(f'handle_broadcast_topology("{topology_pk}") failed: {e}')
+        return
+    send_topology(topology)
+
+
+@shared_task
+def update_all_topologies(label=None):
+    """
+    A Celery task which enqueues one ``fetch_topology`` task for
+    each topology which is updated by ``Topology.update_all``,
+    once all of them have been executed, ``delete_expired_items``
+    receives their results.
+    """
+    Topology = load_model("topology", "Topology")
+    pks = Topology.get_update_all_queryset(label).values_list("pk", flat=True)
+    header = [fetch_topology.si(str(pk)) for pk in pks]
+    # chords require a result backend
+    if isinstance(fetch_topology.backend, DisabledBackend):
+        for task in header:
+            task.delay()
+        delete_expired_items.delay()
         return
-    topology.update_topology(diff)
+    chord(header)(delete_expired_items.s())
+
+
+@shared_task
+def fetch_topology(topology_pk):
+    """
+    A Celery task which fetches the data of a topology and
+    applies the changes; an update of a topology is skipped
+    if another update of the same topology is still running.
+
+    If the cache is shared by all the processes, a cache lock is
+    held during the update, otherwise the row of the topology is
+    locked for the whole update (fetch included).
+
+    Returns ``"updated"``, ``"skipped"`` or ``"failed"``.
+    """
+    Topology = load_model("topology", "Topology")
+    if not app_settings.SHARED_CACHE:
+        with transaction.atomic():
+            topology = (
+                Topology.objects.select_for_update(skip_locked=True)
+                .filter(pk=topology_pk)
+                .first()
+            )
+            if topology is None:
+                if Topology.objects.filter(pk=topology_pk).exists():
+                    return _skip_fetch_topology(topology_pk)
+                logger.warning(
+                    f'fetch_topology("{topology_pk}") failed: '
+                    "Topology matching query does not exist."
+                )
+                return "failed"
+            return _fetch_topology(topology, lock=False)
+    key = get_update_lock_key(topology_pk)
+    if not cache.add(key, True, app_settings.UPDATE_LOCK_TIMEOUT):
+        return _skip_fetch_topology(topology_pk)
+    try:
+        try:
+            topology = Topology.objects.get(pk=topology_pk)
+        except ObjectDoesNotExist as e:
+            logger.warning(f'fetch_topology("{topology_pk}") failed: {e}')
+            return "failed"
+        return _fetch_topology(topology, lock=True)
+    finally:
+        cache.delete(key)
+
+
+def _skip_fetch_topology(topology_pk):
+    logger.info(f'fetch_topology("{topology_pk}") skipped: update in progress')
+    return "skipped"
+
+
+def _fetch_topology(topology, lock):
+    from .contextmanagers import log_failure
+
+    Topology = load_model("topology", "Topology")
+    with log_failure("update", topology):
+        # fetched before locking the row, unless already locked
+        data = topology.get_topology_data()
+        # serialized with ``handle_update_topology``
+        with transaction.atomic():
+            if lock:
+                topology = Topology.objects.select_for_update().get(pk=topology.pk)
+            # the changes are applied by this task, within the lock,
+            # diffs enqueued earlier by ``Topology.update`` are discarded
+            topology.next_update_sequence()
+            topology.update_topology(topology.diff(data))
+        return "updated"
+    return "failed"
+
+
+@shared_task
+def delete_expired_items(results=None):
+    """
+    A Celery task which deletes expired links and nodes
+    once all the topologies have been updated.
+    """
+    Link = load_model("topology", "Link")
+    Node = load_model("topology", "Node")
+    if results is not None:
+        logger.info(
+            "update_all_topologies: {0} updated, {1} skipped, {2} failed".format(
+                results.count("updated"),
+                results.count("skipped"),
+                results.count("failed"),
+            )
+        )
+    Link.delete_expired_links()
+    Node.delete_expired_nodes()
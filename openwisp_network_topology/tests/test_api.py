@@ -1,13 +1,19 @@
-from unittest.mock import patch
+from datetime import timedelta
+from unittest.mock import ANY, patch
 from uuid import uuid4
 
 import swapper
 from django.contrib.auth.models import Permission
 from django.test import TestCase
 from django.urls import reverse
+from django.utils.http import http_date
+from django.utils.timezone import now
+from freezegun import freeze_time
 from rest_framework.views import APIView
 
+from openwisp_network_topology import settings as app_settings
 from openwisp_network_topology.tasks import handle_update_topology
+from openwisp_network_topology.utils import decode_diff
 from openwisp_users.tests.utils import TestOrganizationMixin
 from openwisp_utils.tests import AssertNumQueriesSubTestMixin
 
@@ -128,6 +134,19 @@ class TestApi(
         response = self.client.get(self.detail_url)
         self.assertEqual(response.data["type"], "NetworkGraph")
 
+    def test_detail_cache_disabled(self):
+        expected = self.client.get(self.detail_url).json()
+        with patch.object(app_settings, "CACHE_TIMEOUT", 0), patch.object(
+            self.topology_model,
+            "json",
+            autospec=True,
+            side_effect=self.topology_model.json,
+        ) as mocked_json:
+            response = self.client.get(self.detail_url)
+        # the representation is not serialized twice
+        mocked_json.assert_called_once_with(ANY, dict=True)
+        self.assertEqual(response.json(), expected)
+
     def test_list_include_unpublished(self):
         self._unpublish()
         path = f"{self.list_url}?include_unpublished=true"
@@ -166,10 +185,67 @@ class TestApi(
         topology = self.topology_model.objects.first()
         data = self._load("static/netjson-1-link.json")
         response = self.client.post(self.receive_url, data, content_type="text/plain")
-        mocked_task.assert_called_once_with(topology.pk, topology.diff(data))
+        mocked_task.assert_called_once_with(topology.pk, ANY, ANY)
+        self.assertEqual(decode_diff(mocked_task.call_args[0][1]), topology.diff(data))
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.data["detail"], "data received successfully")
 
+    @patch("openwisp_network_topology.tasks.handle_update_topology.delay")
+    def test_receive_unchanged(self, mocked_task):
+        self._set_receive()
+        topology = self.topology_model.objects.first()
+        data = self._load("static/netjson-1-link.json")
+        response = self.client.post(self.receive_url, data, content_type="text/plain")
+        self.assertEqual(response.data["detail"], "data received successfully")
+        self.assertEqual(mocked_task.call_count, 1)
+        url = self.receive_url
+        # session, user and topology
+        with self.assertNumQueries(3):
+            response = self.client.post(url, data, content_type="text/plain")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["detail"], "data unchanged, skipped")
+        self.assertEqual(mocked_task.call_count, 1)
+
+        with self.subTest("different data"):
+            changed = data.replace('"cost": 1.0', '"cost": 2.0')
+            response = self.client.post(
+                self.receive_url, changed, content_type="text/plain"
+            )
+            self.assertEqual(response.data["detail"], "data received successfully")
+            self.assertEqual(mocked_task.call_count, 2)
+            response = self.client.post(
+                self.receive_url, data, content_type="text/plain"
+            )
+            self.assertEqual(response.data["detail"], "data received successfully")
+            self.assertEqual(mocked_task.call_count, 3)
+
+        with self.subTest("graph modified in the meantime"):
+            self.link.delete()
+            response = self.client.post(
+                self.receive_url, data, content_type="text/plain"
+            )
+            self.assertEqual(response.data["detail"], "data received successfully")
+            self.assertEqual(mocked_task.call_count, 4)
+
+        with self.subTest("links refreshed when half of expiration time elapsed"):
+            topology.expiration_time = 60
+            topology.save()
+            response = self.client.post(
+                self.receive_url, data, content_type="text/plain"
+            )
+            self.assertEqual(mocked_task.call_count, 5)
+            with freeze_time(now() + timedelta(seconds=20)):
+                response = self.client.post(
+                    self.receive_url, data, content_type="text/plain"
+                )
+                self.assertEqual(response.data["detail"], "data unchanged, skipped")
+            with freeze_time(now() + timedelta(seconds=31)):
+                response = self.client.post(
+                    self.receive_url, data, content_type="text/plain"
+                )
+                self.assertEqual(response.data["detail"], "data received successfully")
+            self.assertEqual(mocked_task.call_count, 6)
+
     @patch("openwisp_network_topology.tasks.logger.warning")
     def test_background_topology_update_task_warning(self, mock_warn):
         invalid_topology_pk = str(uuid4())
@@ -261,6 +337,91 @@ class TestApi(
         self.assertEqual(response.status_code, 404)
         self.assertIn("no snapshot found", response.data["detail"])
 
+    def test_snapshot_timestamp(self):
+        t = self.topology_model.objects.first()
+        path = reverse("network_graph_history", args=[t.pk])
+        with patch.object(app_settings, "SNAPSHOT_INTERVAL", 3600):
+            with freeze_time("2024-01-01 10:00:00"):
+                t.save_snapshot()
+            t.label = "changed"
+            t.save()
+            with freeze_time("2024-01-01 12:00:00"):
+                t.save_snapshot()
+        for timestamp, label in [
+            ("2024-01-01T10:00:00Z", "TestNetwork"),
+            ("2024-01-01T11:59:00", "TestNetwork"),
+            ("2024-01-01T12:30:00%2B00:00", "changed"),
+            ("2024-01-01", "changed"),
+        ]:
+            with self.subTest(timestamp):
+                response = self.client.get(f"{path}?date={timestamp}")
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.data["label"], label)
+        with self.subTest("no snapshot saved before the timestamp"):
+            response = self.client.get(f"{path}?date=2024-01-01T09:00:00Z")
+            self.assertEqual(response.status_code, 404)
+
+    def test_snapshot_diff(self):
+        t = self.topology_model.objects.first()
+        path = reverse("network_graph_history_diff", args=[t.pk])
+        with patch.object(app_settings, "SNAPSHOT_INTERVAL", 3600):
+            with freeze_time("2024-01-01 10:00:00"):
+                t.save_snapshot()
+            t.label = "changed"
+            t.save()
+            self.link.delete()
+            self._create_node(
+                label="node3",
+                addresses=["192.168.0.3"],
+                topology=t,
+                organization=t.organization,
+            )
+            with freeze_time("2024-01-01 12:00:00"):
+                t.save_snapshot()
+        url = f"{path}?from=2024-01-01T10:30:00Z&to=2024-01-01"
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["from"], "2024-01-01T10:00:00Z")
+        self.assertEqual(response.json()["to"], "2024-01-01T12:00:00Z")
+        self.assertEqual(response.data["graph"]["label"], "changed")
+        self.assertEqual(len(response.data["added"]["nodes"]), 1)
+        self.assertEqual(response.data["added"]["nodes"][0]["label"], "node3")
+        self.assertEqual(response.data["added"]["links"], [])
+        self.assertEqual(
+            response.data["removed"]["links"],
+            [{"source": "192.168.0.1", "target": "192.168.0.2"}],
+        )
+        self.assertEqual(response.data["removed"]["nodes"], [])
+
+        with self.subTest("the diff is cached"):
+            with patch(
+                "openwisp_network_topology.api.views.get_graph_delta"
+            ) as get_graph_delta:
+                cached_response = self.client.get(url)
+            get_graph_delta.assert_not_called()
+            self.assertEqual(cached_response.data, response.data)
+
+        with self.subTest("unchanged graph"):
+            response = self.client.get(f"{path}?from=2024-01-01&to=2024-01-01")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data["graph"], {})
+            self.assertEqual(response.data["added"], {"nodes": [], "links": []})
+            self.assertEqual(response.data["removed"], {"nodes": [], "links": []})
+            self.assertEqual(response.data["changed"], {"nodes": [], "links": []})
+
+        with self.subTest("missing parameter"):
+            response = self.client.get(f"{path}?from=2024-01-01")
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.data["detail"], 'missing required "to" parameter')
+
+        with self.subTest("invalid date"):
+            response = self.client.get(f"{path}?from=invalid&to=2024-01-01")
+            self.assertEqual(response.status_code, 403)
+
+        with self.subTest("no snapshot"):
+            response = self.client.get(f"{path}?from=2023-12-31&to=2024-01-01")
+            self.assertEqual(response.status_code, 404)
+
     def _test_api_with_unauthenticated_user(self, url):
         self.client.logout()
         r = self.client.get(url)
@@ -315,7 +476,7 @@ class TestApi(
             self.assertEqual(response.status_code, 200)
         with self.subTest("Detail url"):
             url = self.detail_url
-            with self.assertNumQueries(7):
+            with self.assertNumQueries(5):
                 response = self.client.get(url)
             self.assertEqual(response.status_code, 200)
 
@@ -333,7 +494,7 @@ class TestApi(
             self.assertEqual(response.status_code, 200)
         with self.subTest("Detail url"):
             url = self.detail_url
-            with self.assertNumQueries(7):
+            with self.assertNumQueries(5):
                 response = self.client.get(url)
             self.assertEqual(response.status_code, 200)
 
@@ -434,7 +595,7 @@ class TestApi(
             "url": "http://127.0.0.1:9090",
             "published": True,
         }
-        with self.assertNumQueries(12):
+        with self.assertNumQueries(10):
             response = self.client.post(path, data, content_type="application/json")
         self.assertEqual(response.status_code, 201)
         self.assertEqual(response.data["label"], "test-fetch-topology")
@@ -451,7 +612,7 @@ class TestApi(
             "expiration_time": 360,
             "published": True,
         }
-        with self.assertNumQueries(12):
+        with self.assertNumQueries(10):
             response = self.client.post(path, data, content_type="application/json")
         self.assertEqual(response.status_code, 201)
         self.assertEqual(response.data["label"], "test-receive-topology")
@@ -502,6 +663,60 @@ class TestApi(
         self.assertEqual(response.status_code, 200)
         self.assertNotEqual(response.data["links"], [])
 
+    def test_get_topology_detail_conditional_api(self):
+        path = reverse("network_graph", args=(self.topology.pk,))
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        last_modified = response["Last-Modified"]
+        self.assertEqual(last_modified, http_date(self.topology.get_graph_modified()))
+        with self.subTest("If-None-Match"):
+            with self.assertNumQueries(5):
+                response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.content, b"")
+            self.assertEqual(response["ETag"], etag)
+        with self.subTest("If-Modified-Since"):
+            response = self.client.get(path, HTTP_IF_MODIFIED_SINCE=last_modified)
+            self.assertEqual(response.status_code, 304)
+        with self.subTest("Different format"):
+            response = self.client.get(path, {"format": "api"}, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+        with self.subTest("Changed topology"):
+            self.node1.label = "changed"
+            self.node1.save()
+            response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response["ETag"], etag)
+            self.assertEqual(response.data["nodes"][0]["label"], "changed")
+        with self.subTest("Deleted link"):
+            response = self.client.get(path)
+            last_modified = response["Last-Modified"]
+            with freeze_time(now() + timedelta(seconds=5)):
+                self.link.delete()
+            response = self.client.get(path, HTTP_IF_MODIFIED_SINCE=last_modified)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data["links"], [])
+            self.assertNotEqual(response["Last-Modified"], last_modified)
+
+    def test_list_conditional_api(self):
+        response = self.client.get(self.list_url)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        self.assertIn("Last-Modified", response)
+        response = self.client.get(self.list_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        with self.subTest("Different filters"):
+            response = self.client.get(
+                self.list_url, {"include_unpublished": True}, HTTP_IF_NONE_MATCH=etag
+            )
+            self.assertEqual(response.status_code, 200)
+        with self.subTest("New topology"):
+            self._create_topology(organization=self._get_org())
+            response = self.client.get(self.list_url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data["collection"]), 2)
+
     def test_put_topology_detail_api(self):
         path = reverse("network_graph", args=[self.topology.pk])
         data = {
@@ -509,7 +724,7 @@ class TestApi(
             "organization": self._get_org().pk,
             "parser": "netdiff.OlsrParser",
         }
-        with self.assertNumQueries(12):
+        with self.assertNumQueries(10):
             response = self.client.put(path, data, content_type="application/json")
         self.topology.refresh_from_db()
         self.assertEqual(self.topology.label, "ChangeTestNetwork")
@@ -565,7 +780,7 @@ class TestApi(
             "strategy": "fetch",
             "url": "http://127.0.0.1:9090",
         }
-        with self.assertNumQueries(12):
+        with self.assertNumQueries(10):
             response = self.client.put(path, data, content_type="application/json")
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.data["strategy"], "fetch")
@@ -584,7 +799,7 @@ class TestApi(
             "strategy": "receive",
             "key": 12345,
         }
-        with self.assertNumQueries(12):
+        with self.assertNumQueries(10):
             response = self.client.put(path, data, content_type="application/json")
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.data["strategy"], "receive")
@@ -596,7 +811,7 @@ class TestApi(
         data = {
             "label": "ChangeTestNetwork",
         }
-        with self.assertNumQueries(11):
+        with self.assertNumQueries(9):
             response = self.client.patch(path, data, content_type="application/json")
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.data["label"], "ChangeTestNetwork")
@@ -627,7 +842,7 @@ class TestApi(
         with self.subTest("test network graph view"):
             # Get the topology graph view of member org 200
             path = reverse("network_graph", args=(topo1.pk,))
-            with self.assertNumQueries(7):
+            with self.assertNumQueries(5):
                 response = self.client.get(path)
             self.assertEqual(response.status_code, 200)
             self.assertEqual(response.data["id"], str(topo1.id))
@@ -657,7 +872,7 @@ class TestApi(
         with self.subTest("test network graph view"):
             topo1 = self._create_topology(label="topo1", organization=org1)
             path = reverse("network_graph", args=(topo1.pk,))
-            with self.assertNumQueries(14):
+            with self.assertNumQueries(8):
                 response = self.client.get(path, {"format": "api"})
             self.assertEqual(response.status_code, 200)
             self.assertEqual(Organization.objects.count(), 2)
@@ -781,7 +996,7 @@ class TestApi(
     def test_node_patch_api(self):
         path = reverse("node_detail", args=(self.node1.pk,))
         data = {"label": "change-node"}
-        with self.assertNumQueries(12):
+        with self.assertNumQueries(11):
             response = self.client.patch(path, data, content_type="application/json")
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.data["label"], "change-node")
@@ -848,7 +1063,7 @@ class TestApi(
             "properties": {},
             "user_properties": {},
         }
-        with self.assertNumQueries(16):
+        with self.assertNumQueries(14):
             response = self.client.post(path, data, content_type="application/json")
         self.assertEqual(response.status_code, 201)
         self.assertEqual(response.data["topology"], self.topology.pk)
@@ -907,7 +1122,7 @@ class TestApi(
             "properties": {},
             "user_properties": {"user": "tester"},
         }
-        with self.assertNumQueries(16):
+        with self.assertNumQueries(14):
             response = self.client.put(path, data, content_type="application/json")
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.data["cost"], 21.0)
@@ -917,7 +1132,7 @@ class TestApi(
     def test_link_patch_api(self):
         path = reverse("link_detail", args=(self.link.pk,))
         data = {"cost": 50.0}
-        with self.assertNumQueries(13):
+        with self.assertNumQueries(11):
             response = self.client.patch(path, data, content_type="application/json")
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.data["cost"], 50.0)
@@ -8,6 +8,7 @@ from openwisp_users.tests.utils import TestOrganizationMixin
 from .utils import CreateGraphObjectsMixin
 
 Node = swapper.load_model("topology", "Node")
+NodeAddress = swapper.load_model("topology", "NodeAddress")
 Topology = swapper.load_model("topology", "Topology")
 
 
@@ -133,6 +134,71 @@ class TestNode(CreateGraphObjectsMixin, TestOrganizationMixin, TestCase):
         self.assertEqual(self.node_model.count_address("Benz_Kalloni", t), 1)
         self.assertEqual(self.node_model.count_address("Kalloni", t), 1)
 
+    def test_address_index_sync(self):
+        t = self.topology_model.objects.first()
+        n = t._create_node(addresses=["10.0.0.1", "10.0.0.2", "10.0.0.1"])
+        n.full_clean()
+        n.save()
+        self.assertEqual(
+            sorted(n.address_set.values_list("address", flat=True)),
+            ["10.0.0.1", "10.0.0.2"],
+        )
+        n.addresses = ["10.0.0.2", "10.0.0.3"]
+        n.save()
+        self.assertEqual(
+            sorted(n.address_set.values_list("address", flat=True)),
+            ["10.0.0.2", "10.0.0.3"],
+        )
+        self.assertIsNone(self.node_model.get_from_address("10.0.0.1", t))
+        self.assertEqual(self.node_model.get_from_address("10.0.0.3", t), n)
+        n.delete()
+        self.assertFalse(NodeAddress.objects.filter(address="10.0.0.2").exists())
+
+    def test_address_index_duplicate_address(self):
+        t = self.topology_model.objects.first()
+        n = t._create_node(addresses=["192.168.0.1"])
+        n.full_clean()
+        n.save()
+        first = self.node_model.objects.get(label="node1")
+        self.assertEqual(self.node_model.count_address("192.168.0.1", t), 2)
+        self.assertTrue(n.address_set.exists())
+        # the oldest node is returned
+        self.assertEqual(self.node_model.get_from_address("192.168.0.1", t), first)
+        with self.subTest("address dropped by one of the nodes"):
+            first.addresses = ["10.0.0.1"]
+            first.save()
+            self.assertEqual(self.node_model.count_address("192.168.0.1", t), 1)
+            self.assertEqual(self.node_model.get_from_address("192.168.0.1", t), n)
+
+    def test_address_too_long(self):
+        t = self.topology_model.objects.first()
+        address = "a" * 300
+        n = t._create_node(addresses=[address, "10.0.0.1"])
+        n.full_clean()
+        n.save()
+        self.assertEqual(
+            list(n.address_set.values_list("address", flat=True)), ["10.0.0.1"]
+        )
+        self.assertEqual(self.node_model.get_from_address(address, t), n)
+        self.assertEqual(self.node_model.count_address(address, t), 1)
+        self.assertIsNone(self.node_model.get_from_address("b" * 300, t))
+
+    def test_address_index_other_topology(self):
+        t = self.topology_model.objects.first()
+        t2 = self._create_topology(organization=t.organization)
+        self._create_node(
+            label="node3",
+            addresses=["192.168.0.1"],
+            topology=t2,
+            organization=t2.organization,
+        )
+        self.assertEqual(self.node_model.count_address("192.168.0.1", t), 1)
+        self.assertEqual(self.node_model.count_address("192.168.0.1", t2), 1)
+        self.assertNotEqual(
+            self.node_model.get_from_address("192.168.0.1", t),
+            self.node_model.get_from_address("192.168.0.1", t2),
+        )
+
     def test_node_auto_org(self):
         t = self.topology_model.objects.first()
         n = self.node_model(
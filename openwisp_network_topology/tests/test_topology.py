@@ -1,14 +1,27 @@
+import json
 from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
 import responses
 import swapper
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
-from django.test import TestCase
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.timezone import now
 from freezegun import freeze_time
 from netdiff import OlsrParser
 
 from openwisp_utils.tests import capture_any_output
 
+from .. import settings as app_settings
+from ..signals import nodes_created, update_topology
+from ..tasks import handle_update_topology
+from ..utils import COMPRESSION_PREFIX, link_status_changed, links_status_changed
 from .utils import CreateGraphObjectsMixin, CreateOrgMixin, LoadMixin
 
 Link = swapper.load_model("topology", "Link")
@@ -252,6 +265,286 @@ class TestTopology(CreateOrgMixin, CreateGraphObjectsMixin, LoadMixin, TestCase)
         self.assertIn("192.168.0.3", [link.source.netjson_id, link.target.netjson_id])
         self.assertEqual(link.cost, 2.0)
 
+    def test_json_cache(self):
+        t = self.topology_model.objects.first()
+        data = t.json()
+        with self.assertNumQueries(0):
+            self.assertEqual(t.json(), data)
+        revision = t.get_graph_revision()
+        # any write of nodes, links or topology invalidates the cache
+        node = self.node_model.objects.first()
+        node.label = "changed"
+        node.save()
+        self.assertGreater(t.get_graph_revision(), revision)
+        data = t.json()
+        self.assertIn('"label": "changed"', data)
+        # stale instances use the current revision too
+        stale = self.topology_model.objects.get(pk=t.pk)
+        node.delete()
+        self.assertNotIn('"label": "changed"', stale.json())
+        with self.subTest("not cached with arguments"):
+            with self.assertNumQueries(2):
+                t.json(dict=True)
+            with self.assertNumQueries(2):
+                t.json(indent=4)
+        with self.subTest("cache disabled"):
+            with mock.patch.object(app_settings, "CACHE_TIMEOUT", 0):
+                with self.assertNumQueries(2):
+                    t.json()
+
+    def test_diff_fingerprint(self):
+        t = self.topology_model.objects.first()
+        t.parser = "netdiff.NetJsonParser"
+        t.save()
+        self.node_model.objects.all().delete()
+        data = self._load("static/netjson-2-links.json")
+        t.update_topology(t.diff(data))
+        self.assertEqual(self.link_model.objects.count(), 2)
+        with mock.patch.object(app_settings, "CACHE_TIMEOUT", 0):
+            expected = t.diff(data)
+        # the first diff loads the graph and stores its fingerprint
+        self.assertEqual(t.diff(data), expected)
+        with self.assertNumQueries(0):
+            self.assertEqual(t.diff(data), expected)
+        data = self._load("static/netjson-1-link.json")
+        with mock.patch.object(app_settings, "CACHE_TIMEOUT", 0):
+            expected = t.diff(data)
+        self.assertIsNotNone(expected["removed"])
+        self.assertIsNotNone(expected["changed"])
+        # only the removed items are loaded from the database
+        with self.assertNumQueries(2):
+            diff = t.diff(data)
+
+        def normalize(diff):
+            # the direction of the removed links depends on
+            # the order in which the nodes are loaded
+            for link in diff["removed"]["links"]:
+                link["source"], link["target"] = sorted(
+                    [link["source"], link["target"]]
+                )
+            return diff
+
+        self.assertEqual(normalize(diff), normalize(expected))
+        with self.subTest("fingerprint invalidated by writes"):
+            node = self.node_model.objects.get(label="node3")
+            node.label = "changed"
+            node.save()
+            diff = t.diff(self._load("static/netjson-2-links.json"))
+            labels = [node["label"] for node in diff["changed"]["nodes"]]
+            self.assertIn("node3", labels)
+
+    @mock.patch("openwisp_network_topology.tasks.handle_update_topology.delay")
+    def test_update_superseded_diff(self, mocked_task):
+        t = self._set_receive()
+        self.node_model.objects.all().delete()
+        t.receive(self._load("static/netjson-2-links.json"))
+        t.receive(self._load("static/netjson-1-link.json"))
+        self.assertEqual(mocked_task.call_count, 2)
+        (pk1, diff1, sequence1), _ = mocked_task.call_args_list[0]
+        (pk2, diff2, sequence2), _ = mocked_task.call_args_list[1]
+        self.assertGreater(sequence2, sequence1)
+        self.assertTrue(t.is_update_superseded(sequence1))
+        self.assertFalse(t.is_update_superseded(sequence2))
+        # the oldest diff is discarded even if applied last
+        handle_update_topology(pk2, diff2, sequence2)
+        handle_update_topology(pk1, diff1, sequence1)
+        self.assertEqual(self.node_model.objects.count(), 2)
+        self.assertEqual(self.link_model.objects.count(), 1)
+
+        with self.subTest("concurrent initialization"):
+            key = t._update_sequence_key
+            cache.delete(key)
+            incr = cache.incr
+            other_sequences = []
+
+            def concurrent_incr(*args, **kwargs):
+                if not other_sequences:
+                    # another process initializes and increments the
+                    # sequence right after the first attempt of this one
+                    cache.add(key, 100, None)
+                    other_sequences.append(incr(key))
+                    raise ValueError(f"Key '{key}' not found")
+                return incr(*args, **kwargs)
+
+            with mock.patch.object(cache, "incr", side_effect=concurrent_incr):
+                sequence = t.next_update_sequence()
+            self.assertEqual(other_sequences, [101])
+            self.assertEqual(sequence, 102)
+        with self.subTest("diff without sequence number"):
+            handle_update_topology(pk1, diff1)
+            self.assertEqual(self.node_model.objects.count(), 3)
+            self.assertEqual(self.link_model.objects.count(), 2)
+
+    @mock.patch("openwisp_network_topology.tasks.handle_update_topology.delay")
+    def test_update_partial_diffs_not_superseded(self, mocked_task):
+        # several reporters send partial graphs of the same topology
+        t = self._set_receive(expiration_time=60)
+        self.node_model.objects.all().delete()
+        t.receive(self._load("static/netjson-1-link.json"))
+        t.receive(self._load("static/split-network.json"))
+        self.assertEqual(mocked_task.call_count, 2)
+        (pk1, diff1, sequence1), _ = mocked_task.call_args_list[0]
+        (pk2, diff2, sequence2), _ = mocked_task.call_args_list[1]
+        self.assertIsNone(sequence1)
+        self.assertIsNone(sequence2)
+        handle_update_topology(pk1, diff1, sequence1)
+        handle_update_topology(pk2, diff2, sequence2)
+        self.assertEqual(self.node_model.objects.count(), 4)
+        self.assertEqual(self.link_model.objects.filter(status="up").count(), 2)
+
+    def test_update_topology_resolution_queries(self):
+        t = self.topology_model.objects.first()
+        n1, n2 = self._get_nodes()
+        n3 = self._create_node(
+            label="node3",
+            addresses=["192.168.0.3"],
+            topology=t,
+            organization=t.organization,
+        )
+        self._create_link(topology=t, source=n1, target=n2, cost=1.0)
+        self._create_link(topology=t, source=n2, target=n3, cost=1.0)
+        links = [
+            {
+                "source": "192.168.0.2",
+                "target": "192.168.0.1",
+                "cost": 1.0,
+                "cost_text": "one",
+                "properties": {},
+            },
+            {
+                "source": "192.168.0.3",
+                "target": "192.168.0.2",
+                "cost": 1.0,
+                "cost_text": "one",
+                "properties": {},
+            },
+            {
+                "source": "192.168.0.3",
+                "target": "192.168.0.1",
+                "cost": 1.0,
+                "cost_text": "one",
+                "properties": {},
+            },
+        ]
+        diff = {"added": None, "changed": {"links": links}, "removed": None}
+        # nodes and links are loaded once, regardless of the diff
+        # size (the transaction adds the savepoint queries)
+        with self.assertNumQueries(5):
+            t.update_topology(diff)
+        with self.assertNumQueries(0):
+            t.update_topology({"added": None, "changed": None, "removed": None})
+
+    @mock.patch.object(app_settings, "BULK_UPDATE", True)
+    def test_update_topology_atomic(self):
+        t = self._set_receive()
+        self.node_model.objects.all().delete()
+        diff = t.diff(self._load("static/netjson-2-links.json"))
+        handler = mock.Mock()
+        update_topology.connect(handler, sender=self.topology_model)
+        try:
+            with self.captureOnCommitCallbacks(execute=True):
+                with mock.patch.object(
+                    self.link_model.objects,
+                    "bulk_create",
+                    side_effect=DatabaseError("error"),
+                ):
+                    with self.assertRaises(DatabaseError):
+                        t.update_topology(diff)
+        finally:
+            update_topology.disconnect(handler, sender=self.topology_model)
+        # the nodes written before the error have been rolled back
+        self.assertEqual(t.node_set.count(), 0)
+        handler.assert_not_called()
+
+    def test_links_status_changed(self):
+        t = self._set_receive()
+        self.node_model.objects.all().delete()
+        t.receive(self._load("static/netjson-2-links.json"))
+        data = json.loads(self._load("static/netjson-2-links.json"))
+        data["links"] = []
+        handler = mock.Mock()
+        batch_handler = mock.Mock()
+        link_status_changed.connect(handler, sender=self.link_model)
+        links_status_changed.connect(batch_handler, sender=self.link_model)
+        try:
+            with self.captureOnCommitCallbacks(execute=True):
+                t.receive(json.dumps(data))
+            with self.subTest("link saved individually"):
+                link = self.link_model.objects.first()
+                link.status = "up"
+                link.save()
+        finally:
+            link_status_changed.disconnect(handler, sender=self.link_model)
+            links_status_changed.disconnect(batch_handler, sender=self.link_model)
+        self.assertEqual(handler.call_count, 3)
+        self.assertEqual(batch_handler.call_count, 2)
+        kwargs = batch_handler.call_args_list[0].kwargs
+        self.assertEqual(kwargs["status"], "down")
+        self.assertEqual(
+            set(kwargs["link_ids"]),
+            set(self.link_model.objects.values_list("pk", flat=True)),
+        )
+        kwargs = batch_handler.call_args_list[1].kwargs
+        self.assertEqual(kwargs["status"], "up")
+        self.assertEqual(kwargs["link_ids"], [link.pk])
+
+    def _test_update_topology_write_path(self):
+        t = self._set_receive()
+        self.node_model.objects.all().delete()
+        nodes_handler = mock.Mock()
+        topology_handler = mock.Mock()
+        nodes_created.connect(nodes_handler, sender=self.node_model)
+        update_topology.connect(topology_handler, sender=self.topology_model)
+        try:
+            with self.captureOnCommitCallbacks(execute=True):
+                t.update_topology(t.diff(self._load("static/netjson-2-links.json")))
+        finally:
+            nodes_created.disconnect(nodes_handler, sender=self.node_model)
+            update_topology.disconnect(topology_handler, sender=self.topology_model)
+        self.assertEqual(t.node_set.count(), 3)
+        self.assertEqual(t.link_set.filter(status="up").count(), 2)
+        node = self.node_model.get_from_address("10.0.0.3", t)
+        self.assertEqual(node.label, "node3")
+        self.assertEqual(node.addresses, ["192.168.0.3", "10.0.0.3"])
+        link = self.link_model.get_from_nodes("192.168.0.3", "192.168.0.1", t)
+        self.assertEqual(link.cost, 2.0)
+        self.assertEqual(link.properties, {"pretty": False})
+        # one link goes down
+        status_handler = mock.Mock()
+        link_status_changed.connect(status_handler, sender=self.link_model)
+        try:
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                t.update_topology(t.diff(self._load("static/netjson-1-link.json")))
+                # signals are sent only once the transaction is committed
+                self.assertEqual(status_handler.call_count, 0)
+            self.assertTrue(callbacks)
+        finally:
+            link_status_changed.disconnect(status_handler, sender=self.link_model)
+        link.refresh_from_db()
+        self.assertEqual(link.status, "down")
+        self.assertEqual(status_handler.call_count, 1)
+        self.assertEqual(status_handler.call_args.kwargs["link"].pk, link.pk)
+        node = self.node_model.get_from_address("192.168.0.2", t)
+        self.assertEqual(node.addresses, ["192.168.0.2"])
+        self.assertIsNone(self.node_model.get_from_address("10.0.0.2", t))
+        return nodes_handler, topology_handler
+
+    @mock.patch.object(app_settings, "BULK_UPDATE", True)
+    def test_bulk_update_topology(self):
+        nodes_handler, topology_handler = self._test_update_topology_write_path()
+        # the nodes are created in bulk and notified all at once
+        self.assertEqual(nodes_handler.call_count, 1)
+        self.assertEqual(len(nodes_handler.call_args.kwargs["nodes"]), 3)
+        self.assertEqual(topology_handler.call_count, 1)
+
+    @mock.patch.object(app_settings, "BULK_UPDATE", False)
+    def test_update_topology_bulk_disabled(self):
+        nodes_handler, topology_handler = self._test_update_topology_write_path()
+        self.assertEqual(nodes_handler.call_count, 0)
+        # nodes and links are saved one by one, but
+        # update_topology is sent only once on commit
+        self.assertEqual(topology_handler.call_count, 1)
+
     @responses.activate
     def test_update_status_existing_link(self):
         t = self.topology_model.objects.first()
@@ -431,6 +724,83 @@ class TestTopology(CreateOrgMixin, CreateGraphObjectsMixin, LoadMixin, TestCase)
             )
             self.assertEqual(link.cost, 2.0)
 
+    def test_receive_touch_links(self):
+        t = self._set_receive(expiration_time=60)
+        self.node_model.objects.all().delete()
+        data = self._load("static/netjson-2-links.json")
+        with freeze_time(now() - timedelta(seconds=30)):
+            t.receive(data)
+        self.assertEqual(self.link_model.objects.count(), 2)
+        modified = now() - timedelta(seconds=30)
+        self.assertEqual(
+            self.link_model.objects.filter(modified__gt=modified).count(), 0
+        )
+        netjson = t.get_topology_data(data).json(dict=True)
+        handler = mock.Mock()
+        update_topology.connect(handler)
+        t.diff(data)
+        self.assertIsNotNone(t._get_fingerprint())
+        # resolution and update of the links
+        with self.assertNumQueries(2):
+            t._touch_links(netjson["links"])
+        update_topology.disconnect(handler)
+        handler.assert_not_called()
+        # carried over to the new revision
+        fingerprint = t._get_fingerprint()
+        self.assertIsNotNone(fingerprint)
+        self.assertEqual(fingerprint["revision"], t.get_graph_revision())
+        self.assertEqual(
+            self.link_model.objects.filter(modified__gt=modified).count(), 2
+        )
+        with self.subTest("missing links are not touched"):
+            with freeze_time(now() + timedelta(seconds=30)):
+                t.receive(self._load("static/netjson-1-link.json"))
+            self.assertEqual(
+                self.link_model.objects.filter(
+                    modified__gt=now() + timedelta(seconds=10)
+                ).count(),
+                1,
+            )
+
+    def test_receive_unchanged_data_fingerprint(self):
+        t = self._set_receive(expiration_time=60)
+        self.node_model.objects.all().delete()
+        data = json.loads(self._load("static/netjson-1-link.json"))
+        # nodes without label are always reported as changed
+        for node in data["nodes"]:
+            node["label"] = node["id"]
+        data = json.dumps(data)
+        with self.captureOnCommitCallbacks(execute=True):
+            t.receive(data)
+        # stores the fingerprint of the graph
+        t.diff(data)
+        with CaptureQueriesContext(connection) as context:
+            with self.captureOnCommitCallbacks(execute=True):
+                t.receive(data)
+        # the links are resolved and touched, then the task
+        # loads the topology (in a savepoint) to discard the empty diff:
+        # the nodes and links of the graph are not loaded
+        self.assertEqual(len(context.captured_queries), 5)
+        for query in context.captured_queries:
+            self.assertFalse(query["sql"].startswith('SELECT "topology_node"'))
+        fingerprint = t._get_fingerprint()
+        self.assertIsNotNone(fingerprint)
+        self.assertEqual(fingerprint["revision"], t.get_graph_revision())
+
+        with self.subTest("the original expiry is kept"):
+            with freeze_time(now() + timedelta(seconds=app_settings.CACHE_TIMEOUT)):
+                t._touch_links(t.get_topology_data(data).json(dict=True)["links"])
+            self.assertIsNone(t._get_fingerprint())
+
+        with self.subTest("dropped if the graph has been modified"):
+            t.diff(data)
+            fingerprint = t._get_fingerprint()
+            # bumped by the touch and by another write
+            t.bump_graph_revision()
+            t.bump_graph_revision()
+            t._carry_over_fingerprint(fingerprint)
+            self.assertIsNone(t._get_fingerprint())
+
     def test_multiple_receive_split_network(self):
         def _assert_split_topology(self, topology):
             self.assertEqual(self.node_model.objects.count(), 4)
@@ -479,12 +849,194 @@ class TestTopology(CreateOrgMixin, CreateGraphObjectsMixin, LoadMixin, TestCase)
         t = self._set_receive()
         t.save_snapshot()
         s = t.snapshot_set.model.objects.first()
-        self.assertEqual(s.data, t.json())
+        self.assertEqual(s.json(), t.json())
         self.assertEqual(s.topology, t)
         t.save_snapshot()
         s = t.snapshot_set.model.objects.first()
         self.assertFalse(s.created == s.modified)
 
+    @mock.patch.object(app_settings, "SNAPSHOT_KEYFRAME_INTERVAL", 3)
+    def test_save_snapshot_keyframes(self):
+        t = self._set_receive()
+        one_link = self._load("static/netjson-1-link.json")
+        two_links = self._load("static/netjson-2-links.json")
+        graphs = []
+        for day, data in enumerate(
+            [one_link, two_links, two_links, one_link, two_links]
+        ):
+            with freeze_time(f"2024-01-0{day + 1}"):
+                t.receive(data)
+                t.save_snapshot()
+                graphs.append(json.loads(t.json()))
+        snapshots = t.snapshot_set.order_by("date")
+        self.assertEqual(
+            [s.keyframe for s in snapshots], [True, False, False, True, False]
+        )
+
+        def sort_items(graph):
+            for section in ["nodes", "links"]:
+                graph[section].sort(key=json.dumps)
+            return graph
+
+        for snapshot, graph in zip(snapshots, graphs):
+            self.assertEqual(sort_items(json.loads(snapshot.json())), sort_items(graph))
+
+    @mock.patch.object(app_settings, "SNAPSHOT_INTERVAL", 3600)
+    def test_save_snapshot_interval(self):
+        t = self._set_receive()
+        snapshots = t.snapshot_set.order_by("timestamp")
+        with freeze_time("2024-01-01 10:05:00"):
+            t.save_snapshot()
+        with freeze_time("2024-01-01 10:40:00"):
+            t.save_snapshot()
+        self.assertEqual(snapshots.count(), 1)
+        self.assertEqual(snapshots.first().timestamp.minute, 40)
+        with freeze_time("2024-01-01 11:01:00"):
+            t.save_snapshot()
+        self.assertEqual(snapshots.count(), 2)
+
+    @mock.patch.object(app_settings, "SNAPSHOT_INTERVAL", 86400)
+    def test_save_snapshot_interval_local_time(self):
+        t = self._set_receive()
+        snapshots = t.snapshot_set.order_by("timestamp")
+        # UTC+1: the local day starts at 23:00 UTC
+        with timezone.override("Europe/Rome"):
+            with freeze_time("2024-01-01 22:30:00"):
+                t.save_snapshot()
+            with freeze_time("2024-01-01 23:30:00"):
+                t.save_snapshot()
+            with freeze_time("2024-01-02 22:50:00"):
+                t.save_snapshot()
+        self.assertEqual(snapshots.count(), 2)
+        self.assertEqual(
+            [(s.date.day, s.timestamp.hour) for s in snapshots], [(1, 22), (2, 22)]
+        )
+
+    @mock.patch.object(app_settings, "SNAPSHOT_INTERVAL", 3600)
+    @mock.patch.object(app_settings, "SNAPSHOT_KEYFRAME_INTERVAL", 1)
+    def test_prune_snapshots(self):
+        t = self._set_receive()
+        snapshot_model = t.snapshot_set.model
+        one_link = self._load("static/netjson-1-link.json")
+        two_links = self._load("static/netjson-2-links.json")
+        graphs = {}
+        for day in range(1, 4):
+            for hour in [0, 6, 12, 18]:
+                with freeze_time(f"2024-01-0{day} {hour:02}:00:00"):
+                    t.receive(two_links if hour in [6, 18] else one_link)
+                    t.save_snapshot()
+                    graphs[(day, hour)] = json.loads(t.json())
+        self.assertEqual(t.snapshot_set.filter(keyframe=True).count(), 3)
+        # hourly for the last day, daily before
+        retention = [(86400, 3600), (None, 86400)]
+        with freeze_time("2024-01-03 20:00:00"), mock.patch.object(
+            snapshot_model,
+            "get_graph",
+            autospec=True,
+            side_effect=snapshot_model.get_graph,
+        ) as get_graph:
+            self.assertEqual(snapshot_model.prune(t, retention), 6)
+            # the snapshots of the last day are not loaded
+            self.assertEqual(get_graph.call_count, 8)
+            self.assertEqual(snapshot_model.prune(t, retention), 0)
+            self.assertEqual(get_graph.call_count, 8)
+        self.assertEqual(snapshot_model.prune(t, []), 0)
+        snapshots = t.snapshot_set.order_by("timestamp")
+        self.assertEqual(
+            [(s.timestamp.day, s.timestamp.hour) for s in snapshots],
+            [(1, 18), (2, 18), (3, 0), (3, 6), (3, 12), (3, 18)],
+        )
+        # the first snapshot kept has become a keyframe
+        self.assertEqual(
+            [s.keyframe for s in snapshots], [True, False, True, False, False, False]
+        )
+
+        def sort_items(graph):
+            for section in ["nodes", "links"]:
+                graph[section].sort(key=json.dumps)
+            return graph
+
+        for s in snapshots:
+            self.assertEqual(
+                sort_items(json.loads(s.json())),
+                sort_items(graphs[(s.timestamp.day, s.timestamp.hour)]),
+            )
+
+        with self.subTest("save_snapshot_all prunes snapshots"):
+            with mock.patch.object(snapshot_model, "prune") as prune:
+                self.topology_model.save_snapshot_all()
+            prune.assert_called_once_with(t)
+
+    @capture_any_output()
+    def test_save_snapshot_all(self):
+        t = self._set_receive()
+        t2 = self._create_topology(label="test2", organization=t.organization)
+        snapshot_model = t.snapshot_set.model
+        with mock.patch.object(snapshot_model, "save") as save:
+            with freeze_time("2024-01-01 10:00:00"):
+                self.topology_model.save_snapshot_all()
+            with freeze_time("2024-01-01 12:00:00"):
+                self.topology_model.save_snapshot_all()
+            save.assert_not_called()
+        self.assertEqual(snapshot_model.objects.count(), 2)
+        for topology in [t, t2]:
+            s = topology.snapshot_set.get()
+            self.assertEqual(s.json(), topology.json())
+            self.assertEqual(s.timestamp.hour, 12)
+            self.assertEqual(s.modified, s.timestamp)
+        with freeze_time("2024-01-02 10:00:00"):
+            call_command("save_snapshot", label="test2")
+        self.assertEqual(t.snapshot_set.count(), 1)
+        self.assertEqual(t2.snapshot_set.count(), 2)
+
+        with self.subTest("data of the existing snapshots not loaded"):
+            with CaptureQueriesContext(connection) as context:
+                with freeze_time("2024-01-02 12:00:00"):
+                    call_command("save_snapshot", label="test2")
+            table = snapshot_model._meta.db_table
+            selects = [
+                query["sql"]
+                for query in context.captured_queries
+                if query["sql"].startswith("SELECT")
+                and f'FROM "{table}"' in query["sql"]
+            ]
+            self.assertTrue(selects)
+            for sql in selects:
+                self.assertNotIn(f'"{table}"."data"', sql)
+            self.assertEqual(t2.snapshot_set.count(), 2)
+            self.assertEqual(t2.snapshot_set.latest("timestamp").timestamp.hour, 12)
+
+        with self.subTest("failures are logged"):
+            with mock.patch.object(
+                self.topology_model, "json", side_effect=ValueError
+            ), mock.patch(
+                "openwisp_network_topology.contextmanagers.logger.exception"
+            ) as logger_exception:
+                with freeze_time("2024-01-03 10:00:00"):
+                    self.topology_model.save_snapshot_all()
+            self.assertEqual(logger_exception.call_count, 2)
+            self.assertEqual(snapshot_model.objects.count(), 3)
+
+    def test_compress_snapshots(self):
+        t = self._set_receive()
+        t.save_snapshot()
+        snapshot_model = t.snapshot_set.model
+        s = snapshot_model.objects.first()
+        self.assertTrue(s.data.startswith(COMPRESSION_PREFIX))
+        self.assertLess(len(s.data), len(t.json()))
+        # snapshots stored uncompressed by previous versions
+        snapshot_model.objects.bulk_create(
+            [snapshot_model(topology=t, data=t.json()) for _ in range(3)]
+        )
+        stdout = StringIO()
+        call_command("compress_snapshots", chunk_size=2, stdout=stdout)
+        self.assertEqual(
+            stdout.getvalue(), "2 snapshots compressed\n3 snapshots compressed\n"
+        )
+        for s in snapshot_model.objects.all():
+            self.assertTrue(s.data.startswith(COMPRESSION_PREFIX))
+            self.assertEqual(s.json(), t.json())
+
     def test_label_addition(self):
         t = self._set_receive(parser="netdiff.OpenvpnParser")
         t.save()
@@ -556,3 +1108,30 @@ class TestTopology(CreateOrgMixin, CreateGraphObjectsMixin, LoadMixin, TestCase)
             link.refresh_from_db()
             self.assertEqual(link.status, "down")
             self.assertNotEqual(link.modified, modified)
+
+
+class TestTopologyTransaction(
+    CreateOrgMixin, CreateGraphObjectsMixin, TransactionTestCase
+):
+    topology_model = Topology
+    node_model = Node
+
+    @capture_any_output()
+    def test_save_snapshot_all_workers(self):
+        # the worker threads open their own database connections,
+        # which can read only the data which has been committed
+        org = self._create_org()
+        topologies = []
+        for i in range(4):
+            t = self._create_topology(label=f"test{i}", organization=org)
+            self._create_node(
+                label=f"node{i}",
+                addresses=[f"192.168.0.{i}"],
+                topology=t,
+                organization=org,
+            )
+            topologies.append(t)
+        self.topology_model.save_snapshot_all(workers=2)
+        for t in topologies:
+            snapshot = t.snapshot_set.get()
+            self.assertEqual(snapshot.json(), t.json())
@@ -2,15 +2,33 @@ import json
 import sys
 from contextlib import contextmanager
 from datetime import timedelta
+from importlib import reload
 from io import StringIO
+from unittest import mock
+from uuid import uuid4
 
 import responses
 import swapper
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
 from django.core.management import call_command
-from django.test import TestCase
+from django.db import transaction
+from django.db.models import QuerySet
+from django.test import TestCase, override_settings
 from django.utils.timezone import now
 
 from .. import settings as app_settings
+from .. import tasks
+from ..signals import get_pending
+from ..tasks import get_update_lock_key
+from ..utils import (
+    GraphResolver,
+    apply_graph_delta,
+    decode_diff,
+    encode_diff,
+    get_graph_delta,
+)
 from .utils import CreateGraphObjectsMixin, CreateOrgMixin, LoadMixin
 
 Organization = swapper.load_model("openwisp_users", "Organization")
@@ -91,7 +109,8 @@ class TestUtils(CreateGraphObjectsMixin, CreateOrgMixin, LoadMixin, TestCase):
         with redirect_stdout(output):
             self.topology_model.update_all()
 
-        self.assertEqual(self.node_model.objects.count(), 1)
+        # the invalid link aborts the whole update
+        self.assertEqual(self.node_model.objects.count(), 0)
         self.assertEqual(self.link_model.objects.count(), 0)
         self.assertIn("Failed to", output.getvalue())
 
@@ -126,11 +145,175 @@ class TestUtils(CreateGraphObjectsMixin, CreateOrgMixin, LoadMixin, TestCase):
         with redirect_stdout(output):
             call_command("update_topology")
 
-        self.assertEqual(self.node_model.objects.count(), 1)
+        # the invalid link aborts the whole update
+        self.assertEqual(self.node_model.objects.count(), 0)
         self.assertEqual(self.link_model.objects.count(), 0)
         self.assertIn("Failed to", output.getvalue())
 
     @responses.activate
+    def test_update_all_workers(self):
+        t = self.topology_model.objects.first()
+        t.parser = "netdiff.NetJsonParser"
+        t.save()
+        t2 = self._create_topology(
+            organization=t.organization,
+            parser="netdiff.NetJsonParser",
+            url="http://127.0.0.1:9091",
+        )
+        t3 = self._create_topology(
+            organization=t.organization,
+            parser="netdiff.NetJsonParser",
+            url="http://127.0.0.1:9092",
+        )
+        responses.add(
+            responses.GET,
+            "http://127.0.0.1:9090",
+            body=self._load("static/netjson-1-link.json"),
+            content_type="application/json",
+        )
+        responses.add(
+            responses.GET,
+            "http://127.0.0.1:9091",
+            body=self._load("static/netjson-2-links.json"),
+            content_type="application/json",
+        )
+        responses.add(
+            responses.GET,
+            "http://127.0.0.1:9092",
+            body="WRONG",
+            content_type="application/json",
+        )
+        self.node_model.objects.all().delete()
+        output = StringIO()
+        with redirect_stdout(output):
+            call_command("update_topology", workers=3)
+        self.assertEqual(t.node_set.count(), 2)
+        self.assertEqual(t.link_set.count(), 1)
+        self.assertEqual(t2.node_set.count(), 3)
+        self.assertEqual(t2.link_set.count(), 2)
+        self.assertEqual(t3.node_set.count(), 0)
+        self.assertEqual(output.getvalue().count("Failed to perform update"), 1)
+
+    @responses.activate
+    def test_update_all_topologies_task(self):
+        t = self.topology_model.objects.first()
+        t.parser = "netdiff.NetJsonParser"
+        t.save()
+        t2 = self._create_topology(
+            organization=t.organization,
+            parser="netdiff.NetJsonParser",
+            url="http://127.0.0.1:9091",
+        )
+        responses.add(
+            responses.GET,
+            "http://127.0.0.1:9090",
+            body=self._load("static/netjson-1-link.json"),
+            content_type="application/json",
+        )
+        responses.add(
+            responses.GET,
+            "http://127.0.0.1:9091",
+            body=self._load("static/netjson-2-links.json"),
+            content_type="application/json",
+        )
+        self.node_model.objects.all().delete()
+        with mock.patch.object(Link, "delete_expired_links") as delete_expired:
+            call_command("update_topology", celery=True)
+        delete_expired.assert_called_once()
+        self.assertEqual(t.link_set.count(), 1)
+        self.assertEqual(t2.link_set.count(), 2)
+
+        with self.subTest("results aggregated by chord"):
+            self.link_model.objects.all().delete()
+            # the second topology is still being updated
+            cache.add(get_update_lock_key(t2.pk), True)
+            with mock.patch.object(tasks, "DisabledBackend", type("Backend", (), {})):
+                with mock.patch.object(tasks.logger, "info") as info:
+                    with mock.patch.object(app_settings, "SHARED_CACHE", True):
+                        tasks.update_all_topologies.delay()
+            cache.delete(get_update_lock_key(t2.pk))
+            info.assert_any_call(
+                "update_all_topologies: 1 updated, 1 skipped, 0 failed"
+            )
+            self.assertEqual(t.link_set.count(), 1)
+            self.assertEqual(t2.link_set.count(), 0)
+            # lock of the updated topology released
+            self.assertIsNone(cache.get(get_update_lock_key(t.pk)))
+
+        with self.subTest("row locked while applying the changes"):
+            self.link_model.objects.all().delete()
+            with mock.patch.object(
+                QuerySet,
+                "select_for_update",
+                autospec=True,
+                side_effect=QuerySet.select_for_update,
+            ) as select_for_update:
+                with mock.patch.object(app_settings, "SHARED_CACHE", True):
+                    self.assertEqual(tasks.fetch_topology(str(t.pk)), "updated")
+            select_for_update.assert_called_once()
+            self.assertEqual(t.link_set.count(), 1)
+
+        with self.subTest("row locked during the update without a shared cache"):
+            self.link_model.objects.all().delete()
+            with mock.patch.object(
+                QuerySet,
+                "select_for_update",
+                autospec=True,
+                side_effect=QuerySet.select_for_update,
+            ) as select_for_update:
+                self.assertEqual(tasks.fetch_topology(str(t.pk)), "updated")
+            select_for_update.assert_called_once_with(mock.ANY, skip_locked=True)
+            self.assertEqual(t.link_set.count(), 1)
+            self.assertIsNone(cache.get(get_update_lock_key(t.pk)))
+
+        with self.subTest("skipped if the row is locked"):
+            self.link_model.objects.all().delete()
+            with mock.patch.object(
+                QuerySet,
+                "select_for_update",
+                autospec=True,
+                side_effect=lambda qs, **kwargs: qs.none(),
+            ):
+                self.assertEqual(tasks.fetch_topology(str(t.pk)), "skipped")
+                self.assertEqual(tasks.fetch_topology(str(uuid4())), "failed")
+            self.assertEqual(t.link_set.count(), 0)
+
+    @responses.activate
+    def test_cache_timeout_default(self):
+        for backend, timeout in [
+            ("django.core.cache.backends.locmem.LocMemCache", 0),
+            ("django.core.cache.backends.dummy.DummyCache", 0),
+            ("django.core.cache.backends.redis.RedisCache", 86400),
+        ]:
+            with self.subTest(backend):
+                try:
+                    with override_settings(CACHES={"default": {"BACKEND": backend}}):
+                        del settings.OPENWISP_NETWORK_TOPOLOGY_CACHE_TIMEOUT
+                        reload(app_settings)
+                        self.assertEqual(app_settings.CACHE_TIMEOUT, timeout)
+                finally:
+                    reload(app_settings)
+
+    def test_broadcast_debounce_shared_cache(self):
+        for backend, shared in [
+            ("django.core.cache.backends.locmem.LocMemCache", False),
+            ("django.core.cache.backends.redis.RedisCache", True),
+        ]:
+            with self.subTest(backend):
+                try:
+                    with override_settings(
+                        CACHES={"default": {"BACKEND": backend}},
+                        OPENWISP_NETWORK_TOPOLOGY_BROADCAST_DEBOUNCE=1,
+                    ):
+                        if shared:
+                            reload(app_settings)
+                            self.assertTrue(app_settings.SHARED_CACHE)
+                        else:
+                            with self.assertRaises(ImproperlyConfigured):
+                                reload(app_settings)
+                finally:
+                    reload(app_settings)
+
     def test_update_all_method_unpublished(self):
         t = self.topology_model.objects.first()
         t.published = False
@@ -297,3 +480,117 @@ class TestUtils(CreateGraphObjectsMixin, CreateOrgMixin, LoadMixin, TestCase):
         with redirect_stdout(output):
             call_command("save_snapshot")
         self.assertEqual(self.snapshot_model.objects.count(), 1)
+
+    def test_encode_diff(self):
+        t = self.topology_model.objects.first()
+        t.parser = "netdiff.NetJsonParser"
+        t.save()
+        diff = t.diff(self._load("static/netjson-2-links.json"))
+        encoded = encode_diff(diff)
+        self.assertIsInstance(encoded, str)
+        self.assertTrue(encoded.startswith("zlib:"))
+        self.assertEqual(decode_diff(encoded), diff)
+        self.assertLess(len(encoded), len(json.dumps(diff)))
+        with self.subTest("diffs which are not encoded are returned as they are"):
+            self.assertIs(decode_diff(diff), diff)
+
+    def test_graph_resolver_shared_address(self):
+        t = self.topology_model.objects.first()
+        node1 = self.node_model.objects.get(label="node1")
+        node2 = self.node_model.objects.get(label="node2")
+        node2.created += timedelta(seconds=1)
+        for node in [node1, node2]:
+            node.addresses.append("10.0.0.9")
+            node.save()
+        resolver = GraphResolver(t)
+        self.assertEqual(resolver.get_node("10.0.0.9"), node1)
+        node1.addresses = ["192.168.0.1"]
+        resolver.add_node(node1)
+        self.assertEqual(resolver.get_node("10.0.0.9"), node2)
+        node2.addresses = ["192.168.0.2"]
+        resolver.add_node(node2)
+        self.assertIsNone(resolver.get_node("10.0.0.9"))
+        with self.subTest("addresses which are too long to be indexed"):
+            address = "a" * 300
+            node2.addresses = ["192.168.0.2", address]
+            resolver.add_node(node2)
+            self.assertEqual(resolver.get_node(address), node2)
+
+    def test_get_pending(self):
+        calls = []
+
+        class Pending(dict):
+            def __call__(self):
+                calls.append(dict(self))
+
+        with self.subTest("callback is called once on commit"):
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                get_pending("test", Pending)["a"] = 1
+                get_pending("test", Pending)["b"] = 2
+            self.assertEqual(len(callbacks), 1)
+            self.assertEqual(calls, [{"a": 1, "b": 2}])
+
+        with self.subTest("new callback after the commit"):
+            calls.clear()
+            with self.captureOnCommitCallbacks(execute=True):
+                get_pending("test", Pending)["c"] = 3
+            self.assertEqual(calls, [{"c": 3}])
+
+        with self.subTest("callback discarded by a savepoint rollback"):
+            calls.clear()
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                try:
+                    with transaction.atomic():
+                        get_pending("test", Pending)["a"] = 1
+                        raise ValueError()
+                except ValueError:
+                    pass
+                get_pending("test", Pending)["b"] = 2
+            self.assertEqual(len(callbacks), 1)
+            self.assertEqual(calls, [{"b": 2}])
+
+    def test_get_graph_delta(self):
+        old = {
+            "type": "NetworkGraph",
+            "label": "test",
+            "nodes": [{"id": "10.0.0.1"}, {"id": "10.0.0.2"}, {"id": "10.0.0.3"}],
+            "links": [
+                {"source": "10.0.0.1", "target": "10.0.0.2", "cost": 1},
+                {"source": "10.0.0.2", "target": "10.0.0.3", "cost": 1},
+            ],
+        }
+        self.assertIsNone(get_graph_delta(old, json.loads(json.dumps(old))))
+        new = {
+            "type": "NetworkGraph",
+            "label": "changed",
+            "nodes": [
+                {"id": "10.0.0.1", "label": "node1"},
+                {"id": "10.0.0.2"},
+                {"id": "10.0.0.4"},
+            ],
+            "links": [
+                {"source": "10.0.0.1", "target": "10.0.0.2", "cost": 2},
+                {"source": "10.0.0.2", "target": "10.0.0.4", "cost": 1},
+            ],
+        }
+        self.assertEqual(
+            get_graph_delta(old, new),
+            {
+                "graph": {"label": "changed"},
+                "added": {
+                    "nodes": [{"id": "10.0.0.4"}],
+                    "links": [{"source": "10.0.0.2", "target": "10.0.0.4", "cost": 1}],
+                },
+                "removed": {
+                    "nodes": [{"id": "10.0.0.3"}],
+                    "links": [{"source": "10.0.0.2", "target": "10.0.0.3"}],
+                },
+                "changed": {
+                    "nodes": [{"id": "10.0.0.1", "label": "node1"}],
+                    "links": [{"source": "10.0.0.1", "target": "10.0.0.2", "cost": 2}],
+                },
+            },
+        )
+        with self.subTest("apply_graph_delta"):
+            self.assertEqual(apply_graph_delta(old, get_graph_delta(old, new)), new)
+            self.assertEqual(apply_graph_delta(old, None), old)
@@ -1,3 +1,4 @@
+import json
 from unittest.mock import patch
 from uuid import uuid4
 
@@ -6,12 +7,21 @@ from channels.db import database_sync_to_async
 from channels.testing import WebsocketCommunicator
 from django.conf import settings
 from django.contrib.auth.models import Permission
+from django.core.cache import cache
+from django.db import transaction
 from django.utils.module_loading import import_string
 from swapper import load_model
 
 from openwisp_users.tests.utils import TestOrganizationMixin
 
 from .. import settings as app_settings
+from ..signals import (
+    broadcast_state_lock,
+    get_broadcast_lock_key,
+    get_broadcast_state_key,
+    get_delta_subscribers_key,
+)
+from ..tasks import handle_broadcast_topology
 from .utils import CreateGraphObjectsMixin
 
 Topology = load_model("topology", "Topology")
@@ -27,11 +37,11 @@ class TestTopologySockets(CreateGraphObjectsMixin, TestOrganizationMixin):
     topology_model = Topology
     application = import_string(getattr(settings, "ASGI_APPLICATION"))
 
-    async def _get_communicator(self, admin_client, topology_id):
+    async def _get_communicator(self, admin_client, topology_id, query=""):
         session_id = admin_client.cookies["sessionid"].value
         communicator = WebsocketCommunicator(
             self.application,
-            path=f"ws/network-topology/topology/{topology_id}/",
+            path=f"ws/network-topology/topology/{topology_id}/{query}",
             headers=[
                 (
                     b"cookie",
@@ -188,3 +198,255 @@ class TestTopologySockets(CreateGraphObjectsMixin, TestOrganizationMixin):
         assert response["topology"] is not None
         assert response["topology"] == expected_response
         await communicator.disconnect()
+
+    async def test_broadcast_coalesced_in_transaction(self, admin_user, admin_client):
+        org = await database_sync_to_async(self._create_org)()
+        topo = await database_sync_to_async(self._create_topology)(organization=org)
+        communicator = await self._get_communicator(admin_client, topo.pk)
+        connected, _ = await communicator.connect()
+        assert connected is True
+
+        def _create_graph():
+            with transaction.atomic():
+                node1 = self._create_node(
+                    topology=topo, label="node-0", organization=org
+                )
+                node2 = self._create_node(
+                    topology=topo,
+                    label="node-1",
+                    addresses=["192.168.0.2"],
+                    organization=org,
+                )
+                self._create_link(
+                    topology=topo, source=node1, target=node2, organization=org
+                )
+
+        await database_sync_to_async(_create_graph)()
+        expected_response = await database_sync_to_async(topo.json)()
+        response = await communicator.receive_json_from()
+        assert response["topology"] == expected_response
+        assert len(json.loads(response["topology"])["nodes"]) == 2
+        assert await communicator.receive_nothing() is True
+        await communicator.disconnect()
+
+    @patch.object(app_settings, "BROADCAST_DEBOUNCE", 5)
+    async def test_broadcast_debounce(self, admin_user, admin_client):
+        org = await database_sync_to_async(self._create_org)()
+        topo = await database_sync_to_async(self._create_topology)(organization=org)
+        await database_sync_to_async(cache.delete)(get_broadcast_lock_key(topo.pk))
+        communicator = await self._get_communicator(admin_client, topo.pk)
+        connected, _ = await communicator.connect()
+        assert connected is True
+        with patch.object(handle_broadcast_topology, "apply_async") as mocked:
+            await database_sync_to_async(self._create_node)(
+                topology=topo, label="node-0", organization=org
+            )
+            await database_sync_to_async(self._create_node)(
+                topology=topo,
+                label="node-1",
+                addresses=["192.168.0.2"],
+                organization=org,
+            )
+        mocked.assert_called_once_with((topo.pk,), countdown=5)
+        assert await communicator.receive_nothing() is True
+        await database_sync_to_async(handle_broadcast_topology)(topo.pk)
+        expected_response = await database_sync_to_async(topo.json)()
+        response = await communicator.receive_json_from()
+        assert response["topology"] == expected_response
+        assert (
+            await database_sync_to_async(cache.get)(get_broadcast_lock_key(topo.pk))
+            is None
+        )
+        await communicator.disconnect()
+
+    async def test_topology_delta_update(self, admin_user, admin_client):
+        org = await database_sync_to_async(self._create_org)()
+        topo = await database_sync_to_async(self._create_topology)(organization=org)
+        node1 = await database_sync_to_async(self._create_node)(
+            topology=topo, label="node-0", organization=org
+        )
+        communicator = await self._get_communicator(
+            admin_client, topo.pk, query="?format=delta"
+        )
+        connected, _ = await communicator.connect()
+        assert connected is True
+        full_communicator = await self._get_communicator(admin_client, topo.pk)
+        connected, _ = await full_communicator.connect()
+        assert connected is True
+        response = await communicator.receive_json_from()
+        assert response["type"] == "topology_snapshot"
+        revision = response["revision"]
+        assert [node["id"] for node in response["topology"]["nodes"]] == ["192.168.0.1"]
+        node2 = await database_sync_to_async(self._create_node)(
+            topology=topo,
+            label="node-1",
+            addresses=["192.168.0.2"],
+            organization=org,
+        )
+        response = await communicator.receive_json_from()
+        assert response["type"] == "topology_delta"
+        assert response["base_revision"] == revision
+        assert response["revision"] > revision
+        revision = response["revision"]
+        delta = response["delta"]
+        assert [node["id"] for node in delta["added"]["nodes"]] == ["192.168.0.2"]
+        assert delta["changed"] == {"nodes": [], "links": []}
+        assert delta["removed"] == {"nodes": [], "links": []}
+        response = await full_communicator.receive_json_from()
+        assert response["type"] == "broadcast_topology"
+        assert await full_communicator.receive_nothing() is True
+        await database_sync_to_async(self._create_link)(
+            topology=topo, source=node1, target=node2, organization=org
+        )
+        response = await communicator.receive_json_from()
+        assert response["base_revision"] == revision
+        assert response["revision"] > revision
+        revision = response["revision"]
+        assert len(response["delta"]["added"]["links"]) == 1
+        await node2.adelete()
+        response = await communicator.receive_json_from()
+        assert response["base_revision"] == revision
+        assert response["revision"] > revision
+        revision = response["revision"]
+        assert response["delta"]["removed"] == {
+            "nodes": [{"id": "192.168.0.2"}],
+            "links": [{"source": "192.168.0.1", "target": "192.168.0.2"}],
+        }
+        # clients which miss a revision can request the whole graph
+        await communicator.send_json_to({"type": "resync"})
+        response = await communicator.receive_json_from()
+        assert response["type"] == "topology_snapshot"
+        assert response["revision"] == revision
+        expected_response = await database_sync_to_async(topo.json)()
+        assert response["topology"] == json.loads(expected_response)
+        await communicator.disconnect()
+        await full_communicator.disconnect()
+
+    async def test_topology_delta_subscribers(self, admin_user, admin_client):
+        org = await database_sync_to_async(self._create_org)()
+        topo = await database_sync_to_async(self._create_topology)(organization=org)
+        subscribers_key = get_delta_subscribers_key(topo.pk)
+        state_key = get_broadcast_state_key(topo.pk)
+        communicator = await self._get_communicator(
+            admin_client, topo.pk, query="?format=delta"
+        )
+        connected, _ = await communicator.connect()
+        assert connected is True
+        response = await communicator.receive_json_from()
+        assert response["type"] == "topology_snapshot"
+        assert await database_sync_to_async(cache.get)(subscribers_key) == 1
+        lock_key = f"topology-broadcast-state-lock-{topo.pk}"
+        await database_sync_to_async(cache.add)(lock_key, True)
+
+        # concurrent broadcasts are serialized, the
+        # lock is released by the other broadcast
+        with patch(
+            "openwisp_network_topology.signals.sleep",
+            side_effect=lambda seconds: cache.delete(lock_key),
+        ) as mocked_sleep:
+            await database_sync_to_async(self._create_node)(
+                topology=topo, label="node-0", organization=org
+            )
+        mocked_sleep.assert_called_once()
+        response = await communicator.receive_json_from()
+        assert response["type"] == "topology_delta"
+        assert await database_sync_to_async(cache.get)(lock_key) is None
+
+        # the wait is bounded: a snapshot is sent if the lock is not released
+        await database_sync_to_async(cache.add)(lock_key, "other")
+        with patch("openwisp_network_topology.signals.STATE_LOCK_WAIT", 0):
+            await database_sync_to_async(self._create_node)(
+                topology=topo,
+                label="node-2",
+                addresses=["192.168.0.3"],
+                organization=org,
+            )
+        response = await communicator.receive_json_from()
+        assert response["type"] == "topology_snapshot"
+        assert len(response["topology"]["nodes"]) == 2
+        # the lock of the other broadcast is not released
+        assert await database_sync_to_async(cache.get)(lock_key) == "other"
+        await database_sync_to_async(cache.delete)(lock_key)
+
+        # an expired lock acquired by another broadcast is not released
+        def expire_lock():
+            with broadcast_state_lock(topo.pk) as acquired:
+                assert acquired is True
+                cache.set(lock_key, "other")
+
+        await database_sync_to_async(expire_lock)()
+        assert await database_sync_to_async(cache.get)(lock_key) == "other"
+        await database_sync_to_async(cache.delete)(lock_key)
+
+        await communicator.disconnect()
+        assert await database_sync_to_async(cache.get)(subscribers_key) == 0
+        assert await database_sync_to_async(cache.get)(state_key) is not None
+        with patch("openwisp_network_topology.signals.get_graph_delta") as mocked:
+            await database_sync_to_async(self._create_node)(
+                topology=topo,
+                label="node-1",
+                addresses=["192.168.0.2"],
+                organization=org,
+            )
+        mocked.assert_not_called()
+        assert await database_sync_to_async(cache.get)(state_key) is None
+
+    async def test_topology_delta_subscribers_expired(self, admin_user, admin_client):
+        org = await database_sync_to_async(self._create_org)()
+        topo = await database_sync_to_async(self._create_topology)(organization=org)
+        subscribers_key = get_delta_subscribers_key(topo.pk)
+        communicator = await self._get_communicator(
+            admin_client, topo.pk, query="?format=delta"
+        )
+        connected, _ = await communicator.connect()
+        assert connected is True
+        response = await communicator.receive_json_from()
+        revision = response["revision"]
+        # the number of subscribers expired
+        await database_sync_to_async(cache.delete)(subscribers_key)
+        node = await database_sync_to_async(self._create_node)(
+            topology=topo, label="node-0", organization=org
+        )
+        response = await communicator.receive_json_from()
+        assert response["type"] == "topology_snapshot"
+        assert response["revision"] > revision
+        revision = response["revision"]
+        # counted again when the snapshot is received
+        assert await database_sync_to_async(cache.get)(subscribers_key) == 1
+        node.label = "node-1"
+        await node.asave()
+        # the state is initialized again
+        response = await communicator.receive_json_from()
+        assert response["type"] == "topology_snapshot"
+        assert response["revision"] > revision
+        revision = response["revision"]
+        node.label = "node-2"
+        await node.asave()
+        response = await communicator.receive_json_from()
+        assert response["type"] == "topology_delta"
+        assert response["base_revision"] == revision
+        revision = response["revision"]
+
+        with patch.object(app_settings, "CACHE_TIMEOUT", 0):
+            node.label = "node-3"
+            await node.asave()
+            response = await communicator.receive_json_from()
+            assert response["type"] == "topology_snapshot"
+            assert response["revision"] > revision
+        await communicator.disconnect()
+        assert await database_sync_to_async(cache.get)(subscribers_key) == 0
+
+    async def test_topology_resync_full_format(self, admin_user, admin_client):
+        org = await database_sync_to_async(self._create_org)()
+        topo = await database_sync_to_async(self._create_topology)(organization=org)
+        communicator = await self._get_communicator(admin_client, topo.pk)
+        connected, _ = await communicator.connect()
+        assert connected is True
+        await communicator.send_to(text_data="invalid")
+        assert await communicator.receive_nothing() is True
+        await communicator.send_json_to({"type": "resync"})
+        response = await communicator.receive_json_from()
+        expected_response = await database_sync_to_async(topo.json)()
+        assert response["type"] == "broadcast_topology"
+        assert response["topology"] == expected_response
+        await communicator.disconnect()
@@ -1,15 +1,31 @@
+import json
+import logging
 import sys
+import zlib
+from base64 import b64decode, b64encode
+from collections import OrderedDict, defaultdict
+from hashlib import md5
 
+import swapper
 from django.core.exceptions import ValidationError
 from django.dispatch import Signal
 from django.http import Http404
 from django.shortcuts import get_object_or_404 as get_obj_or_404
 from django.urls import path, re_path
+from rest_framework.utils.encoders import JSONEncoder
+
+logger = logging.getLogger(__name__)
 
 link_status_changed = Signal()
 link_status_changed.__doc__ = """
 Providing arguments: ['link']
 """
+links_status_changed = Signal()
+links_status_changed.__doc__ = """
+Sent once for all the links of a topology whose status
+has changed to ``status`` in the same transaction
+Providing arguments: ['link_ids', 'status']
+"""
 
 
 def print_info(message):  # pragma no cover
@@ -20,6 +36,283 @@ def print_info(message):  # pragma no cover
         print("{0}\n".format(message))
 
 
+class GraphResolver(object):
+    """
+    Loads all the nodes and links of a topology once and
+    resolves them from their addresses without hitting
+    the database again (used when applying a diff)
+    """
+
+    def __init__(self, topology):
+        self.topology = topology
+        NodeAddress = swapper.load_model("topology", "NodeAddress")
+        self.nodes = OrderedDict()
+        for node in topology.node_model.objects.filter(topology=topology).order_by(
+            "created"
+        ):
+            node.topology = topology
+            self.nodes[node.pk] = node
+        self.max_length = NodeAddress._meta.get_field("address").max_length
+        self.addresses = {}
+        self.node_addresses = defaultdict(set)
+        for address, node_id in (
+            NodeAddress.objects.filter(topology=topology)
+            .order_by("node__created", "node_id")
+            .values_list("address", "node_id")
+        ):
+            if node_id in self.nodes:
+                # addresses shared by more nodes resolve to the oldest node
+                self.addresses.setdefault(address, node_id)
+                self.node_addresses[node_id].add(address)
+        self.links = {}
+        for link in topology.link_model.objects.filter(topology=topology).order_by(
+            "created"
+        ):
+            self._set_link_relations(link)
+            self.links.setdefault(self._get_link_key(link), link)
+
+    @staticmethod
+    def _get_link_key(link):
+        return frozenset((link.source_id, link.target_id))
+
+    def _set_link_relations(self, link):
+        link.topology = self.topology
+        if link.source_id in self.nodes:
+            link.source = self.nodes[link.source_id]
+        if link.target_id in self.nodes:
+            link.target = self.nodes[link.target_id]
+
+    def _get_node_id(self, address):
+        if len(address) > self.max_length:
+            # addresses too long to be indexed
+            for node in self.nodes.values():
+                if address in (node.addresses or []):
+                    return node.pk
+            return None
+        return self.addresses.get(address)
+
+    def get_node(self, address):
+        """
+        returns the node which has ``address`` or ``None``
+        """
+        node_id = self._get_node_id(address)
+        if node_id is None:
+            return None
+        return self.nodes[node_id]
+
+    def get_link(self, source, target):
+        """
+        returns the link between the nodes having the
+        ``source`` and ``target`` addresses (or vice versa)
+        """
+        source_id = self._get_node_id(source)
+        target_id = self._get_node_id(target)
+        if source_id is None or target_id is None:
+            return None
+        return self.links.get(frozenset((source_id, target_id)))
+
+    def add_node(self, node):
+        """
+        registers a new or modified node,
+        mirrors the behaviour of ``Node.sync_addresses``
+        """
+        self.nodes[node.pk] = node
+        addresses = node.addresses or []
+        indexed = self.node_addresses[node.pk]
+        for address in indexed.difference(addresses):
+            indexed.discard(address)
+            if self.addresses[address] != node.pk:
+                continue
+            # the address moves to the oldest node which still has it
+            for node_id, node_addresses in self.node_addresses.items():
+                if address in node_addresses:
+                    self.addresses[address] = node_id
+                    break
+            else:
+                del self.addresses[address]
+        for address in addresses:
+            if not isinstance(address, str) or len(address) > self.max_length:
+                continue
+            self.addresses.setdefault(address, node.pk)
+            indexed.add(address)
+
+    def add_link(self, link):
+        """
+        registers a new link
+        """
+        self.links.setdefault(self._get_link_key(link), link)
+
+
+def _get_digest(*values):
+    data = json.dumps(values, sort_keys=True, cls=JSONEncoder)
+    return md5(data.encode()).digest()
+
+
+def get_node_digest(node):
+    """
+    returns the content hash of a NetJSON node
+    """
+    return _get_digest(
+        node.get("label"), node.get("local_addresses"), node.get("properties")
+    )
+
+
+def get_link_digest(link):
+    """
+    returns the content hash of a NetJSON link
+    """
+    cost = link.get("cost")
+    # the cost is stored as a float: 1 and 1.0 are the same cost
+    if isinstance(cost, int):
+        cost = float(cost)
+    return _get_digest(cost, link.get("cost_text"), link.get("properties"))
+
+
+def get_link_key(link):
+    """
+    links are not directed, the order of source and target is irrelevant
+    """
+    return frozenset((link["source"], link["target"]))
+
+
+def get_graph_fingerprint(netjson):
+    """
+    returns the content hashes of the nodes and links of a
+    NetJSON NetworkGraph dict, which allow to compute differences
+    without keeping the whole graph around
+    """
+    return {
+        "nodes": {node["id"]: get_node_digest(node) for node in netjson["nodes"]},
+        "links": {
+            get_link_key(link): get_link_digest(link) for link in netjson["links"]
+        },
+    }
+
+
+COMPRESSION_PREFIX = "zlib:"
+
+
+def compress(text):
+    """
+    returns ``text`` compressed and encoded in base64,
+    prefixed with ``COMPRESSION_PREFIX``
+    """
+    return COMPRESSION_PREFIX + b64encode(zlib.compress(text.encode())).decode()
+
+
+def decompress(text):
+    """
+    inverse of ``compress``, text which
+    is not compressed is returned unchanged
+    """
+    if not is_compressed(text):
+        return text
+    return zlib.decompress(b64decode(text.split(":", 1)[1])).decode()
+
+
+def is_compressed(text):
+    return text.startswith(COMPRESSION_PREFIX)
+
+
+def encode_diff(diff):
+    """
+    returns ``diff`` serialized as JSON, compressed and encoded
+    in base64, which makes it suitable for Celery messages
+    """
+    data = json.dumps(diff, cls=JSONEncoder, separators=(",", ":"))
+    encoded = compress(data)
+    logger.debug(f"Diff of {len(data)} bytes encoded in {len(encoded)} bytes")
+    return encoded
+
+
+def decode_diff(data):
+    """
+    inverse of ``encode_diff``, diffs which
+    are not encoded are returned unchanged
+    """
+    if not isinstance(data, str) or not is_compressed(data):
+        return data
+    return json.loads(decompress(data), object_pairs_hook=OrderedDict)
+
+
+def _get_item_key(section, item):
+    if section == "nodes":
+        return item["id"]
+    return (item["source"], item["target"])
+
+
+def _get_item_id(section, item):
+    if section == "nodes":
+        return {"id": item["id"]}
+    return {"source": item["source"], "target": item["target"]}
+
+
+def get_graph_delta(old, new):
+    """
+    returns the structural difference between two NetJSON
+    NetworkGraph dicts or ``None`` if they're equal:
+    added and changed items are returned in full, removed
+    items are identified by their ``id`` (nodes) or
+    ``source`` and ``target`` (links); ``graph`` contains
+    the top level attributes which have changed
+    """
+    delta = OrderedDict(
+        (
+            ("graph", {}),
+            ("added", {"nodes": [], "links": []}),
+            ("removed", {"nodes": [], "links": []}),
+            ("changed", {"nodes": [], "links": []}),
+        )
+    )
+    changed = False
+    for key, value in new.items():
+        if key not in ["nodes", "links"] and old.get(key) != value:
+            delta["graph"][key] = value
+            changed = True
+    for section in ["nodes", "links"]:
+        old_items = OrderedDict(
+            (_get_item_key(section, item), item) for item in old.get(section, [])
+        )
+        for item in new.get(section, []):
+            old_item = old_items.pop(_get_item_key(section, item), None)
+            if old_item is None:
+                delta["added"][section].append(item)
+            elif old_item != item:
+                delta["changed"][section].append(item)
+            else:
+                continue
+            changed = True
+        for item in old_items.values():
+            delta["removed"][section].append(_get_item_id(section, item))
+            changed = True
+    return delta if changed else None
+
+
+def apply_graph_delta(graph, delta):
+    """
+    inverse of ``get_graph_delta``: returns the NetJSON
+    NetworkGraph dict obtained by applying ``delta`` to
+    ``graph`` (added items are appended at the end)
+    """
+    new = OrderedDict(graph)
+    if delta is None:
+        return new
+    new.update(delta["graph"])
+    for section in ["nodes", "links"]:
+        removed = {_get_item_key(section, item) for item in delta["removed"][section]}
+        changed = {
+            _get_item_key(section, item): item for item in delta["changed"][section]
+        }
+        items = []
+        for item in graph.get(section, []):
+            key = _get_item_key(section, item)
+            if key not in removed:
+                items.append(changed.get(key, item))
+        items.extend(delta["added"][section])
+        new[section] = items
+    return new
+
+
 def get_object_or_404(model, pk, **kwargs):
     """
     retrieves topology with specified arguments or raises 404
@@ -51,6 +344,11 @@ def get_api_urls(views_module):
             views_module.network_graph_history,
             name="network_graph_history",
         ),
+        path(
+            "network-topology/topology/<uuid:pk>/history/diff/",
+            views_module.network_graph_history_diff,
+            name="network_graph_history_diff",
+        ),
         path(
             "network-topology/topology/<uuid:pk>/receive/",
             views_module.receive_topology,
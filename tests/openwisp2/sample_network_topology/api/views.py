@@ -5,6 +5,9 @@ from openwisp_network_topology.api.views import (
 from openwisp_network_topology.api.views import (
     NetworkCollectionView as BaseNetworkCollectionView,
 )
+from openwisp_network_topology.api.views import (
+    NetworkGraphHistoryDiffView as BaseNetworkGraphHistoryDiffView,
+)
 from openwisp_network_topology.api.views import (
     NetworkGraphHistoryView as BaseNetworkGraphHistoryView,
 )
@@ -34,6 +37,10 @@ class NetworkGraphHistoryView(BaseNetworkGraphHistoryView):
     pass
 
 
+class NetworkGraphHistoryDiffView(BaseNetworkGraphHistoryDiffView):
+    pass
+
+
 class NodeListCreateView(BaseNodeListCreateView):
     pass
 
@@ -53,6 +60,7 @@ class LinkDetailView(BaseLinkDetailView):
 network_collection = NetworkCollectionView.as_view()
 network_graph = NetworkGraphView.as_view()
 network_graph_history = NetworkGraphHistoryView.as_view()
+network_graph_history_diff = NetworkGraphHistoryDiffView.as_view()
 receive_topology = ReceiveTopologyView.as_view()
 node_list = NodeListCreateView.as_view()
 node_detail = NodeDetailView.as_view()
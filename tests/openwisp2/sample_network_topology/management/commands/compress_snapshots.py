@@ -0,0 +1,5 @@
+from openwisp_network_topology.management.commands import BaseCompressSnapshotsCommand
+
+
+class Command(BaseCompressSnapshotsCommand):
+    pass
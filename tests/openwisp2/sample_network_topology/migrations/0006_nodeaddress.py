@@ -0,0 +1,57 @@
+import uuid
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from openwisp_network_topology.migrations import populate_node_addresses
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sample_network_topology", "0005_migrate_to_django_jsonfield"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="NodeAddress",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                ("address", models.CharField(max_length=255, verbose_name="address")),
+                ("details", models.CharField(blank=True, max_length=64, null=True)),
+                (
+                    "node",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="address_set",
+                        to="sample_network_topology.node",
+                    ),
+                ),
+                (
+                    "topology",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="sample_network_topology.topology",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "node address",
+                "verbose_name_plural": "node addresses",
+                "abstract": False,
+                "unique_together": {("topology", "address")},
+            },
+        ),
+        migrations.RunPython(
+            populate_node_addresses, reverse_code=migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,20 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sample_network_topology", "0006_nodeaddress"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="snapshot",
+            name="keyframe",
+            field=models.BooleanField(
+                default=True,
+                help_text="whether the whole graph is stored or only the changes since the previous snapshot",
+                verbose_name="keyframe",
+            ),
+        ),
+    ]
@@ -1,7 +1,7 @@
 from django.db import models
 
 from openwisp_network_topology.base.link import AbstractLink
-from openwisp_network_topology.base.node import AbstractNode
+from openwisp_network_topology.base.node import AbstractNode, AbstractNodeAddress
 from openwisp_network_topology.base.snapshot import AbstractSnapshot
 from openwisp_network_topology.base.topology import AbstractTopology
 
@@ -23,6 +23,11 @@ class Node(DetailsModel, AbstractNode):
         abstract = False
 
 
+class NodeAddress(DetailsModel, AbstractNodeAddress):
+    class Meta(AbstractNodeAddress.Meta):
+        abstract = False
+
+
 class Snapshot(DetailsModel, AbstractSnapshot):
     class Meta(AbstractSnapshot.Meta):
         abstract = False
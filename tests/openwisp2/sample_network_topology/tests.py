@@ -11,6 +11,9 @@ from openwisp_network_topology.tests.test_snapshot import (
 from openwisp_network_topology.tests.test_topology import (
     TestTopology as BaseTestTopology,
 )
+from openwisp_network_topology.tests.test_topology import (
+    TestTopologyTransaction as BaseTestTopologyTransaction,
+)
 from openwisp_network_topology.tests.test_upgrader_script import (
     TestUpgradeFromDjangoNetjsongraph as BaseTestUpgradeFromDjangoNetjsongraph,
 )
@@ -48,6 +51,10 @@ class TestTopology(BaseTestTopology):
     pass
 
 
+class TestTopologyTransaction(BaseTestTopologyTransaction):
+    pass
+
+
 class TestUtils(BaseTestUtils):
     pass
 
@@ -75,6 +82,7 @@ del BaseTestLink
 del BaseTestNode
 del BaseTestSnapshot
 del BaseTestTopology
+del BaseTestTopologyTransaction
 del BaseTestUtils
 del BaseTestVisualizer
 del BaseTestUpgradeFromDjangoNetjsongraph
@@ -196,6 +196,9 @@ TIMESERIES_DATABASE = {
 CELERY_TASK_ALWAYS_EAGER = True
 CELERY_TASK_EAGER_PROPAGATES = True
 CELERY_BROKER_URL = "memory://"
+# the tests run the Celery tasks in the same process,
+# hence the cache can be local to the process
+OPENWISP_NETWORK_TOPOLOGY_CACHE_TIMEOUT = 86400
 
 if not TESTING and any(["shell" in sys.argv, "shell_plus" in sys.argv]):
     LOGGING.update(
@@ -240,6 +243,7 @@ if os.environ.get("SAMPLE_APP", False):
     ]
     TOPOLOGY_LINK_MODEL = "sample_network_topology.Link"
     TOPOLOGY_NODE_MODEL = "sample_network_topology.Node"
+    TOPOLOGY_NODEADDRESS_MODEL = "sample_network_topology.NodeAddress"
     TOPOLOGY_SNAPSHOT_MODEL = "sample_network_topology.Snapshot"
     TOPOLOGY_TOPOLOGY_MODEL = "sample_network_topology.Topology"
     TOPOLOGY_DEVICE_DEVICENODE_MODEL = "sample_integration_device.DeviceNode"